@@ -0,0 +1,288 @@
+"""上游调用的准入控制：按客户端限流、有界优先级队列、按截止时间提前拒绝、熔断
+
+    RateLimiter        每个客户端一个令牌桶，超出速率返回429
+    UpstreamScheduler  同时在途的上游请求数有上限，其余请求按优先级排队；队列已满、
+                       预计等待超过截止时间或排队超时时返回503，而不是等到上游超时
+    CircuitBreaker     最近一段时间上游失败率过高时熔断，冷却期内直接返回503，
+                       冷却结束后放行少量探测请求，成功则恢复
+
+拒绝时抛出AdmissionError，status_code与retry_after用于HTTP响应。
+"""
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+
+from metrics import metrics
+
+# 数值越小越优先：交互式聊天 > 连通性测试等后台请求 > 批量任务
+PRIORITIES = {"interactive": 0, "background": 1, "batch": 2}
+
+
+class AdmissionError(Exception):
+    """请求未被准入（限流、过载或熔断）"""
+
+    def __init__(self, message, status_code=503, retry_after=1.0, reason="overloaded"):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.reason = reason
+
+    @property
+    def headers(self):
+        return {"Retry-After": str(max(1, int(self.retry_after + 0.999)))}
+
+
+def _reject(message, status_code, retry_after, reason):
+    metrics.incr("admission_rejected", reason)
+    return AdmissionError(message, status_code, retry_after, reason)
+
+
+class RateLimiter:
+    """按客户端的令牌桶：平均每秒rate个请求，允许burst个突发；rate为0时不限流"""
+
+    def __init__(self, rate=2.0, burst=10, max_clients=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()  # 客户端 -> (令牌数, 更新时间)，按最近使用排序
+        self._lock = threading.Lock()
+
+    def check(self, client):
+        if self.rate <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            allowed = tokens >= 1
+            self._buckets[client] = (tokens - 1 if allowed else tokens, now)
+            # 长时间不活跃的客户端令牌桶已满，淘汰后重新创建结果相同
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        if not allowed:
+            raise _reject("请求过于频繁，请稍后再试", 429, (1 - tokens) / self.rate, "rate_limit")
+
+    def stats(self):
+        return {"rate": self.rate, "burst": self.burst, "clients": len(self._buckets)}
+
+
+class CircuitBreaker:
+    """按最近window秒内的上游调用结果熔断
+
+    调用数不少于min_requests且失败率不低于error_rate时打开，cooldown秒后进入半开状态，
+    放行half_open_probes个探测请求：探测成功则关闭，失败则重新打开。
+    探测名额在call()退出时归还，探测请求被取消或抛出其他异常时同样归还。
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, window=30.0, min_requests=20, error_rate=0.5, cooldown=10.0, half_open_probes=1):
+        self.window = window
+        self.min_requests = min_requests
+        self.error_rate = error_rate
+        self.cooldown = cooldown
+        self.half_open_probes = half_open_probes
+        self._results = deque()  # (时间, 是否成功)
+        self._failures = 0
+        self._opened_at = None
+        self._probes = 0
+        self._lock = threading.Lock()
+        self.opened = 0
+
+    @property
+    def state(self):
+        if self._opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self._opened_at < self.cooldown:
+            return self.OPEN
+        return self.HALF_OPEN
+
+    def check(self):
+        """熔断打开时抛出AdmissionError（不占用探测名额，用于提前拒绝）"""
+        if self.state == self.OPEN:
+            remaining = self.cooldown - (time.monotonic() - self._opened_at)
+            raise _reject("上游服务暂时不可用（已熔断），请稍后再试", 503, remaining, "circuit_open")
+
+    def acquire(self):
+        """每次调用上游之前调用，占用了探测名额时返回True；半开状态下超出探测名额的请求同样被拒绝"""
+        with self._lock:
+            state = self.state
+            if state == self.HALF_OPEN:
+                if self._probes >= self.half_open_probes:
+                    raise _reject("上游服务恢复中，请稍后再试", 503, 1.0, "circuit_open")
+                self._probes += 1
+                return True
+        if state == self.OPEN:
+            self.check()
+        return False
+
+    def release(self):
+        """归还acquire()占用的探测名额"""
+        with self._lock:
+            self._probes = max(0, self._probes - 1)
+
+    @contextmanager
+    def call(self):
+        """包住一次上游调用：进入时acquire()，退出时无论结果如何都归还探测名额"""
+        probe = self.acquire()
+        try:
+            yield
+        finally:
+            if probe:
+                self.release()
+
+    def _open(self, now):
+        self._opened_at = now
+        self.opened += 1
+        metrics.incr("circuit_opened")
+
+    def record(self, ok):
+        now = time.monotonic()
+        with self._lock:
+            if self._opened_at is not None:
+                if now - self._opened_at < self.cooldown:
+                    return  # 熔断之前发出的请求，结果不再计入
+                # 半开状态下的探测结果决定关闭还是重新打开
+                if ok:
+                    self._opened_at = None
+                    self._results.clear()
+                    self._failures = 0
+                else:
+                    self._open(now)
+                return
+
+            self._results.append((now, ok))
+            self._failures += not ok
+            while self._results and now - self._results[0][0] > self.window:
+                self._failures -= not self._results.popleft()[1]
+            total = len(self._results)
+            if total >= self.min_requests and self._failures / total >= self.error_rate:
+                self._open(now)
+
+    def stats(self):
+        with self._lock:
+            total = len(self._results)
+            return {
+                "state": self.state,
+                "requests": total,
+                "error_rate": round(self._failures / total, 4) if total else 0.0,
+                "opened": self.opened,
+            }
+
+
+class UpstreamScheduler:
+    """限制同时在途的上游请求数，超出的请求按 (优先级, 到达顺序) 排队
+
+    max_queue为None时队列不限长度；队列已满时新请求挤出优先级更低的排队请求，没有更低的则被拒绝。
+    平均占用时间按指数移动平均估计，预计等待时间超过请求的截止时间时直接拒绝。
+    """
+
+    def __init__(self, max_concurrency=32, max_queue=None, queue_timeout=None):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout  # 未指定截止时间的请求最多排队的秒数
+        self.active = 0
+        self.service_time = None  # 每个请求占用名额的平均秒数
+        self._heap = []  # (优先级, 序号, future)
+        self._waiting = 0
+        self._counter = itertools.count()
+
+    def _deadline(self, deadline):
+        if deadline is None and self.queue_timeout:
+            return time.monotonic() + self.queue_timeout
+        return deadline
+
+    def estimated_wait(self, priority):
+        """按排在前面的请求数估计排队时间（秒）"""
+        if self.active < self.max_concurrency and not self._waiting:
+            return 0.0
+        if self.service_time is None:
+            return 0.0
+        ahead = sum(1 for p, _, future in self._heap if p <= priority and not future.done())
+        return (ahead + 1) * self.service_time / self.max_concurrency
+
+    def check(self, priority=0, deadline=None):
+        """不排队地检查请求现在能否被准入，不能时抛出AdmissionError"""
+        if self.active < self.max_concurrency and not self._waiting:
+            return
+        if self.max_queue is not None and self._waiting >= self.max_queue and self._lowest(priority) is None:
+            raise _reject("服务繁忙，请稍后再试", 503, self.service_time or 1.0, "queue_full")
+        deadline = self._deadline(deadline)
+        if deadline is not None:
+            wait = self.estimated_wait(priority)
+            if time.monotonic() + wait > deadline:
+                raise _reject("服务繁忙，预计无法在截止时间内处理", 503, wait, "deadline")
+
+    def _lowest(self, priority):
+        """优先级低于priority的排队请求中最后到达的一个"""
+        candidates = [entry for entry in self._heap if entry[0] > priority and not entry[2].done()]
+        return max(candidates, key=lambda entry: (entry[0], entry[1])) if candidates else None
+
+    @asynccontextmanager
+    async def slot(self, priority=0, deadline=None):
+        await self.acquire(priority, deadline)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - start)
+
+    async def acquire(self, priority=0, deadline=None):
+        if self.active < self.max_concurrency and not self._waiting:
+            self.active += 1
+            return
+        self.check(priority, deadline)
+        if self.max_queue is not None and self._waiting >= self.max_queue:
+            _, _, evicted = self._lowest(priority)
+            evicted.set_exception(_reject("被更高优先级的请求挤出队列", 503, self.service_time or 1.0, "preempted"))
+            self._waiting -= 1
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (priority, next(self._counter), future))
+        self._waiting += 1
+        metrics.incr("admission_queued", str(priority))
+        queued_at = time.monotonic()
+        reason = "deadline" if deadline is not None else "queue_timeout"
+        deadline = self._deadline(deadline)
+        timeout = None if deadline is None else max(0.0, deadline - queued_at)
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                return  # 超时的同时已经拿到名额
+            self._waiting -= 1
+            raise _reject("排队超时，请稍后再试", 503, self.service_time or 1.0, reason)
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                # 名额已经交给本请求，但请求被取消：交给下一个排队的请求
+                self.release(None)
+            elif not future.done() or future.cancelled():
+                self._waiting -= 1
+            raise
+        finally:
+            metrics.observe("admission_queue_seconds", time.monotonic() - queued_at, str(priority))
+
+    def release(self, duration):
+        if duration is not None:
+            self.service_time = duration if self.service_time is None else 0.8 * self.service_time + 0.2 * duration
+        # 名额直接交给下一个仍在等待的请求，active不变
+        while self._heap:
+            _, _, future = heapq.heappop(self._heap)
+            if not future.done():
+                self._waiting -= 1
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self):
+        return {
+            "active": self.active,
+            "queued": self._waiting,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "service_seconds": round(self.service_time, 4) if self.service_time is not None else None,
+        }
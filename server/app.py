@@ -1,17 +1,39 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
 import os
+import hmac
+import logging
+import time
+import asyncio
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 import uvicorn
 import json
 from typing import List, Dict, Any, Optional
-import requests
 import traceback  # 添加traceback模块
-from llama_index.core import VectorStoreIndex, StorageContext, load_index_from_storage
 from llama_index.core.settings import Settings
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
-from llama_index.vector_stores.chroma import ChromaVectorStore
 import chromadb
+from admission import PRIORITIES, AdmissionError, CircuitBreaker, RateLimiter, UpstreamScheduler
+from cache import normalize_query
+from coalesce import SingleFlight
+from completion_cache import SemanticCompletionCache
+from embedding_service import RemoteEmbedding, parse_address
+from knowledge_base import KNOWLEDGE_BASES, KnowledgeBase, resolve_persona
+from log_config import SAMPLED, setup_logging
+from metrics import format_family, metrics
+from retrieval import RetrievalExecutor
+from sessions import SessionStore, build_history, rewrite_query, turns_from_messages, valid_session_id
+from settings import DATA_DIR, EMBEDDING_MODEL_PATH, PERSIST_DIR, SERVER_DIR, get_setting
+from upstream import DeepSeekClient, UpstreamError
+from vector_store import VectorStoreConfig
+
+# 日志格式、级别和请求日志采样比例见log_config.py
+setup_logging()
+logger = logging.getLogger("app")
 
 app = FastAPI()
 
@@ -24,21 +46,93 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# 加载本地embedding模型
-EMBEDDING_MODEL_PATH = r"C:\Users\Boredommm\.cache\modelscope\hub\models\sentence-transformers\paraphrase-multilingual-MiniLM-L12-v2"
+# 知识库加载方式：
+#   eager      启动时加载全部知识库，加载完成后才开始接受请求（原有行为）
+#   background 立即开始监听端口，后台并行加载全部知识库
+#   lazy       立即开始监听端口，后台只加载embedding模型，知识库在第一次被访问时加载
+KB_LOAD_MODE = get_setting("KB_LOAD_MODE", "background")
+KB_RETRY_AFTER = get_setting("KB_RETRY_AFTER", 5, int)  # 知识库未就绪时建议客户端等待的秒数
+KB_WATCH = get_setting("KB_WATCH", False, bool)  # 轮询各知识库的数据文件，变化时在后台热更新
+KB_WATCH_INTERVAL = get_setting("KB_WATCH_INTERVAL", 5.0, float)  # 轮询间隔（秒）
+KB_RETIRE_SECONDS = get_setting("KB_RETIRE_SECONDS", 60.0, float)  # 热更新后旧版本索引保留的秒数，等待进行中的查询结束
+ADMIN_TOKEN = get_setting("ADMIN_TOKEN", "")  # /admin写接口需要在X-Admin-Token请求头中提供；未设置时这些接口被禁用
+SEARCH_TIMEOUT_MS = get_setting("SEARCH_TIMEOUT_MS", 2000, float)  # /search的默认截止时间
+BATCH_QUERY_SIZE = get_setting("BATCH_QUERY_SIZE", 256, int)  # /query/batch每批计算向量的查询数
+MODEL_CONTEXT_TOKENS = get_setting("MODEL_CONTEXT_TOKENS", 65536, int)  # DeepSeek模型的上下文窗口
+FAST_ANSWER_ENABLED = get_setting("FAST_ANSWER_ENABLED", True, bool)  # 已知问题是否跳过大模型直接回答
+VECTOR_BACKEND = get_setting("VECTOR_BACKEND")  # chroma / numpy，为空时按各知识库的配置
+# 多worker部署时由serve.py设置：向共享的embedding服务请求向量，worker中不再各自加载模型
+EMBEDDING_SERVICE_ADDRESS = get_setting("EMBEDDING_SERVICE_ADDRESS")
 
 # 定义全局变量，用于存储索引实例
-riddle_index = None
-minecraft_index = None  # 新增：我的世界知识库索引
-magic_index = None  # 新增：哈利波特魔法知识库索引
+knowledge_bases = {
+    spec.name: KnowledgeBase(spec, DATA_DIR, PERSIST_DIR, VECTOR_BACKEND, VectorStoreConfig.from_settings())
+    for spec in KNOWLEDGE_BASES.values()
+}
 chroma_client = None
-riddle_collection = None
-minecraft_collection = None  # 新增：我的世界collection
-magic_collection = None  # 新增：哈利波特魔法collection
+retrieval_executor = None  # 检索执行器：线程池 + 查询向量微批处理
+
+# 语义回答缓存：同一角色下意思相近的问题直接复用DeepSeek的回答；设置SEMANTIC_CACHE_PATH时持久化到SQLite
+_semantic_cache_path = get_setting("SEMANTIC_CACHE_PATH", "")
+completion_cache = SemanticCompletionCache(
+    maxsize=get_setting("SEMANTIC_CACHE_SIZE", 1000, int),
+    threshold=get_setting("SEMANTIC_CACHE_THRESHOLD", 0.92, float),
+    max_temperature=get_setting("SEMANTIC_CACHE_MAX_TEMPERATURE", 0.8, float),
+    ttl=get_setting("SEMANTIC_CACHE_TTL", 86400, float),
+    persist_path=os.path.join(SERVER_DIR, _semantic_cache_path) if _semantic_cache_path else None,
+)
+# 服务端会话：前端只发送新消息和session_id，历史由服务端保存；设置SESSION_STORE_PATH时多个worker共享（SQLite）
+_session_store_path = get_setting("SESSION_STORE_PATH", "")
+session_store = SessionStore(
+    maxsize=get_setting("SESSION_MAX", 10000, int),
+    ttl=get_setting("SESSION_TTL", 86400, float),
+    max_turns=get_setting("SESSION_MAX_TURNS", 20, int),
+    persist_path=os.path.join(SERVER_DIR, _session_store_path) if _session_store_path else None,
+)
+SESSION_HISTORY_TOKENS = get_setting("SESSION_HISTORY_TOKENS", 800, int)  # 发给上游的历史（含摘要）的token预算
+SESSION_RECENT_TURNS = get_setting("SESSION_RECENT_TURNS", 2, int)  # 原样发送的最近轮数，更早的压缩成摘要
+SESSION_REWRITE_TURNS = get_setting("SESSION_REWRITE_TURNS", 2, int)  # 追问时合并进检索查询的最近轮数
+# 请求合并：没有前文的相同问题（角色、归一化问题、temperature、max_tokens均相同）同时到达时只执行一次
+COALESCE_ENABLED = get_setting("COALESCE_ENABLED", True, bool)
+coalescer = SingleFlight(on_coalesced=lambda key: metrics.incr("coalesced_requests", key[0]))
+runtime_state = {"status": "pending", "load_seconds": None, "error": None, "embedding_backend": None}  # embedding模型与Chroma客户端
 
-# 数据目录
-DATA_DIR = "../data"
-PERSIST_DIR = "./chroma_db"
+# /metrics导出的指标说明与标签名，各阶段耗时按角色(persona)或知识库(kb)区分
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+metrics.describe("request_seconds", "聊天请求总耗时（流式为最后一个分片发送完的时间）", "persona")
+metrics.describe("stage_embed_seconds", "查询向量计算耗时", "kb")
+metrics.describe("stage_vector_search_seconds", "向量（或混合）检索耗时", "kb")
+metrics.describe("stage_context_build_seconds", "参考内容组装与提示词构建耗时", "persona")
+metrics.describe("stage_upstream_seconds", "DeepSeek调用耗时（流式为整个生成过程）", "persona")
+metrics.describe("ttft_seconds", "流式首token延迟（含检索）", "persona")
+metrics.describe("tokens_per_second", "流式生成速度", "persona", (5, 10, 20, 40, 80, 160, 320))
+metrics.describe("context_tokens", "参考内容的估算token数", "persona", TOKEN_BUCKETS)
+metrics.describe("context_tokens_saved", "去重与裁剪节省的估算token数", "persona", TOKEN_BUCKETS)
+metrics.describe("history_tokens", "发给上游的对话历史（含摘要）的估算token数", "persona", TOKEN_BUCKETS)
+metrics.describe("query_rewrites", "追问合并了前文的检索查询数", "persona")
+metrics.describe("coalesced_requests", "与进行中的相同请求合并、共享检索和上游调用的请求数", "persona")
+metrics.describe("fast_answer_seconds", "快速回答耗时", "persona")
+metrics.describe("semantic_cache_seconds", "语义缓存命中时的耗时", "persona")
+metrics.describe("search_seconds", "跨知识库检索耗时")
+metrics.describe("retrieval_cache_hits", "检索结果缓存命中次数", "kb")
+metrics.describe("exact_match_hits", "精确匹配直接返回的次数", "kb")
+metrics.describe("semantic_cache_hits", "语义缓存命中次数", "persona")
+metrics.describe("fast_answer_hits", "快速回答次数", "persona")
+metrics.describe("fast_answer_near_duplicates", "按近似问题快速回答的次数", "persona")
+metrics.describe("upstream_errors", "DeepSeek调用失败次数（状态码、timeout、connect或invalid_json）", "reason")
+metrics.describe("upstream_timeouts", "DeepSeek调用超时次数")
+metrics.describe("upstream_retries", "DeepSeek调用重试次数")
+metrics.describe("admission_rejected", "未被准入的请求数（rate_limit、queue_full、deadline、queue_timeout、preempted、circuit_open）", "reason")
+metrics.describe("admission_queued", "等待上游名额而排队的请求数，按优先级（0为交互式）", "priority")
+metrics.describe("admission_queue_seconds", "等待上游名额的排队耗时", "priority")
+metrics.describe("circuit_opened", "上游失败率过高触发熔断的次数")
+metrics.describe("stream_errors", "流式生成中途出错次数", "persona")
+metrics.describe("stream_cancelled", "客户端断开导致取消的流式请求数", "persona")
+metrics.describe("search_timeouts", "跨知识库检索中超时的知识库次数", "kb")
+metrics.describe("batch_queries", "批量查询条数")
+metrics.describe("kb_reload_seconds", "知识库热更新耗时", "kb")
+metrics.describe("kb_reloads", "知识库热更新次数（rebuild、follow、unchanged或failed）", "result")
+_runtime_lock = threading.Lock()
 
 # 定义聊天请求模型
 class ChatRequest(BaseModel):
@@ -46,493 +140,768 @@ class ChatRequest(BaseModel):
     messages: List[Dict[str, str]]
     temperature: Optional[float] = 0.7
     max_tokens: Optional[int] = 2048
+    stream: Optional[bool] = False  # 为True时以SSE流式返回
+    persona: Optional[str] = None  # 角色id（riddle_master / steve / wizard），为空时按系统提示词识别
+    session_id: Optional[str] = None  # 会话id，由客户端生成；提供时对话历史保存在服务端，只需发送新消息
+    priority: Optional[str] = None  # 上游排队优先级：interactive（默认）/ background / batch
+    timeout_ms: Optional[float] = None  # 截止时间，预计无法在此之前开始调用上游时直接返回503
+
+# 跨知识库检索请求
+class SearchRequest(BaseModel):
+    query: str
+    kbs: Optional[List[str]] = None  # 要检索的知识库id，为空时检索全部
+    top_k: Optional[Dict[str, int]] = None  # 按知识库覆盖返回条数，未指定的使用知识库默认值
+    limit: Optional[int] = None  # 合并后最多返回的条数
+    timeout_ms: Optional[float] = None  # 全局截止时间，超时的知识库不等待，只返回已完成的结果
 
 # 尝试从环境变量或配置文件中读取API Key
 def get_api_key():
-    # 首先尝试从环境变量获取
-    api_key = os.environ.get("DEEPSEEK_API_KEY")
-    
-    # 如果环境变量中没有，尝试从config.json读取
-    if not api_key:
-        config_path = os.path.join(os.path.dirname(__file__), "config.json")
-        if os.path.exists(config_path):
-            try:
-                with open(config_path, "r", encoding="utf-8") as f:
-                    config = json.load(f)
-                    api_key = config.get("DEEPSEEK_API_KEY")
-                    if api_key:
-                        print("成功从config.json读取API密钥")
-            except Exception as e:
-                print(f"读取配置文件出错: {e}")
+    # 依次从环境变量、config.json中读取
+    api_key = get_setting("DEEPSEEK_API_KEY")
     
     # 如果还是没有，使用默认值
     if not api_key:
         api_key = "DEEPSEEK-API"  # 使用与前端相同的默认API密钥
-        print("警告: 使用默认API密钥，建议替换为您自己的密钥")
-        print("您可以通过创建config.json文件或设置DEEPSEEK_API_KEY环境变量来配置自己的API密钥")
+        logger.warning("使用默认API密钥，建议替换为您自己的密钥")
+        logger.warning("您可以通过创建config.json文件或设置DEEPSEEK_API_KEY环境变量来配置自己的API密钥")
     
     return api_key
 
-# 初始化函数，用于加载或创建向量索引
-def init_index():
-    global riddle_index, minecraft_index, magic_index, chroma_client, riddle_collection, minecraft_collection, magic_collection
-    
-    # 创建embedding模型
-    embed_model = HuggingFaceEmbedding(model_name=EMBEDDING_MODEL_PATH)
+# 初始化embedding模型、Chroma客户端和检索执行器（只执行一次，可在线程中调用）
+def init_runtime():
+    global chroma_client, retrieval_executor
     
-    # 初始化Chroma客户端
-    chroma_client = chromadb.PersistentClient(path=PERSIST_DIR)
-    
-    # 设置全局Settings
-    Settings.embed_model = embed_model
-    # 注意：我们不再设置LLM，因为我们不使用查询引擎，而是直接使用检索器
-    
-    # ====== 加载猜谜大师知识库 ======
-    # 判断是否已经存在索引
-    index_exists = False
-    if os.path.exists(PERSIST_DIR):
+    with _runtime_lock:
+        if runtime_state["status"] == "ready":
+            return
+        runtime_state["status"] = "loading"
+        start = time.perf_counter()
         try:
-            # 尝试获取collection
-            if "riddles" in [col.name for col in chroma_client.list_collections()]:
-                # 检查索引文件是否存在
-                if os.path.exists(os.path.join(PERSIST_DIR, "docstore.json")):
-                    index_exists = True
-        except Exception as e:
-            print(f"检查猜谜索引时出错: {e}")
-            index_exists = False
-    
-    if index_exists:
-        # 加载已存在的索引
-        print("正在加载已存在的猜谜索引...")
-        try:
-            riddle_collection = chroma_client.get_collection("riddles")
-            chroma_vector_store = ChromaVectorStore(chroma_collection=riddle_collection)
-            storage_context = StorageContext.from_defaults(vector_store=chroma_vector_store, persist_dir=PERSIST_DIR)
-            riddle_index = load_index_from_storage(storage_context)
-            print("猜谜索引加载完成")
-        except Exception as e:
-            print(f"加载猜谜索引时出错: {e}")
-            index_exists = False  # 如果加载失败，重新创建索引
-    
-    if not index_exists:
-        # 第一次运行，创建索引
-        print("正在创建新的猜谜索引...")
-        # 确保数据目录存在
-        riddle_data_path = os.path.join(DATA_DIR, "riddle")
-        
-        # 删除已存在的collection（如果有）
-        try:
-            if "riddles" in [col.name for col in chroma_client.list_collections()]:
-                print("发现已存在的riddles集合，正在删除...")
-                chroma_client.delete_collection("riddles")
-                print("已删除旧集合")
-        except Exception as e:
-            print(f"尝试删除旧集合时出错: {e}")
-        
-        # 读取JSON文件并准备文档
-        with open(os.path.join(riddle_data_path, "data.json"), "r", encoding="utf-8") as f:
-            riddles_data = json.load(f)
-        
-        # 将JSON数据转换为文本文档
-        documents = []
-        from llama_index.core.schema import Document
-        for idx, riddle in enumerate(riddles_data):
-            doc_text = f"问题: {riddle['instruction']}\n回答: {riddle['output']}"
-            documents.append(Document(text=doc_text, id=f"riddle_{idx}"))
-        
-        # 创建向量存储和索引
-        riddle_collection = chroma_client.create_collection("riddles")
-        chroma_vector_store = ChromaVectorStore(chroma_collection=riddle_collection)
-        storage_context = StorageContext.from_defaults(vector_store=chroma_vector_store)
-        # 不再需要传递service_context
-        riddle_index = VectorStoreIndex.from_documents(
-            documents, 
-            storage_context=storage_context
-        )
-        
-        # 保存索引
-        storage_context.persist(persist_dir=PERSIST_DIR)
-        print("猜谜索引创建完成")
-    
-    # ====== 加载我的世界知识库 ======
-    minecraft_index_exists = False
-    minecraft_persist_dir = os.path.join(PERSIST_DIR, "minecraft")
-    os.makedirs(minecraft_persist_dir, exist_ok=True)
-    
-    if os.path.exists(minecraft_persist_dir):
-        try:
-            # 尝试获取collection
-            if "minecraft" in [col.name for col in chroma_client.list_collections()]:
-                # 检查索引文件是否存在
-                if os.path.exists(os.path.join(minecraft_persist_dir, "docstore.json")):
-                    minecraft_index_exists = True
-        except Exception as e:
-            print(f"检查我的世界索引时出错: {e}")
-            minecraft_index_exists = False
-    
-    if minecraft_index_exists:
-        # 加载已存在的索引
-        print("正在加载已存在的我的世界索引...")
-        try:
-            minecraft_collection = chroma_client.get_collection("minecraft")
-            minecraft_vector_store = ChromaVectorStore(chroma_collection=minecraft_collection)
-            minecraft_storage_context = StorageContext.from_defaults(vector_store=minecraft_vector_store, persist_dir=minecraft_persist_dir)
-            minecraft_index = load_index_from_storage(minecraft_storage_context)
-            print("我的世界索引加载完成")
-        except Exception as e:
-            print(f"加载我的世界索引时出错: {e}")
-            minecraft_index_exists = False  # 如果加载失败，重新创建索引
-    
-    if not minecraft_index_exists:
-        # 第一次运行，创建索引
-        print("正在创建新的我的世界索引...")
-        minecraft_data_path = os.path.join(DATA_DIR, "minecraft")
-        
-        # 删除已存在的collection（如果有）+
-        try:
-            if "minecraft" in [col.name for col in chroma_client.list_collections()]:
-                print("发现已存在的minecraft集合，正在删除...")
-                chroma_client.delete_collection("minecraft")
-                print("已删除旧集合")
-        except Exception as e:
-            print(f"尝试删除旧集合时出错: {e}")
-        
-        # 读取JSON文件并准备文档
-        with open(os.path.join(minecraft_data_path, "minecraft.json"), "r", encoding="utf-8") as f:
-            minecraft_data = json.load(f)
-        
-        # 将JSON数据转换为文本文档
-        minecraft_documents = []
-        from llama_index.core.schema import Document
-        for idx, item in enumerate(minecraft_data):
-            # 注意这里根据train.json的具体结构进行调整
-            if isinstance(item, dict) and "instruction" in item and "output" in item:
-                doc_text = f"Question: {item['instruction']}\nAnswer: {item['output']}"
-                minecraft_documents.append(Document(text=doc_text, id=f"minecraft_{idx}"))
-        
-        # 创建向量存储和索引
-        minecraft_collection = chroma_client.create_collection("minecraft")
-        minecraft_vector_store = ChromaVectorStore(chroma_collection=minecraft_collection)
-        minecraft_storage_context = StorageContext.from_defaults(vector_store=minecraft_vector_store)
-        minecraft_index = VectorStoreIndex.from_documents(
-            minecraft_documents, 
-            storage_context=minecraft_storage_context
-        )
-        
-        # 保存索引
-        minecraft_storage_context.persist(persist_dir=minecraft_persist_dir)
-        print("我的世界索引创建完成")
-    
-    # ====== 加载哈利波特魔法知识库 ======
-    magic_index_exists = False
-    magic_persist_dir = os.path.join(PERSIST_DIR, "magic")
-    os.makedirs(magic_persist_dir, exist_ok=True)
-    
-    if os.path.exists(magic_persist_dir):
-        try:
-            # 尝试获取collection
-            if "magic" in [col.name for col in chroma_client.list_collections()]:
-                # 检查索引文件是否存在
-                if os.path.exists(os.path.join(magic_persist_dir, "docstore.json")):
-                    magic_index_exists = True
-        except Exception as e:
-            print(f"检查哈利波特魔法索引时出错: {e}")
-            magic_index_exists = False
-    
-    if magic_index_exists:
-        # 加载已存在的索引
-        print("正在加载已存在的哈利波特魔法索引...")
-        try:
-            magic_collection = chroma_client.get_collection("magic")
-            magic_vector_store = ChromaVectorStore(chroma_collection=magic_collection)
-            magic_storage_context = StorageContext.from_defaults(vector_store=magic_vector_store, persist_dir=magic_persist_dir)
-            magic_index = load_index_from_storage(magic_storage_context)
-            print("哈利波特魔法索引加载完成")
-        except Exception as e:
-            print(f"加载哈利波特魔法索引时出错: {e}")
-            magic_index_exists = False  # 如果加载失败，重新创建索引
-    
-    if not magic_index_exists:
-        # 第一次运行，创建索引
-        print("正在创建新的哈利波特魔法索引...")
-        magic_data_path = os.path.join(DATA_DIR, "magic")
-        
-        # 删除已存在的collection（如果有）
-        try:
-            if "magic" in [col.name for col in chroma_client.list_collections()]:
-                print("发现已存在的magic集合，正在删除...")
-                chroma_client.delete_collection("magic")
-                print("已删除旧集合")
+            # 创建embedding模型
+            if EMBEDDING_SERVICE_ADDRESS:
+                authkey = bytes.fromhex(get_setting("EMBEDDING_SERVICE_AUTHKEY", ""))
+                embed_model = RemoteEmbedding(parse_address(EMBEDDING_SERVICE_ADDRESS), authkey)
+                runtime_state["embedding_backend"] = "remote"
+            else:
+                # 使用共享embedding服务时worker不导入torch，延迟到这里导入
+                from embeddings import create_embed_model
+
+                embed_model, runtime_state["embedding_backend"] = create_embed_model(model_path=EMBEDDING_MODEL_PATH)
+            
+            # 初始化Chroma客户端
+            chroma_client = chromadb.PersistentClient(path=PERSIST_DIR)
+            
+            # 设置全局Settings
+            Settings.embed_model = embed_model
+            retrieval_executor = RetrievalExecutor(
+                embed_model,
+                max_workers=get_setting("RETRIEVAL_WORKERS", 4, int),
+                batch_window=get_setting("RETRIEVAL_BATCH_WINDOW_MS", 5, float) / 1000,
+                max_batch_size=get_setting("RETRIEVAL_MAX_BATCH", 64, int),
+                embedding_cache_size=get_setting("EMBEDDING_CACHE_SIZE", 4096, int),
+                result_cache_size=get_setting("RETRIEVAL_CACHE_SIZE", 2048, int),
+                cache_ttl=get_setting("RETRIEVAL_CACHE_TTL", 3600, float),
+                candidate_factor=get_setting("HYBRID_CANDIDATE_FACTOR", 3, int),
+            )
+            # 注意：我们不再设置LLM，因为我们不使用查询引擎，而是直接使用检索器
+            runtime_state["status"] = "ready"
         except Exception as e:
-            print(f"尝试删除旧集合时出错: {e}")
-        
-        # 读取JSON文件并准备文档
-        with open(os.path.join(magic_data_path, "harry_potter_spells_clean.json"), "r", encoding="utf-8") as f:
-            magic_data = json.load(f)
-        
-        # 将JSON数据转换为文本文档
-        magic_documents = []
-        from llama_index.core.schema import Document
-        for idx, spell in enumerate(magic_data):
-            # 注意这里根据harry_potter_spells_clean.json的具体结构进行调整
-            if isinstance(spell, dict):
-                # 构建魔法咒语文档，根据实际JSON结构调整字段
-                fields = []
-                for key, value in spell.items():
-                    if value and isinstance(value, (str, int, float, bool)):
-                        fields.append(f"{key}: {value}")
-                
-                doc_text = "\n".join(fields)
-                magic_documents.append(Document(text=doc_text, id=f"magic_{idx}"))
-        
-        # 创建向量存储和索引
-        magic_collection = chroma_client.create_collection("magic")
-        magic_vector_store = ChromaVectorStore(chroma_collection=magic_collection)
-        magic_storage_context = StorageContext.from_defaults(vector_store=magic_vector_store)
-        magic_index = VectorStoreIndex.from_documents(
-            magic_documents, 
-            storage_context=magic_storage_context
-        )
-        
-        # 保存索引
-        magic_storage_context.persist(persist_dir=magic_persist_dir)
-        print("哈利波特魔法索引创建完成")
+            runtime_state["status"] = "failed"
+            runtime_state["error"] = str(e)
+            raise
+        finally:
+            runtime_state["load_seconds"] = round(time.perf_counter() - start, 3)
+
+# 加载或创建单个知识库
+def load_knowledge_base(kb):
+    try:
+        init_runtime()
+    except Exception as e:
+        kb.status = "failed"
+        kb.error = f"embedding模型加载失败: {e}"
+        return
+    if kb.load(chroma_client):
+        retrieval_executor.invalidate(kb.spec.name)
+        completion_cache.invalidate(kb.spec.persona)
+    if kb.ready:
+        # 上次运行中未能删除的旧快照（仍被映射时删除失败）在启动加载后清理
+        kb.sweep_snapshots()
+
+# 初始化函数，用于加载或创建向量索引：先加载embedding模型，再并行加载各知识库
+def init_index():
+    try:
+        init_runtime()
+    except Exception as e:
+        logger.exception(f"embedding模型加载失败: {e}")
+    with ThreadPoolExecutor(max_workers=len(knowledge_bases), thread_name_prefix="kb-load") as pool:
+        list(pool.map(load_knowledge_base, knowledge_bases.values()))
+    logger.info("知识库加载完成: " + ", ".join(f"{name}={kb.status}" for name, kb in knowledge_bases.items()))
+
+# 后台初始化与数据文件轮询时保留任务引用，避免被垃圾回收
+_background_init = None
+_kb_watcher = None
 
 # 在应用启动时执行初始化
 @app.on_event("startup")
 async def startup_event():
-    init_index()
+    global _background_init, _kb_watcher
+    await deepseek_client.start()
+    logger.info(f"知识库加载方式: {KB_LOAD_MODE}")
+    if KB_LOAD_MODE == "eager":
+        init_index()
+    elif KB_LOAD_MODE == "lazy":
+        _background_init = asyncio.get_running_loop().run_in_executor(None, init_runtime)
+    else:
+        _background_init = asyncio.get_running_loop().run_in_executor(None, init_index)
+    if KB_WATCH:
+        _kb_watcher = asyncio.create_task(watch_knowledge_bases())
 
-# 查询接口
-@app.post("/query")
-async def query_riddle(query: str):
-    global riddle_index
+# 获取已就绪的知识库，未就绪时返回503并提示重试时间
+def require_knowledge_base(kb_name):
+    kb = knowledge_bases.get(kb_name)
+    if kb is None:
+        raise HTTPException(status_code=404, detail=f"未知的知识库: {kb_name}")
+    if kb.ready:
+        return kb
+    if kb.status == "failed":
+        raise HTTPException(status_code=500, detail=f"{kb.spec.display_name}索引加载失败: {kb.error}")
+    if kb.status == "pending" and KB_LOAD_MODE == "lazy":
+        # 懒加载：第一次访问时在后台开始加载
+        kb.status = "queued"
+        asyncio.get_running_loop().run_in_executor(None, load_knowledge_base, kb)
+    raise HTTPException(
+        status_code=503,
+        detail=f"{kb.spec.display_name}索引正在加载，请稍后重试",
+        headers={"Retry-After": str(KB_RETRY_AFTER)},
+    )
+
+# 热更新：在后台把一个知识库重建到新的collection，完成后替换knowledge_bases中的引用
+kb_reloads = {}  # 知识库id -> 最近一次热更新的状态与报告
+_reload_tasks = {}  # 知识库id -> 进行中的热更新
+
+def reload_knowledge_base(name, force=False):
+    """重建并替换知识库，返回报告（在线程中调用）"""
+    init_runtime()
+    old = knowledge_bases[name]
+    new, report = old.reload(chroma_client, force)
+    if new is not None:
+        # 字典赋值是原子的；进行中的查询已经持有旧对象，继续使用旧版本直到结束
+        knowledge_bases[name] = new
+        # 检索结果按版本缓存，新版本不会读到旧结果；这里只释放旧版本占用的缓存
+        retrieval_executor.invalidate(name, old.collection_name)
+        completion_cache.invalidate(new.spec.persona)
+        if report["mode"] == "rebuild" and old.collection_name != new.collection_name:
+            # 旧版本保留一段时间再删除，等待进行中的查询（以及其他worker切换到新版本）
+            timer = threading.Timer(KB_RETIRE_SECONDS, old.drop, args=(chroma_client,))
+            timer.daemon = True
+            timer.start()
+    return report
+
+def start_reload(name, force=False):
+    """在后台开始热更新，同一知识库已在热更新时返回进行中的那一次"""
+    task = _reload_tasks.get(name)
+    if task is not None and not task.done():
+        return task
+    kb_reloads[name] = {"status": "running", "started_at": time.strftime("%Y-%m-%d %H:%M:%S"), "force": force}
+    task = _reload_tasks[name] = asyncio.get_running_loop().run_in_executor(None, reload_knowledge_base, name, force)
+    task.add_done_callback(lambda done: _finish_reload(name, done))
+    return task
+
+def _finish_reload(name, task):
+    started = kb_reloads.get(name, {})
+    if task.exception() is not None:
+        error = task.exception()
+        logger.error(f"知识库{name}热更新失败: {error}", exc_info=error)
+        metrics.incr("kb_reloads", "failed")
+        kb_reloads[name] = dict(started, status="failed", error=str(error))
+        return
+    report = task.result()
+    metrics.incr("kb_reloads", report["mode"])
+    metrics.observe("kb_reload_seconds", report["seconds"], name)
+    kb_reloads[name] = dict(started, status="done", finished_at=time.strftime("%Y-%m-%d %H:%M:%S"), **report)
+
+# 轮询数据文件（以及其他worker写入的清单），变化时在后台热更新对应的知识库
+async def watch_knowledge_bases():
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(KB_WATCH_INTERVAL)
+        for name, kb in list(knowledge_bases.items()):
+            task = _reload_tasks.get(name)
+            if not kb.ready or (task is not None and not task.done()):
+                continue
+            try:
+                changed = await loop.run_in_executor(None, kb.needs_reload)
+            except Exception as e:
+                logger.warning(f"检查{kb.spec.display_name}数据文件出错: {e}")
+                continue
+            if changed:
+                logger.info(f"检测到{kb.spec.display_name}数据变化，开始热更新")
+                start_reload(name)
+
+# 关闭时释放上游连接池
+@app.on_event("shutdown")
+async def shutdown_event():
+    if _kb_watcher is not None:
+        _kb_watcher.cancel()
+    await deepseek_client.close()
+    if retrieval_executor is not None:
+        retrieval_executor.shutdown()
+    completion_cache.close()
+    session_store.close()
+
+# 在线程池中检索知识库，返回按相关度排序的NodeWithScore列表
+async def retrieve_nodes(kb, query, top_k=None):
+    # 直接使用向量检索，不依赖LLM进行查询
+    # 检索在线程池中执行，并与同时到达的其他查询合并计算向量，不阻塞事件循环
+    logger.info(f"执行{kb.spec.display_name}查询", extra=dict(SAMPLED, kb=kb.spec.name, query_chars=len(query)))
+    return await retrieval_executor.retrieve(
+        kb.index,
+        query,
+        collection=kb.spec.name,
+        version=kb.collection_name,
+        top_k=top_k or kb.spec.top_k,
+        lexical=kb.lexical,
+    )
+
+# 通用查询接口：按知识库id检索
+@app.post("/kb/{kb_name}/query")
+async def query_knowledge_base(kb_name: str, query: str):
+    kb = require_knowledge_base(kb_name)
     
     try:
-        if riddle_index is None:
-            raise HTTPException(status_code=500, detail="索引尚未初始化")
-        
-        # 直接使用向量检索，不依赖LLM进行查询
-        # 创建一个检索器而不是查询引擎
-        retriever = riddle_index.as_retriever(similarity_top_k=3)
-        print(f"执行查询: {query}")
         # 获取最相关的文档节点
-        nodes = retriever.retrieve(query)
+        nodes = await retrieve_nodes(kb, query)
         
-        # 提取检索到的文档内容
+        # 提取检索到的文档内容，以及可供引用的来源
         result_texts = []
+        sources = []
         for node in nodes:
             result_texts.append(node.get_content())
+            source = node.metadata.get("source")
+            if source and source not in sources:
+                sources.append(source)
         
         response_text = "\n\n".join(result_texts)
-        print(f"查询结果: {response_text}")
+        logger.info(
+            f"{kb.spec.display_name}查询完成",
+            extra=dict(SAMPLED, kb=kb.spec.name, nodes=len(nodes), result_chars=len(response_text)),
+        )
         
-        return {"response": response_text}
+        return {"response": response_text, "sources": sources}
     except Exception as e:
-        error_detail = traceback.format_exc()
-        print(f"查询过程出错: {str(e)}")
-        print(f"详细错误: {error_detail}")
-        raise HTTPException(status_code=500, detail=f"查询处理出错: {str(e)}")
+        logger.exception(f"{kb.spec.display_name}查询过程出错: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"{kb.spec.display_name}查询处理出错: {str(e)}")
 
-# 查询我的世界知识库
-@app.post("/query-minecraft")
-async def query_minecraft(query: str):
-    global minecraft_index
+# 跨知识库检索：并发查询多个知识库，按各自名次交错合并；超过截止时间的知识库返回部分结果
+@app.post("/search")
+async def search(request: SearchRequest):
+    names = request.kbs or list(knowledge_bases)
+    unknown = [name for name in names if name not in knowledge_bases]
+    if unknown:
+        raise HTTPException(status_code=404, detail=f"未知的知识库: {', '.join(unknown)}")
+    
+    start = time.perf_counter()
+    top_k = request.top_k or {}
+    status = {}
+    tasks = {}
+    for name in dict.fromkeys(names):
+        try:
+            kb = require_knowledge_base(name)
+        except HTTPException as e:
+            # 单个知识库未就绪或加载失败不影响其他知识库
+            status[name] = {"status": "unavailable", "detail": e.detail}
+            continue
+        # 同一查询的向量在检索执行器中只计算一次，各知识库共享
+        tasks[asyncio.create_task(retrieve_nodes(kb, request.query, top_k.get(name)))] = name
     
+    timeout = (request.timeout_ms if request.timeout_ms is not None else SEARCH_TIMEOUT_MS) / 1000
+    done, pending = await asyncio.wait(tasks, timeout=timeout) if tasks else (set(), set())
+    for task in pending:
+        task.cancel()
+        status[tasks[task]] = {"status": "timeout"}
+        metrics.incr("search_timeouts", tasks[task])
+    
+    order = {name: i for i, name in enumerate(dict.fromkeys(names))}
+    results = []
+    for task in done:
+        name = tasks[task]
+        if task.exception() is not None:
+            status[name] = {"status": "error", "detail": str(task.exception())}
+            continue
+        nodes = task.result()
+        status[name] = {"status": "ok", "count": len(nodes)}
+        # 向量检索的exp(-距离)与混合检索的RRF分数不可比，只用各知识库内的名次合并
+        for rank, item in enumerate(nodes, 1):
+            results.append({
+                "kb": name,
+                "rank": rank,
+                "score": item.score,
+                "text": item.node.get_content(),
+                "source": item.node.metadata.get("source"),
+            })
+    
+    # 各知识库的第1名在前，其次第2名……同一名次按请求中知识库的顺序
+    results.sort(key=lambda hit: (hit["rank"], order[hit["kb"]]))
+    if request.limit:
+        results = results[: request.limit]
+    elapsed = time.perf_counter() - start
+    metrics.observe("search_seconds", elapsed)
+    return {
+        "query": request.query,
+        "results": results,
+        "knowledge_bases": status,
+        "partial": any(entry["status"] != "ok" for entry in status.values()),
+        "seconds": round(elapsed, 4),
+    }
+
+# 辅助函数：把批量查询的一项统一为 {id, kb, query, top_k}
+def parse_batch_item(item, index, default_kb, default_top_k):
+    if isinstance(item, str):
+        item = {"query": item}
+    if not isinstance(item, dict) or not isinstance(item.get("query"), str) or not item["query"].strip():
+        return {"id": index, "error": "缺少query"}
+    return {
+        "id": item.get("id", index),
+        "kb": item.get("kb") or default_kb,
+        "query": item["query"],
+        "top_k": item.get("top_k") or default_top_k,
+    }
+
+# 辅助函数：读取批量查询请求体，支持JSON（数组或{"queries": [...]}）和NDJSON（每行一个查询）
+async def read_batch_items(request, default_kb, default_top_k):
+    items = []
+    content_type = request.headers.get("content-type", "")
+    if "ndjson" in content_type or "jsonl" in content_type:
+        # 按块读取并逐行解析，不需要把整个请求体拼成一个字符串
+        buffer = b""
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    items.append(line)
+        if buffer.strip():
+            items.append(buffer)
+        parsed = []
+        for i, line in enumerate(items):
+            try:
+                parsed.append(parse_batch_item(json.loads(line), i, default_kb, default_top_k))
+            except json.JSONDecodeError as e:
+                parsed.append({"id": i, "error": f"不是有效的JSON: {e}"})
+        return parsed
     try:
-        if minecraft_index is None:
-            raise HTTPException(status_code=500, detail="我的世界索引尚未初始化")
-        
-        # 直接使用向量检索，不依赖LLM进行查询
-        # 创建一个检索器而不是查询引擎
-        retriever = minecraft_index.as_retriever(similarity_top_k=5)  # 多检索几条，增加覆盖面
-        print(f"执行我的世界查询: {query}")
-        # 获取最相关的文档节点
-        nodes = retriever.retrieve(query)
-        
-        # 提取检索到的文档内容
-        result_texts = []
-        for node in nodes:
-            result_texts.append(node.get_content())
-        
-        response_text = "\n\n".join(result_texts)
-        print(f"我的世界查询结果长度: {len(response_text)}")
+        body = await request.json()
+    except json.JSONDecodeError as e:
+        raise HTTPException(status_code=400, detail=f"请求体不是有效的JSON: {e}")
+    if isinstance(body, dict):
+        default_kb = body.get("kb") or default_kb
+        default_top_k = body.get("top_k") or default_top_k
+        body = body.get("queries")
+    if not isinstance(body, list):
+        raise HTTPException(status_code=400, detail="请求体应为查询数组或包含queries数组的对象")
+    return [parse_batch_item(item, i, default_kb, default_top_k) for i, item in enumerate(body)]
+
+# 辅助函数：按批计算向量并检索，按输入顺序逐行产出NDJSON结果
+async def run_batch_queries(items):
+    for start in range(0, len(items), BATCH_QUERY_SIZE):
+        chunk = items[start : start + BATCH_QUERY_SIZE]
+        results = {}
+        groups = {}
+        for i, item in enumerate(chunk):
+            if "error" in item:
+                results[i] = item
+            else:
+                try:
+                    # 与单条查询相同：懒加载模式下第一次访问时开始加载，未就绪或加载失败时该条返回错误
+                    kb = require_knowledge_base(item["kb"])
+                except HTTPException as e:
+                    results[i] = {"id": item["id"], "error": e.detail}
+                    continue
+                groups.setdefault((item["kb"], item["top_k"] or kb.spec.top_k), []).append(i)
         
-        return {"response": response_text}
-    except Exception as e:
-        error_detail = traceback.format_exc()
-        print(f"我的世界查询过程出错: {str(e)}")
-        print(f"详细错误: {error_detail}")
-        raise HTTPException(status_code=500, detail=f"我的世界查询处理出错: {str(e)}")
+        for (kb_name, top_k), indexes in groups.items():
+            kb = knowledge_bases[kb_name]
+            try:
+                found = await retrieval_executor.retrieve_batch(
+                    kb.vector_source, [chunk[i]["query"] for i in indexes], top_k, lexical=kb.lexical
+                )
+            except Exception as e:
+                logger.exception(f"{kb.spec.display_name}批量查询出错: {e}")
+                for i in indexes:
+                    results[i] = {"id": chunk[i]["id"], "error": str(e)}
+                continue
+            for i, nodes in zip(indexes, found):
+                results[i] = {
+                    "id": chunk[i]["id"],
+                    "kb": kb_name,
+                    "query": chunk[i]["query"],
+                    "results": [
+                        {"score": item.score, "text": item.node.get_content(), "source": item.node.metadata.get("source")}
+                        for item in nodes
+                    ],
+                }
+        metrics.incr("batch_queries", amount=len(chunk))
+        for i in range(len(chunk)):
+            yield json.dumps(results[i], ensure_ascii=False) + "\n"
+
+# 批量查询：一批查询只调用一次embedding模型和一次collection.query，结果以NDJSON逐行返回
+@app.post("/query/batch")
+async def query_batch(request: Request, kb: str = "riddles", top_k: Optional[int] = None):
+    if retrieval_executor is None:
+        raise HTTPException(status_code=503, detail="索引尚未初始化", headers={"Retry-After": str(KB_RETRY_AFTER)})
+    items = await read_batch_items(request, kb, top_k)
+    logger.info(f"批量查询: {len(items)}条", extra=SAMPLED)
+    return StreamingResponse(run_batch_queries(items), media_type="application/x-ndjson")
+
+# 兼容旧版接口
+@app.post("/query")
+async def query_riddle(query: str):
+    return await query_knowledge_base("riddles", query)
+
+# 查询我的世界知识库
+@app.post("/query-minecraft")
+async def query_minecraft(query: str):
+    return await query_knowledge_base("minecraft", query)
 
 # 查询哈利波特魔法知识库
 @app.post("/query-magic")
 async def query_magic(query: str):
-    global magic_index
-    
-    try:
-        if magic_index is None:
-            raise HTTPException(status_code=500, detail="哈利波特魔法索引尚未初始化")
-        
-        # 直接使用向量检索，不依赖LLM进行查询
-        # 创建一个检索器而不是查询引擎
-        retriever = magic_index.as_retriever(similarity_top_k=4)
-        print(f"执行哈利波特魔法查询: {query}")
-        # 获取最相关的文档节点
-        nodes = retriever.retrieve(query)
-        
-        # 提取检索到的文档内容
-        result_texts = []
-        for node in nodes:
-            result_texts.append(node.get_content())
-        
-        response_text = "\n\n".join(result_texts)
-        print(f"哈利波特魔法查询结果长度: {len(response_text)}")
-        
-        return {"response": response_text}
-    except Exception as e:
-        error_detail = traceback.format_exc()
-        print(f"哈利波特魔法查询过程出错: {str(e)}")
-        print(f"详细错误: {error_detail}")
-        raise HTTPException(status_code=500, detail=f"哈利波特魔法查询处理出错: {str(e)}")
+    return await query_knowledge_base("magic", query)
 
 # DeepSeek API接口
-DEEPSEEK_API_URL = "https://api.deepseek.com/v1/chat/completions"
+DEEPSEEK_API_URL = get_setting("DEEPSEEK_API_URL", "https://api.deepseek.com/v1/chat/completions")
 DEEPSEEK_API_KEY = get_api_key()  # 使用获取的API密钥
 
+# 上游准入控制：按客户端限流，同时在途的上游请求数有上限，超出的按优先级排队，失败率过高时熔断
+rate_limiter = RateLimiter(
+    rate=get_setting("RATE_LIMIT_PER_SECOND", 2.0, float),
+    burst=get_setting("RATE_LIMIT_BURST", 10, int),
+)
+RATE_LIMIT_CLIENT_HEADER = get_setting("RATE_LIMIT_CLIENT_HEADER", "")  # 在反向代理之后时按该请求头（如X-Forwarded-For）区分客户端
+upstream_scheduler = UpstreamScheduler(
+    max_concurrency=get_setting("UPSTREAM_MAX_CONCURRENCY", 32, int),
+    max_queue=get_setting("ADMISSION_MAX_QUEUE", 256, int),
+    queue_timeout=get_setting("ADMISSION_QUEUE_TIMEOUT", 10.0, float),
+)
+circuit_breaker = CircuitBreaker(
+    window=get_setting("BREAKER_WINDOW", 30.0, float),
+    min_requests=get_setting("BREAKER_MIN_REQUESTS", 20, int),
+    error_rate=get_setting("BREAKER_ERROR_RATE", 0.5, float),
+    cooldown=get_setting("BREAKER_COOLDOWN", 10.0, float),
+)
+
+# 共享的上游客户端：连接池、并发上限、超时与重试均可通过环境变量或config.json配置
+deepseek_client = DeepSeekClient(
+    DEEPSEEK_API_URL,
+    DEEPSEEK_API_KEY,
+    max_connections=get_setting("UPSTREAM_MAX_CONNECTIONS", 100, int),
+    max_keepalive_connections=get_setting("UPSTREAM_MAX_KEEPALIVE", 20, int),
+    timeout=get_setting("UPSTREAM_TIMEOUT", 30.0, float),
+    connect_timeout=get_setting("UPSTREAM_CONNECT_TIMEOUT", 5.0, float),
+    max_retries=get_setting("UPSTREAM_MAX_RETRIES", 2, int),
+    backoff_base=get_setting("UPSTREAM_BACKOFF_BASE", 0.5, float),
+    scheduler=upstream_scheduler,
+    breaker=circuit_breaker,
+)
+
+def client_id(http_request: Request):
+    if RATE_LIMIT_CLIENT_HEADER:
+        forwarded = http_request.headers.get(RATE_LIMIT_CLIENT_HEADER)
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return http_request.client.host if http_request.client else "unknown"
+
+def admission_exception(e: AdmissionError):
+    return HTTPException(status_code=e.status_code, detail=str(e), headers=e.headers)
+
+# 确定要调用上游时才做准入检查（限流、熔断、队列），快速回答和缓存命中不消耗令牌
+def admit_upstream(http_request: Request, priority, deadline):
+    rate_limiter.check(client_id(http_request))
+    circuit_breaker.check()
+    upstream_scheduler.check(priority, deadline)
+
+# 检索角色知识库，组装参考内容与对话历史，返回发给DeepSeek的请求体
+async def build_persona_payload(kb, request, user_query, turns):
+    persona = kb.spec.persona
+    # 查询角色对应的本地知识库；追问时把前几轮的问题合并进检索查询
+    retrieval_query = rewrite_query(user_query, turns, SESSION_REWRITE_TURNS)
+    if retrieval_query != user_query:
+        metrics.incr("query_rewrites", persona)
+    nodes = await retrieve_nodes(kb, retrieval_query)
+    
+    # 对话历史：最近几轮原样发送，更早的压缩成摘要，总量不超过SESSION_HISTORY_TOKENS
+    context_start = time.perf_counter()
+    history, history_tokens = build_history(turns, SESSION_HISTORY_TOKENS, SESSION_RECENT_TURNS)
+    metrics.observe("history_tokens", history_tokens, persona)
+    
+    # 按token预算组装参考内容：去重，按相关度整条放入，放不下的丢弃或按行裁剪
+    packed = kb.pack_context(nodes, user_query, request.max_tokens, MODEL_CONTEXT_TOKENS - history_tokens)
+    metrics.observe("context_tokens", packed.tokens, persona)
+    metrics.observe("context_tokens_saved", packed.tokens_saved, persona)
+    
+    # 创建角色提示，包含从知识库检索的相关内容
+    system_prompt = kb.build_prompt(packed.text)
+    metrics.observe("stage_context_build_seconds", time.perf_counter() - context_start, persona)
+    
+    # 更新系统提示
+    updated_messages = [{"role": "system", "content": system_prompt}]
+    # 添加对话历史与用户查询
+    updated_messages += history
+    updated_messages.append({"role": "user", "content": user_query})
+    
+    logger.info(
+        "发送到DeepSeek API",
+        extra=dict(
+            SAMPLED,
+            persona=persona,
+            prompt_chars=len(system_prompt),
+            history_turns=len(turns),
+            history_tokens=history_tokens,
+            stream=bool(request.stream),
+        ),
+    )
+    
+    # 为DeepSeek构建正确的消息格式
+    return {
+        "model": "deepseek-chat",  # 使用DeepSeek Chat模型
+        "messages": updated_messages,
+        "temperature": request.temperature,
+        "max_tokens": request.max_tokens
+    }
+
 @app.post("/chat/completions")
-async def chat_completions(request: ChatRequest):
+async def chat_completions(request: ChatRequest, http_request: Request):
+    request_start = time.perf_counter()
+    if request.priority is not None and request.priority not in PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"priority应为: {', '.join(PRIORITIES)}")
+    priority = PRIORITIES[request.priority or "interactive"]
+    deadline = time.monotonic() + request.timeout_ms / 1000 if request.timeout_ms else None
     # 获取用户的最后一条消息
     user_query = next((msg["content"] for msg in reversed(request.messages) if msg["role"] == "user"), None)
     
     if not user_query:
         raise HTTPException(status_code=400, detail="未找到用户消息")
+    session_id = request.session_id
+    if session_id is not None and not valid_session_id(session_id):
+        raise HTTPException(status_code=400, detail="session_id应为8到64位的字母、数字、-或_")
+    
+    # 按角色id（或旧版系统提示词）查表确定知识库
+    spec = resolve_persona(request.persona, request.messages)
+    if request.persona and spec is None:
+        raise HTTPException(status_code=400, detail=f"未知的角色: {request.persona}")
+    
+    # 知识库未就绪时直接返回503，而不是包装成500
+    if spec is not None:
+        kb = require_knowledge_base(spec.name)
+        # 此前的轮次：优先使用服务端保存的会话，没有时从请求的消息列表中提取（发送完整历史的旧客户端）
+        turns = session_store.get(spec.persona, session_id) if session_id else []
+        turns = turns or turns_from_messages(request.messages)
+        
+        def record(completion):
+            if session_id:
+                content = completion["choices"][0]["message"]["content"]
+                session_store.append(spec.persona, session_id, user_query, content)
+        
+        # 已知问题直接按模板回答，跳过检索和DeepSeek调用
+        if FAST_ANSWER_ENABLED and kb.answers is not None:
+            match = kb.answers.lookup(user_query)
+            if match is not None:
+                return fast_answer_response(kb, match, request.stream, request_start, on_complete=record)
     
-    # 根据不同角色处理请求
     try:
-        # 角色1: 猜谜大师
-        if "你是模型A，猜谜大师" in request.messages[0]["content"]:
-            # 查询本地知识库
-            query_response = await query_riddle(user_query)
-            context = query_response["response"]
-            
-            # 限制上下文长度，避免超出API限制
-            if len(context) > 2000:
-                print(f"上下文过长 ({len(context)} 字符)，截断至2000字符")
-                context = context[:1997] + "..."
-            
-            # 创建给猜谜大师的提示，包含从知识库检索的相关内容
-            system_prompt = f"""你是一位猜谜大师，精通各种脑筋急转弯和谜语。
-            基于以下参考内容回答用户的问题，如果找到了准确匹配的谜语，请用生动有趣的方式给出答案。
-            如果没有找到准确匹配的谜语，可以基于你的知识创造性地回答。
-            
-            参考内容：
-            {context}
-            """
-            
-            # 更新系统提示
-            updated_messages = [{"role": "system", "content": system_prompt}]
-            # 添加用户查询
-            updated_messages.append({"role": "user", "content": user_query})
+        # 其他模型，直接转发原始请求
+        if spec is None:
+            return await forward_to_deepseek(request, http_request, priority, deadline)
         
-        # 角色2: 我的世界史蒂夫
-        elif "你是模型B，专业的技术顾问" in request.messages[0]["content"]:
-            # 查询我的世界知识库
-            query_response = await query_minecraft(user_query)
-            context = query_response["response"]
-            
-            # 限制上下文长度，避免超出API限制
-            if len(context) > 3000:
-                print(f"我的世界上下文过长 ({len(context)} 字符)，截断至3000字符")
-                context = context[:2997] + "..."
-            
-            # 创建给我的世界史蒂夫的提示，包含从知识库检索的相关内容
-            system_prompt = f"""你是我的世界(Minecraft)中的史蒂夫(Steve)，精通所有与我的世界相关的知识。
-            基于以下参考内容（英文）回答用户的问题，理解英文的含义，并翻译成中文。
-            当知识库中找到准确的信息时，请基于这些信息回答。如果没有找到相关信息，先道歉！接着可以基于你对我的世界的了解创造性地回答。
-            回答时要亲切友好，像一个热爱分享我的世界知识的玩家，可以使用一些与游戏相关的表达方式。
-            
-            参考内容（英文）：
-            {context}
-            
-            请注意：虽然参考资料是英文的，但你必须用流利的中文回答！
-            """
-            
-            # 更新系统提示
-            updated_messages = [{"role": "system", "content": system_prompt}]
-            # 添加用户查询
-            updated_messages.append({"role": "user", "content": user_query})
+        persona = spec.persona
         
-        # 角色3: 哈利波特魔法师
-        elif "你是模型C，幽默的生活小助手" in request.messages[0]["content"]:
-            # 查询哈利波特魔法知识库
-            query_response = await query_magic(user_query)
-            context = query_response["response"]
-            
-            # 限制上下文长度，避免超出API限制
-            if len(context) > 2500:
-                print(f"哈利波特魔法上下文过长 ({len(context)} 字符)，截断至2500字符")
-                context = context[:2497] + "..."
-            
-            # 创建给哈利波特魔法师的提示，包含从知识库检索的相关内容
-            system_prompt = f"""你是哈利波特世界中的一位魔法师，精通各种魔法咒语和魔法知识。
-            基于以下参考内容回答用户的问题，如果找到了相关的魔法咒语或魔法知识，请详细解释其用途和效果。
-            回答时要幽默风趣，充满魔法世界的奇妙感，可以偶尔引用哈利波特系列中的经典台词或场景。
-            
-            参考内容：
-            {context}
-            """
-            
-            # 更新系统提示
-            updated_messages = [{"role": "system", "content": system_prompt}]
-            # 添加用户查询
-            updated_messages.append({"role": "user", "content": user_query})
+        # 语义缓存：意思相近的问题直接返回之前的回答，省去检索和DeepSeek调用
+        # 有前文时回答依赖对话历史，不使用缓存
+        cache_scope = None
+        if not turns and completion_cache.cacheable(request.temperature):
+            query_embedding = await retrieval_executor.embed(user_query)
+            cache_scope = completion_cache.scope(persona, request.max_tokens)
+            cached, similarity = completion_cache.get(cache_scope, query_embedding)
+            if cached is not None:
+                logger.info("语义缓存命中", extra=dict(SAMPLED, persona=persona, similarity=round(similarity, 3)))
+                metrics.incr("semantic_cache_hits", persona)
+                metrics.observe("semantic_cache_seconds", time.perf_counter() - request_start, persona)
+                metrics.observe("request_seconds", time.perf_counter() - request_start, persona)
+                record(cached)
+                return completion_sse(cached) if request.stream else cached
         
-        # 其他模型，直接转发原始请求
-        else:
-            return await forward_to_deepseek(request)
+        # 需要调用上游：超出限流、熔断中、队列已满或预计排队超过截止时间时直接拒绝，不做检索
+        admit_upstream(http_request, priority, deadline)
         
-        # 调用DeepSeek API
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {DEEPSEEK_API_KEY}"
-        }
+        # 合并执行时语义缓存只由实际调用上游的一方写入，会话记录由每个请求各自完成
+        def remember(response):
+            if cache_scope is not None:
+                latency = time.perf_counter() - request_start
+                completion_cache.set(cache_scope, user_query, query_embedding, response, latency)
         
-        # 为DeepSeek构建正确的消息格式
-        payload = {
-            "model": "deepseek-chat",  # 使用DeepSeek Chat模型
-            "messages": updated_messages,
-            "temperature": request.temperature,
-            "max_tokens": request.max_tokens
-        }
+        # 没有前文的相同问题同时到达时只检索、调用上游一次（流式请求共享同一个上游流）
+        # 准入优先级放进key；截止时间比进行中的请求更紧时由SingleFlight单独执行
+        coalesce_key = None
+        if COALESCE_ENABLED and not turns:
+            coalesce_key = (persona, normalize_query(user_query), request.temperature, request.max_tokens, priority)
         
-        print(f"发送到DeepSeek API的请求: {DEEPSEEK_API_URL}")
-        print(f"消息类型: {updated_messages[0]['content'][:50]}...")
-        response = requests.post(DEEPSEEK_API_URL, headers=headers, json=payload, timeout=30)  # 添加超时设置
+        # 流式模式下先完成检索，再把上游token逐个转发给前端
+        if request.stream:
+            async def open_stream(on_complete):
+                payload = await build_persona_payload(kb, request, user_query, turns)
+                
+                def finish(response):
+                    remember(response)
+                    on_complete(response)
+                
+                return upstream_events(
+                    payload, persona, request_start, on_complete=finish, priority=priority, deadline=deadline
+                )
+            
+            if coalesce_key is None:
+                events = await open_stream(record)
+            else:
+                events = await coalescer.stream(coalesce_key, open_stream, on_complete=record, deadline=deadline)
+                # 订阅由响应负责退出：即使客户端在第一个分片前断开、events从未被迭代也会退出
+                try:
+                    return event_stream_response(events, background=BackgroundTask(events.aclose))
+                except BaseException:
+                    events.close()
+                    raise
+            return event_stream_response(events)
         
-        if response.status_code != 200:
-            print(f"DeepSeek API返回错误，状态码: {response.status_code}")
-            print(f"错误详情: {response.text}")
-            raise Exception(f"DeepSeek API返回错误 (状态码: {response.status_code}): {response.text}")
+        async def complete():
+            payload = await build_persona_payload(kb, request, user_query, turns)
+            upstream_start = time.perf_counter()
+            response = await deepseek_client.chat(payload, priority=priority, deadline=deadline)
+            metrics.observe("stage_upstream_seconds", time.perf_counter() - upstream_start, persona)
+            logger.info("DeepSeek API响应成功", extra=dict(SAMPLED, persona=persona))
+            remember(response)
+            return response
         
-        response_json = response.json()
-        print(f"DeepSeek API响应成功")
+        response_json = await (complete() if coalesce_key is None else coalescer.run(coalesce_key, complete, deadline=deadline))
+        record(response_json)
+        metrics.observe("request_seconds", time.perf_counter() - request_start, persona)
         return response_json
-            
+    
+    except AdmissionError as e:
+        raise admission_exception(e)
     except Exception as e:
-        error_detail = traceback.format_exc()
-        print(f"处理角色请求时出错: {str(e)}")
-        print(f"详细错误: {error_detail}")
+        logger.exception(f"处理角色请求时出错: {str(e)}")
         raise HTTPException(status_code=500, detail=f"处理角色请求时出错: {str(e)}")
 
+# 辅助函数：在本地生成与DeepSeek格式相同的非流式回答
+def local_completion(content, model):
+    return {
+        "id": f"local-{uuid.uuid4().hex[:24]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+    }
+
+# 辅助函数：把一个完整的非流式回答作为单个分片的SSE返回
+def completion_sse(completion):
+    choice = completion["choices"][0]
+    chunk = {
+        "id": completion.get("id"),
+        "object": "chat.completion.chunk",
+        "created": completion.get("created"),
+        "model": completion.get("model"),
+        "choices": [{"index": 0, "delta": choice["message"], "finish_reason": choice.get("finish_reason")}],
+    }
+
+    async def events():
+        yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return event_stream_response(events())
+
+# 辅助函数：快速回答，返回与DeepSeek相同格式的响应（流式时为单个分片的SSE）
+def fast_answer_response(kb, match, stream, start, on_complete=None):
+    question, answer, score = match
+    persona = kb.spec.persona
+    metrics.incr("fast_answer_hits", persona)
+    if score < 1.0:
+        metrics.incr("fast_answer_near_duplicates", persona)
+    logger.info(f"{kb.spec.display_name}快速回答", extra=dict(SAMPLED, persona=persona, similarity=score))
+    completion = local_completion(kb.answers.render(question, answer), "fast-answer")
+    if on_complete is not None:
+        on_complete(completion)
+    metrics.observe("fast_answer_seconds", time.perf_counter() - start, persona)
+    metrics.observe("request_seconds", time.perf_counter() - start, persona)
+    return completion_sse(completion) if stream else completion
+
+# 辅助函数：把上游的流式分片转为SSE事件
+async def stream_completion(payload, persona, start, on_complete=None, priority=0, deadline=None):
+    # StreamingResponse每发送完一个分片才会继续迭代，客户端读得慢时上游读取也随之暂停（背压）；
+    # 客户端断开时Starlette会取消本生成器，取消沿着async for传到上游客户端并关闭连接
+    # start为请求进入的时间，因此首token延迟包含了检索耗时
+    # 正常结束时把拼接好的完整回答传给on_complete（用于写入语义缓存）
+    upstream_start = time.perf_counter()
+    first_token_at = None
+    parts = []
+    model = payload.get("model")
+    token_count = 0
+    usage_tokens = None
+    try:
+        async for chunk in deepseek_client.stream_chat(payload, priority=priority, deadline=deadline):
+            choices = chunk.get("choices") or []
+            model = chunk.get("model") or model
+            if choices and (choices[0].get("delta") or {}).get("content"):
+                parts.append(choices[0]["delta"]["content"])
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                    metrics.observe("ttft_seconds", first_token_at - start, persona)
+                token_count += 1
+            if chunk.get("usage"):
+                usage_tokens = chunk["usage"].get("completion_tokens")
+            yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+        yield "data: [DONE]\n\n"
+        if on_complete is not None and parts:
+            on_complete(local_completion("".join(parts), model))
+    except (UpstreamError, AdmissionError) as e:
+        logger.warning(f"流式调用DeepSeek API时出错: {str(e)}")
+        metrics.incr("stream_errors", persona)
+        yield f"event: error\ndata: {json.dumps({'detail': str(e)}, ensure_ascii=False)}\n\n"
+    except Exception as e:
+        # 其他意外错误同样以error事件结束，而不是让响应中途断开
+        logger.exception(f"流式生成出错: {str(e)}")
+        metrics.incr("stream_errors", persona)
+        yield f"event: error\ndata: {json.dumps({'detail': '流式生成出错'}, ensure_ascii=False)}\n\n"
+    except asyncio.CancelledError:
+        logger.info("客户端已断开连接，取消上游流式请求", extra=dict(SAMPLED, persona=persona))
+        metrics.incr("stream_cancelled", persona)
+        raise
+    finally:
+        if first_token_at is not None:
+            generation_time = time.perf_counter() - first_token_at
+            if generation_time > 0:
+                metrics.observe("tokens_per_second", (usage_tokens or token_count) / generation_time, persona)
+        end = time.perf_counter()
+        metrics.observe("stage_upstream_seconds", end - upstream_start, persona)
+        metrics.observe("request_seconds", end - start, persona)
+
+def upstream_events(payload, persona, start=None, on_complete=None, priority=0, deadline=None):
+    # 要求上游在最后一个分片中附带usage，便于统计真实的token数
+    payload = dict(payload, stream_options={"include_usage": True})
+    return stream_completion(payload, persona, start or time.perf_counter(), on_complete, priority, deadline)
+
+def event_stream_response(events, background=None):
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=background,
+    )
+
+def sse_response(payload, persona, start=None, on_complete=None, priority=0, deadline=None):
+    return event_stream_response(upstream_events(payload, persona, start, on_complete, priority, deadline))
+
 # 辅助函数：转发请求到DeepSeek API
-async def forward_to_deepseek(request: ChatRequest):
+async def forward_to_deepseek(request: ChatRequest, http_request: Request, priority=0, deadline=None):
     try:
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {DEEPSEEK_API_KEY}"
-        }
-        
         # 确保消息格式正确
         messages = request.messages
         
@@ -543,27 +912,18 @@ async def forward_to_deepseek(request: ChatRequest):
             "max_tokens": request.max_tokens
         }
         
-        print(f"转发到DeepSeek API，模型: {request.model}")
-        response = requests.post(DEEPSEEK_API_URL, headers=headers, json=payload, timeout=30)  # 添加超时设置
-        
-        if response.status_code != 200:
-            print(f"DeepSeek API返回错误，状态码: {response.status_code}")
-            print(f"错误详情: {response.text}")
-            raise Exception(f"DeepSeek API返回错误 (状态码: {response.status_code}): {response.text}")
+        logger.info("转发到DeepSeek API", extra=dict(SAMPLED, model=request.model))
+        admit_upstream(http_request, priority, deadline)
+        if request.stream:
+            return sse_response(payload, "passthrough", priority=priority, deadline=deadline)
         
-        response_json = response.json()
-        print(f"DeepSeek API响应成功")
+        response_json = await deepseek_client.chat(payload, priority=priority, deadline=deadline)
+        logger.info("DeepSeek API响应成功", extra=dict(SAMPLED, model=request.model))
         return response_json
+    except AdmissionError:
+        raise
     except Exception as e:
-        error_detail = traceback.format_exc()
-        print(f"调用DeepSeek API时出错: {str(e)}")
-        print(f"详细错误: {error_detail}")
-        raise HTTPException(status_code=500, detail=f"调用DeepSeek API时出错: {str(e)}")
-        
-    except Exception as e:
-        error_detail = traceback.format_exc()
-        print(f"调用DeepSeek API时出错: {str(e)}")
-        print(f"详细错误: {error_detail}")
+        logger.exception(f"调用DeepSeek API时出错: {str(e)}")
         raise HTTPException(status_code=500, detail=f"调用DeepSeek API时出错: {str(e)}")
 
 # 测试DeepSeek API连接
@@ -571,11 +931,6 @@ async def forward_to_deepseek(request: ChatRequest):
 async def test_deepseek_api():
     """测试DeepSeek API是否可用"""
     try:
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {DEEPSEEK_API_KEY}"
-        }
-        
         payload = {
             "model": "deepseek-chat",
             "messages": [
@@ -586,18 +941,25 @@ async def test_deepseek_api():
             "max_tokens": 100
         }
         
-        response = requests.post(DEEPSEEK_API_URL, headers=headers, json=payload)
-        
-        if response.status_code != 200:
+        try:
+            # 连通性测试排在交互式聊天之后，不与用户请求争抢上游名额
+            response_json = await deepseek_client.chat(payload, max_retries=0, priority=PRIORITIES["background"])
+        except UpstreamError as e:
             return {
                 "status": "error",
-                "code": response.status_code,
-                "message": response.text
+                "code": e.status_code,
+                "message": e.body or str(e)
+            }
+        except AdmissionError as e:
+            return {
+                "status": "error",
+                "code": e.status_code,
+                "message": str(e)
             }
         
         return {
             "status": "success",
-            "response": response.json()
+            "response": response_json
         }
     except Exception as e:
         error_detail = traceback.format_exc()
@@ -607,6 +969,126 @@ async def test_deepseek_api():
             "detail": error_detail
         }
 
+# 存活检查：进程已启动即返回200，并报告各知识库的加载状态与耗时
+@app.get("/health")
+async def health():
+    return {
+        "status": "ok",
+        "pid": os.getpid(),
+        "load_mode": KB_LOAD_MODE,
+        "embedding_model": runtime_state,
+        "knowledge_bases": {name: kb.state() for name, kb in knowledge_bases.items()},
+        "reloads": kb_reloads,
+    }
+
+# 就绪检查：全部知识库加载完成后返回200，否则返回503
+@app.get("/ready")
+async def ready():
+    body = await health()
+    all_ready = all(kb.ready for kb in knowledge_bases.values())
+    body["status"] = "ready" if all_ready else "loading"
+    if not all_ready:
+        return JSONResponse(status_code=503, content=body, headers={"Retry-After": str(KB_RETRY_AFTER)})
+    return body
+
+# 管理接口：热更新单个知识库。默认立即返回202，在后台重建；wait=true时等待完成并返回报告
+@app.post("/admin/kb/{kb_name}/reload")
+async def reload_kb(kb_name: str, http_request: Request, force: bool = False, wait: bool = False):
+    # CORS允许任意来源，没有配置ADMIN_TOKEN时不开放重建接口
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="未配置ADMIN_TOKEN，热更新接口已禁用")
+    if not hmac.compare_digest(http_request.headers.get("X-Admin-Token", ""), ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="需要有效的X-Admin-Token")
+    kb = knowledge_bases.get(kb_name)
+    if kb is None:
+        raise HTTPException(status_code=404, detail=f"未知的知识库: {kb_name}")
+    if kb.status in ("queued", "loading"):
+        raise HTTPException(
+            status_code=409,
+            detail=f"{kb.spec.display_name}索引正在加载，请稍后重试",
+            headers={"Retry-After": str(KB_RETRY_AFTER)},
+        )
+    task = start_reload(kb_name, force)
+    if not wait:
+        return JSONResponse(status_code=202, content=kb_reloads[kb_name])
+    try:
+        await asyncio.shield(task)
+    except Exception:
+        return JSONResponse(status_code=500, content=kb_reloads[kb_name])
+    return kb_reloads[kb_name]
+
+# 最近一次热更新的状态：running / done / failed，完成后包含耗时与重建前后的文档数
+@app.get("/admin/kb/{kb_name}/reload")
+async def reload_kb_status(kb_name: str):
+    if kb_name not in knowledge_bases:
+        raise HTTPException(status_code=404, detail=f"未知的知识库: {kb_name}")
+    return kb_reloads.get(kb_name) or {"status": "none"}
+
+# 查询向量与检索结果缓存的命中统计
+@app.get("/cache/stats")
+async def get_cache_stats():
+    if retrieval_executor is None:
+        raise HTTPException(status_code=503, detail="索引尚未初始化")
+    return dict(retrieval_executor.cache_stats(), completion=completion_cache.stats(), sessions=session_store.stats())
+
+# 运行时指标：流式首token延迟(ttft_seconds)、生成速度(tokens_per_second)等
+@app.get("/stats")
+async def get_stats():
+    return dict(
+        metrics.snapshot(),
+        admission={
+            "upstream": upstream_scheduler.stats(),
+            "circuit_breaker": circuit_breaker.stats(),
+            "rate_limit": rate_limiter.stats(),
+        },
+    )
+
+# Prometheus抓取接口：各阶段耗时直方图、计数器，以及缓存与知识库状态
+@app.get("/metrics")
+async def get_metrics():
+    prefix = metrics.prefix
+    lines = metrics.render_prometheus()
+
+    caches = {"completion": completion_cache.stats(), "session": session_store.stats()}
+    if retrieval_executor is not None:
+        stats = retrieval_executor.cache_stats()
+        caches.update(embedding=stats["embedding"], retrieval=stats["retrieval"])
+    for field, help_text in (("hits", "缓存命中次数"), ("misses", "缓存未命中次数"), ("evictions", "缓存淘汰次数")):
+        samples = [("", {"cache": name}, stats[field]) for name, stats in sorted(caches.items())]
+        lines += format_family(f"{prefix}_cache_{field}_total", "counter", help_text, samples)
+    lines += format_family(
+        f"{prefix}_cache_size", "gauge", "缓存条目数",
+        [("", {"cache": name}, stats["size"]) for name, stats in sorted(caches.items())],
+    )
+    lines += format_family(
+        f"{prefix}_semantic_cache_saved_seconds_total", "counter", "语义缓存命中节省的上游耗时",
+        [("", {}, caches["completion"]["saved_seconds"])],
+    )
+    scheduler = upstream_scheduler.stats()
+    lines += format_family(
+        f"{prefix}_upstream_active", "gauge", "正在调用上游的请求数", [("", {}, scheduler["active"])]
+    )
+    lines += format_family(
+        f"{prefix}_upstream_queued", "gauge", "等待上游名额的请求数", [("", {}, scheduler["queued"])]
+    )
+    lines += format_family(
+        f"{prefix}_circuit_breaker_state", "gauge", "熔断器状态（当前状态为1）",
+        [("", {"state": state}, int(circuit_breaker.state == state))
+         for state in (CircuitBreaker.CLOSED, CircuitBreaker.OPEN, CircuitBreaker.HALF_OPEN)],
+    )
+    lines += format_family(
+        f"{prefix}_rate_limit_clients", "gauge", "限流跟踪的客户端数", [("", {}, rate_limiter.stats()["clients"])]
+    )
+    lines += format_family(
+        f"{prefix}_knowledge_base_ready", "gauge", "知识库是否已加载完成",
+        [("", {"kb": name}, int(kb.ready)) for name, kb in sorted(knowledge_bases.items())],
+    )
+    lines += format_family(
+        f"{prefix}_knowledge_base_documents", "gauge", "知识库当前版本的文档数",
+        [("", {"kb": name}, kb.collection.count()) for name, kb in sorted(knowledge_bases.items()) if kb.ready],
+    )
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
-    print("正在启动服务器，监听地址: http://127.0.0.1:8000")
+    logger.info("正在启动服务器，监听地址: http://127.0.0.1:8000")
     uvicorn.run("app:app", host="127.0.0.1", port=8000, reload=True)
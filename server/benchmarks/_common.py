@@ -0,0 +1,79 @@
+"""各基准测试共用的计时、统计与进程工具
+
+脚本在server目录下以 python benchmarks/xxx.py 运行，benchmarks目录即sys.path[0]，直接 from _common import ...
+"""
+import asyncio
+import time
+
+import httpx
+
+
+def percentile(ordered, p):
+    """已排序序列的p分位数（0 <= p <= 1），空序列返回NaN"""
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))] if ordered else float("nan")
+
+
+def latency_summary(latencies, ps=(0.5, 0.95, 0.99)):
+    """把以秒为单位的延迟列表汇总为 {"p50_ms": ..., "p95_ms": ..., ...}"""
+    ordered = sorted(latencies)
+    return {f"p{round(p * 100)}_ms": round(percentile(ordered, p) * 1000, 3) for p in ps}
+
+
+async def run_clients(handler, items, concurrency):
+    """concurrency个协程从队列中取item并await handler(item)，返回 (每秒完成数, 排好序的延迟列表)"""
+    queue = asyncio.Queue()
+    for item in items:
+        queue.put_nowait(item)
+    latencies = []
+
+    async def client():
+        while not queue.empty():
+            item = queue.get_nowait()
+            start = time.perf_counter()
+            await handler(item)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return len(latencies) / elapsed, latencies
+
+
+def wait_until(url, deadline, proc, expect_status=200):
+    """轮询url直到返回expect_status（为None时只要能连上即可），返回当时的perf_counter"""
+    while time.perf_counter() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"服务器进程已退出，返回码 {proc.returncode}")
+        try:
+            status = httpx.get(url, timeout=1).status_code
+            if expect_status is None or status == expect_status:
+                return time.perf_counter()
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.05)
+    raise TimeoutError(f"等待 {url} 超时")
+
+
+def peak_rss_mb():
+    """当前进程的峰值RSS（MB），不支持的平台返回NaN"""
+    try:
+        import resource
+
+        # Linux下ru_maxrss单位为KB
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    except ImportError:
+        try:
+            import psutil
+
+            return psutil.Process().memory_info().peak_wset / (1 << 20)
+        except Exception:
+            return float("nan")
+
+
+def field_value(text, name):
+    """从 "字段: 值" 形式的多行文档中取出字段值，没有该字段时返回空串"""
+    for line in text.splitlines():
+        if line.startswith(name + ":"):
+            return line.split(":", 1)[1].strip()
+    return ""
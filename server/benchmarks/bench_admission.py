@@ -0,0 +1,160 @@
+"""准入控制压测：对注入了延迟和错误的本地模拟上游施加过载，观察排队、提前拒绝与熔断
+
+    过载：并发请求数远超上游名额，交互式与批量请求混合，带截止时间；
+          统计各优先级的接受数、拒绝原因、接受请求的延迟以及被拒绝请求的等待时间
+    故障：模拟上游全部返回错误，观察熔断打开前的调用数、熔断期间的拒绝耗时，以及恢复后的探测
+    限流：单个客户端突发请求时令牌桶放行的数量
+
+用法（在server目录下）:
+    python benchmarks/bench_admission.py --latency 0.5 --concurrency 4 --requests 200 --deadline-ms 2000
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from collections import Counter, defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mock_deepseek  # noqa: E402
+from _common import percentile  # noqa: E402
+from admission import PRIORITIES, AdmissionError, CircuitBreaker, RateLimiter, UpstreamScheduler  # noqa: E402
+from load_upstream import start_mock_server  # noqa: E402
+from upstream import DeepSeekClient, UpstreamError  # noqa: E402
+
+
+def payload(i):
+    return {"model": "deepseek-chat", "messages": [{"role": "user", "content": f"问题{i}"}]}
+
+
+def ms(values, p):
+    return percentile(sorted(values), p) * 1000 if values else 0.0
+
+
+async def run_overload(client, args):
+    accepted = defaultdict(list)
+    rejected = defaultdict(list)
+    reasons = Counter()
+    names = {value: name for name, value in PRIORITIES.items()}
+
+    async def send(i):
+        # 每4个请求中有1个批量请求
+        priority = PRIORITIES["batch"] if i % 4 == 3 else PRIORITIES["interactive"]
+        start = time.perf_counter()
+        deadline = time.monotonic() + args.deadline_ms / 1000
+        try:
+            client.breaker.check()
+            client.scheduler.check(priority, deadline)
+            await client.chat(payload(i), priority=priority, deadline=deadline)
+            accepted[names[priority]].append(time.perf_counter() - start)
+        except AdmissionError as e:
+            rejected[names[priority]].append(time.perf_counter() - start)
+            reasons[e.reason] += 1
+        except UpstreamError:
+            reasons["upstream_error"] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(send(i) for i in range(args.requests)))
+    elapsed = time.perf_counter() - start
+
+    print(f"\n== 过载: {args.requests}个并发请求, 上游名额{args.concurrency}, 延迟{args.latency}s, 截止{args.deadline_ms}ms ==")
+    print(f"{'优先级':<12} {'接受':>6} {'拒绝':>6} {'接受p50(ms)':>12} {'接受p95(ms)':>12} {'拒绝p50(ms)':>12}")
+    for name in ("interactive", "batch"):
+        ok, rej = accepted[name], rejected[name]
+        print(f"{name:<12} {len(ok):>6} {len(rej):>6} {ms(ok, 0.5):>12.1f} {ms(ok, 0.95):>12.1f} {ms(rej, 0.5):>12.1f}")
+    print(f"拒绝原因: {dict(reasons)}")
+    print(f"总耗时 {elapsed:.2f}s, 上游平均占用 {client.scheduler.stats()['service_seconds']}s")
+
+
+async def run_outage(client, args):
+    breaker = client.breaker
+    mock_deepseek.MOCK_ERROR_RATE = 1.0
+    calls = 0
+    try:
+        while breaker.state == CircuitBreaker.CLOSED and calls < 1000:
+            calls += 1
+            try:
+                await client.chat(payload(calls), max_retries=0)
+            except UpstreamError:
+                pass
+        reject_times = []
+        for i in range(20):
+            start = time.perf_counter()
+            try:
+                await client.chat(payload(i), max_retries=0)
+            except AdmissionError:
+                reject_times.append(time.perf_counter() - start)
+            except UpstreamError:
+                pass
+    finally:
+        mock_deepseek.MOCK_ERROR_RATE = 0.0
+
+    print("\n== 故障: 上游全部返回503 ==")
+    print(f"熔断打开前的上游调用数: {calls}, 熔断期间拒绝 {len(reject_times)}/20, 拒绝p50 {ms(reject_times, 0.5):.3f}ms")
+
+    # 冷却结束后进入半开状态，探测请求成功则关闭
+    start = time.perf_counter()
+    await asyncio.sleep(args.cooldown)
+    recovered = None
+    while time.perf_counter() - start < args.cooldown + 10:
+        try:
+            await client.chat(payload(0), max_retries=0)
+        except (AdmissionError, UpstreamError):
+            await asyncio.sleep(0.1)
+            continue
+        recovered = time.perf_counter() - start
+        break
+    status = f"{recovered:.2f}s后恢复" if recovered is not None else "未恢复"
+    print(f"上游恢复后: 熔断器{status}, 当前状态 {breaker.state}, 共打开 {breaker.opened} 次")
+
+
+def run_rate_limit(args):
+    limiter = RateLimiter(rate=args.rate, burst=args.burst)
+    allowed = 0
+    for _ in range(args.burst * 5):
+        try:
+            limiter.check("127.0.0.1")
+            allowed += 1
+        except AdmissionError:
+            pass
+    print(f"\n== 限流: 每秒{args.rate}个、突发{args.burst}个 ==")
+    print(f"同一客户端瞬间发出{args.burst * 5}个请求，放行 {allowed} 个，其余返回429")
+
+
+async def main(args):
+    url = f"http://127.0.0.1:{args.port}/v1/chat/completions"
+    scheduler = UpstreamScheduler(args.concurrency, max_queue=args.max_queue, queue_timeout=args.queue_timeout)
+    breaker = CircuitBreaker(window=10, min_requests=args.min_requests, error_rate=0.5, cooldown=args.cooldown)
+    client = DeepSeekClient(url, "mock-key", max_retries=1, backoff_base=0.05, scheduler=scheduler, breaker=breaker)
+    await client.start()
+    try:
+        await run_overload(client, args)
+        await run_outage(client, args)
+    finally:
+        await client.close()
+    run_rate_limit(args)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="上游准入控制（排队、提前拒绝、熔断、限流）压测")
+    parser.add_argument("--port", type=int, default=8012)
+    parser.add_argument("--latency", type=float, default=0.5, help="模拟上游延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.1, help="模拟上游延迟抖动（秒）")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=4, help="上游名额数")
+    parser.add_argument("--max-queue", type=int, default=32)
+    parser.add_argument("--queue-timeout", type=float, default=10.0)
+    parser.add_argument("--deadline-ms", type=float, default=2000)
+    parser.add_argument("--min-requests", type=int, default=10, help="熔断判断所需的最少调用数")
+    parser.add_argument("--cooldown", type=float, default=2.0, help="熔断冷却时间（秒）")
+    parser.add_argument("--rate", type=float, default=2.0)
+    parser.add_argument("--burst", type=int, default=10)
+    args = parser.parse_args()
+
+    mock_deepseek.MOCK_LATENCY_JITTER = args.jitter
+    server = start_mock_server(args.port, args.latency)
+    try:
+        asyncio.run(main(args))
+    finally:
+        server.should_exit = True
@@ -0,0 +1,92 @@
+"""批量查询基准：对比逐条调用/kb/{kb}/query与/query/batch的吞吐（queries/sec）
+
+需要先启动服务器，并关闭检索缓存，避免重复查询直接命中缓存:
+    EMBEDDING_CACHE_SIZE=0 RETRIEVAL_CACHE_SIZE=0 python app.py
+
+用法（在server目录下）:
+    python benchmarks/bench_batch.py --kb minecraft --queries 2000 --concurrency 1 16 --batch-sizes 100 1000
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from knowledge_base import KNOWLEDGE_BASES, KnowledgeBase  # noqa: E402
+from settings import DATA_DIR, PERSIST_DIR  # noqa: E402
+
+
+def load_queries(kb_name, count):
+    """用知识库文档的第一行（问题、谜面或咒语描述）作为查询，不足时循环使用"""
+    kb = KnowledgeBase(KNOWLEDGE_BASES[kb_name], DATA_DIR, PERSIST_DIR)
+    seeds = [doc.get_content().splitlines()[0].split(":", 1)[-1].strip() for doc in kb.iter_documents()]
+    return [seeds[i % len(seeds)] for i in range(count)]
+
+
+async def single(client, kb_name, queries, concurrency):
+    queue = asyncio.Queue()
+    for query in queries:
+        queue.put_nowait(query)
+
+    async def worker():
+        while not queue.empty():
+            query = queue.get_nowait()
+            response = await client.post(f"/kb/{kb_name}/query", params={"query": query})
+            response.raise_for_status()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return len(queries) / (time.perf_counter() - start)
+
+
+async def batched(client, kb_name, queries, batch_size):
+    start = time.perf_counter()
+    received = 0
+    for i in range(0, len(queries), batch_size):
+        body = "".join(json.dumps({"query": q}, ensure_ascii=False) + "\n" for q in queries[i : i + batch_size])
+        async with client.stream(
+            "POST",
+            "/query/batch",
+            params={"kb": kb_name},
+            content=body.encode("utf-8"),
+            headers={"Content-Type": "application/x-ndjson"},
+        ) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if line.strip():
+                    received += 1
+    assert received == len(queries), f"只收到{received}条结果"
+    return len(queries) / (time.perf_counter() - start)
+
+
+async def main(args):
+    queries = load_queries(args.kb, args.queries)
+    async with httpx.AsyncClient(base_url=args.url, timeout=600) as client:
+        ready = await client.get("/ready")
+        if ready.status_code != 200:
+            print(f"服务器尚未就绪: {ready.text}")
+            return
+
+        print(f"知识库: {args.kb}, 查询数: {len(queries)}")
+        print(f"{'方式':<14} {'参数':>8} {'queries/sec':>12}")
+        for concurrency in args.concurrency:
+            qps = await single(client, args.kb, queries, concurrency)
+            print(f"{'逐条查询':<14} {'并发' + str(concurrency):>8} {qps:>12.1f}")
+        for batch_size in args.batch_sizes:
+            qps = await batched(client, args.kb, queries, batch_size)
+            print(f"{'/query/batch':<14} {'批' + str(batch_size):>8} {qps:>12.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="批量查询吞吐基准测试")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--kb", default="minecraft", choices=sorted(KNOWLEDGE_BASES))
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[100, 1000])
+    asyncio.run(main(parser.parse_args()))
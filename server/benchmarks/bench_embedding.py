@@ -0,0 +1,129 @@
+"""embedding后端基准：量化 / ONNX后端相对PyTorch fp32参考模型的向量漂移、检索质量与CPU延迟
+
+对每个候选后端（见embeddings.BACKENDS），用知识库的文档和run_suite生成的查询集测量:
+    cos      同一文本在候选后端与参考后端下向量的余弦相似度（平均 / 最小）
+    R@k      检索recall@k：参考后端的查询检索参考后端的文档（基线）、候选查询检索参考文档（混用，
+             即只换查询端模型而不重建索引）、候选查询检索候选文档（全部换成候选后端）
+    延迟     单条查询的p50/p95，以及各线程数下批量计算的吞吐（texts/sec）
+
+检索为暴力精确余弦检索，只反映模型差异。任一后端的最小余弦低于--min-cosine或
+recall@k（全部换成候选后端）比参考下降超过--max-recall-drop时返回码为1。
+
+用法（在server目录下）:
+    python benchmarks/bench_embedding.py --backends huggingface-int8 onnx onnx-int8 --threads 1 2 4
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+
+from _common import percentile  # noqa: E402
+from embeddings import BACKENDS, create_embed_model  # noqa: E402
+from knowledge_base import KNOWLEDGE_BASES, KnowledgeBase  # noqa: E402
+from run_suite import build_query_sets, sample  # noqa: E402
+from settings import DATA_DIR, EMBEDDING_MODEL_PATH  # noqa: E402
+
+
+def load_corpus(kb_names, limit):
+    """返回 (文档id列表, 文档文本列表, [(查询, 期望命中的文档id集合)])"""
+    ids, texts, queries = [], [], []
+    for name in kb_names:
+        documents = list(KnowledgeBase(KNOWLEDGE_BASES[name], DATA_DIR, SERVER_DIR).iter_documents())
+        ids += [doc.id_ for doc in documents]
+        texts += [doc.get_content() for doc in documents]
+        for category_queries in build_query_sets(name, documents).values():
+            queries += sample(category_queries, limit)
+    return ids, texts, queries
+
+
+def embed(model, texts, batch_size=64):
+    vectors = []
+    for i in range(0, len(texts), batch_size):
+        vectors += model.get_text_embedding_batch(texts[i : i + batch_size])
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def recall(query_vectors, doc_vectors, doc_ids, queries, k):
+    top = np.argsort(-(query_vectors @ doc_vectors.T), axis=1)[:, :k]
+    hits = sum(any(doc_ids[i] in expected for i in row) for row, (_, expected) in zip(top, queries))
+    return hits / len(queries)
+
+
+def latency(model, queries, batch_texts, rounds):
+    """返回 (单条查询p50, p95, 批量吞吐)，时间单位毫秒"""
+    single = []
+    for query, _ in queries[:rounds]:
+        start = time.perf_counter()
+        model.get_query_embedding(query)
+        single.append(time.perf_counter() - start)
+    single.sort()
+    start = time.perf_counter()
+    embed(model, batch_texts)
+    throughput = len(batch_texts) / (time.perf_counter() - start)
+    return percentile(single, 0.5) * 1000, percentile(single, 0.95) * 1000, throughput
+
+
+def main(args):
+    ids, texts, queries = load_corpus(args.kb, args.queries)
+    query_texts = [query for query, _ in queries]
+    batch_texts = texts[: args.batch_texts]
+    print(f"文档 {len(texts)} 条, 查询 {len(queries)} 条")
+
+    reference, _ = create_embed_model("huggingface", args.model, threads=max(args.threads))
+    ref_docs = embed(reference, texts)
+    ref_queries = embed(reference, query_texts)
+    baseline = recall(ref_queries, ref_docs, ids, queries, args.k)
+    del reference
+
+    failed = False
+    print(
+        f"\n{'后端':<18} {'线程':>4} {'平均cos':>8} {'最小cos':>8} {'R@' + str(args.k) + '混用':>9} "
+        f"{'R@' + str(args.k):>7} {'p50(ms)':>8} {'p95(ms)':>8} {'texts/s':>8}"
+    )
+    print(f"{'参考(fp32)':<18} {'':>4} {1:>8.4f} {1:>8.4f} {baseline:>9.3f} {baseline:>7.3f}")
+    for backend in args.backends:
+        drift = None
+        for threads in args.threads:
+            model, used = create_embed_model(backend, args.model, threads=threads)
+            if used != backend:
+                print(f"{backend:<18} 加载失败，跳过")
+                break
+            if drift is None:
+                docs = embed(model, texts)
+                cand_queries = embed(model, query_texts)
+                cosine = np.concatenate([(docs * ref_docs).sum(axis=1), (cand_queries * ref_queries).sum(axis=1)])
+                drift = (
+                    cosine.mean(),
+                    cosine.min(),
+                    recall(cand_queries, ref_docs, ids, queries, args.k),
+                    recall(cand_queries, docs, ids, queries, args.k),
+                )
+                failed |= drift[1] < args.min_cosine or baseline - drift[3] > args.max_recall_drop
+            p50, p95, throughput = latency(model, queries, batch_texts, args.rounds)
+            print(
+                f"{backend:<18} {threads:>4} {drift[0]:>8.4f} {drift[1]:>8.4f} {drift[2]:>9.3f} {drift[3]:>7.3f} "
+                f"{p50:>8.2f} {p95:>8.2f} {throughput:>8.1f}"
+            )
+            del model
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="embedding后端的漂移、检索质量与延迟基准")
+    parser.add_argument("--backends", nargs="+", default=[b for b in BACKENDS if b != "huggingface"], choices=BACKENDS)
+    parser.add_argument("--model", default=EMBEDDING_MODEL_PATH)
+    parser.add_argument("--kb", nargs="+", default=list(KNOWLEDGE_BASES), choices=sorted(KNOWLEDGE_BASES))
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4], help="推理线程数")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=100, help="每个类别最多使用的查询数")
+    parser.add_argument("--rounds", type=int, default=200, help="测量单条查询延迟的次数")
+    parser.add_argument("--batch-texts", type=int, default=512, help="测量批量吞吐的文档数")
+    parser.add_argument("--min-cosine", type=float, default=0.99)
+    parser.add_argument("--max-recall-drop", type=float, default=0.02)
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,121 @@
+"""混合检索基准：对比纯向量、纯BM25、混合检索（含精确匹配短路）的单次延迟和recall@k
+
+从数据文件生成带标注的查询集，每条查询对应一条期望命中的文档：
+    exact   原样的谜面 / 咒语英文名
+    keyword 在谜面、咒语名前后加上口语化的修饰
+每种检索方式使用独立的执行器并关闭缓存，结果不受先后顺序影响。
+
+用法（在server目录下）:
+    python benchmarks/bench_hybrid.py --kb riddles magic --k 1 3 5
+"""
+import argparse
+import asyncio
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chromadb  # noqa: E402
+from llama_index.embeddings.huggingface import HuggingFaceEmbedding  # noqa: E402
+
+from _common import field_value, percentile  # noqa: E402
+from knowledge_base import KNOWLEDGE_BASES, KnowledgeBase  # noqa: E402
+from retrieval import RetrievalExecutor  # noqa: E402
+from settings import DATA_DIR, EMBEDDING_MODEL_PATH  # noqa: E402
+
+_LATIN = re.compile(r"[A-Za-z][A-Za-z '\-]*[A-Za-z]")
+
+
+def build_queries(kb_name, documents, limit):
+    """返回 [(类别, 查询, 期望文档id)]"""
+    queries = []
+    for doc in documents:
+        text = doc.get_content()
+        if kb_name == "riddles":
+            question = field_value(text, "问题").rstrip("？?")
+            queries.append(("exact", question, doc.id_))
+            queries.append(("keyword", f"请问{question}，答案是什么", doc.id_))
+        elif kb_name == "magic":
+            names = _LATIN.findall(field_value(text, "咒语"))
+            if names:
+                queries.append(("exact", names[0], doc.id_))
+                queries.append(("keyword", f"{names[0]}这个咒语有什么用", doc.id_))
+        if len(queries) >= limit:
+            break
+    return queries
+
+
+async def evaluate(search, queries, ks):
+    max_k = max(ks)
+    hits = {k: 0 for k in ks}
+    latencies = []
+    for _, query, expected in queries:
+        start = time.perf_counter()
+        nodes = await search(query, max_k)
+        latencies.append(time.perf_counter() - start)
+        ids = [item.node.node_id for item in nodes]
+        for k in ks:
+            hits[k] += expected in ids[:k]
+    latencies.sort()
+    recall = {k: hits[k] / len(queries) for k in ks}
+    return recall, percentile(latencies, 0.5), percentile(latencies, 0.99)
+
+
+async def main(args):
+    embed_model = HuggingFaceEmbedding(model_name=args.model)
+    workdir = tempfile.mkdtemp(prefix="hybrid_bench_")
+    try:
+        client = chromadb.PersistentClient(path=os.path.join(workdir, "chroma"))
+        for kb_name in args.kb:
+            spec = KNOWLEDGE_BASES[kb_name]
+            if spec.retrieval_mode != "hybrid":
+                print(f"{spec.display_name}未启用混合检索，跳过")
+                continue
+            kb = KnowledgeBase(spec, DATA_DIR, workdir)
+            kb.sync(client, embed_model=embed_model)
+            queries = build_queries(kb_name, kb.iter_documents(), args.queries)
+
+            def executor():
+                return RetrievalExecutor(embed_model, embedding_cache_size=0, result_cache_size=0)
+
+            vector_executor, hybrid_executor = executor(), executor()
+
+            async def vector(query, k):
+                return await vector_executor.retrieve(kb.index, query, k)
+
+            async def bm25(query, k):
+                return kb.lexical.search(query, k)
+
+            async def hybrid(query, k):
+                return await hybrid_executor.retrieve(kb.index, query, k, lexical=kb.lexical)
+
+            # 预热
+            await vector(queries[0][1], 1)
+
+            print(f"\n{spec.display_name}: {len(kb.lexical)}条文档, {len(queries)}条查询")
+            header = " ".join(f"{'R@' + str(k):>7}" for k in args.k)
+            print(f"{'类别':<8} {'方式':<8} {header} {'p50(ms)':>9} {'p99(ms)':>9}")
+            for category in ("exact", "keyword"):
+                subset = [q for q in queries if q[0] == category]
+                for name, search in (("向量", vector), ("BM25", bm25), ("混合", hybrid)):
+                    recall, p50, p99 = await evaluate(search, subset, args.k)
+                    cells = " ".join(f"{recall[k]:>7.3f}" for k in args.k)
+                    print(f"{category:<8} {name:<8} {cells} {p50 * 1000:>9.2f} {p99 * 1000:>9.2f}")
+            print(f"混合检索精确匹配短路: {hybrid_executor.exact_hits}次")
+            vector_executor.shutdown()
+            hybrid_executor.shutdown()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="混合检索基准测试")
+    parser.add_argument("--model", default=EMBEDDING_MODEL_PATH)
+    parser.add_argument("--kb", nargs="+", default=["riddles", "magic"], choices=sorted(KNOWLEDGE_BASES))
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 3, 5])
+    parser.add_argument("--queries", type=int, default=400, help="每个知识库最多生成的查询数")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,80 @@
+"""导入吞吐基准：在不同批大小和进程数下，测量流式导入的速度（docs/sec）
+
+以我的世界问答为模板生成指定条数的JSONL合成数据，每组参数写入一个新的临时collection。
+
+用法（在server目录下）:
+    python benchmarks/bench_ingest.py --docs 20000 --batch-sizes 64 256 1024 --workers 0 2 4
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chromadb  # noqa: E402
+from llama_index.core.schema import Document  # noqa: E402
+from llama_index.embeddings.huggingface import HuggingFaceEmbedding  # noqa: E402
+
+from _common import peak_rss_mb  # noqa: E402
+from ingest import ingest_documents, iter_records  # noqa: E402
+from knowledge_base import content_hash  # noqa: E402
+from settings import DATA_DIR, EMBEDDING_MODEL_PATH  # noqa: E402
+
+
+def write_synthetic_jsonl(path, count):
+    with open(os.path.join(DATA_DIR, "minecraft", "minecraft.json"), "r", encoding="utf-8") as f:
+        seed = json.load(f)
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(count):
+            item = seed[i % len(seed)]
+            record = {"question": f"{item['question']} (#{i})", "answer": item["answer"]}
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def iter_documents(path):
+    for record in iter_records(path):
+        text = f"Question: {record['question']}\nAnswer: {record['answer']}"
+        yield Document(text=text, id_=content_hash(text))
+
+
+def main(args):
+    workdir = tempfile.mkdtemp(prefix="ingest_bench_")
+    try:
+        data_path = os.path.join(workdir, "synthetic.jsonl")
+        write_synthetic_jsonl(data_path, args.docs)
+        client = chromadb.PersistentClient(path=os.path.join(workdir, "chroma"))
+        embed_model = HuggingFaceEmbedding(model_name=args.model) if 0 in args.workers else None
+
+        print(f"文档数: {args.docs}")
+        print(f"{'批大小':>6} {'进程数':>6} {'耗时(s)':>9} {'docs/sec':>10} {'峰值RSS(MB)':>12}")
+        for workers in args.workers:
+            for batch_size in args.batch_sizes:
+                name = f"bench_{workers}_{batch_size}"
+                collection = client.get_or_create_collection(name)
+                start = time.perf_counter()
+                written = ingest_documents(
+                    iter_documents(data_path),
+                    collection,
+                    embed_model=embed_model,
+                    model_path=args.model,
+                    batch_size=batch_size,
+                    workers=workers,
+                )
+                elapsed = time.perf_counter() - start
+                print(f"{batch_size:>6} {workers:>6} {elapsed:>9.2f} {written / elapsed:>10.1f} {peak_rss_mb():>12.0f}")
+                client.delete_collection(name)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="流式导入吞吐基准测试")
+    parser.add_argument("--model", default=EMBEDDING_MODEL_PATH)
+    parser.add_argument("--docs", type=int, default=20000)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[64, 256, 1024])
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 2, 4])
+    main(parser.parse_args())
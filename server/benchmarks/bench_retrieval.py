@@ -0,0 +1,68 @@
+"""检索执行器基准：对比事件循环内同步检索与线程池+微批处理检索的延迟和QPS
+
+用法（在server目录下）:
+    python benchmarks/bench_retrieval.py --clients 1 8 64 --requests 256
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llama_index.core import VectorStoreIndex  # noqa: E402
+from llama_index.core.schema import Document  # noqa: E402
+from llama_index.embeddings.huggingface import HuggingFaceEmbedding  # noqa: E402
+
+from _common import percentile, run_clients  # noqa: E402
+from app import DATA_DIR, EMBEDDING_MODEL_PATH  # noqa: E402
+from retrieval import RetrievalExecutor  # noqa: E402
+
+
+def load_riddles():
+    with open(os.path.join(DATA_DIR, "riddle", "data.json"), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+async def main(args):
+    embed_model = HuggingFaceEmbedding(model_name=args.model)
+    riddles = load_riddles()
+    documents = [
+        Document(text=f"问题: {r['instruction']}\n回答: {r['output']}", id_=f"riddle_{i}")
+        for i, r in enumerate(riddles)
+    ]
+    index = VectorStoreIndex.from_documents(documents, embed_model=embed_model)
+    queries = [riddles[i % len(riddles)]["instruction"] for i in range(args.requests)]
+
+    executor = RetrievalExecutor(embed_model, max_workers=args.workers, batch_window=args.window_ms / 1000)
+
+    async def per_request(query):
+        # 与原实现相同：在async接口内直接同步调用retrieve
+        return index.as_retriever(similarity_top_k=3).retrieve(query)
+
+    async def batched(query):
+        return await executor.retrieve(index, query, 3)
+
+    # 预热，避免首次调用的模型初始化开销计入结果
+    await per_request(queries[0])
+    await batched(queries[0])
+
+    print(f"查询数: {args.requests}, 线程数: {args.workers}, 批处理窗口: {args.window_ms}ms")
+    print(f"{'方式':<10} {'并发':>6} {'QPS':>10} {'p50(ms)':>10} {'p99(ms)':>10}")
+    for clients in args.clients:
+        for name, handler in (("逐个同步", per_request), ("执行器", batched)):
+            qps, latencies = await run_clients(handler, queries, clients)
+            p50, p99 = percentile(latencies, 0.5), percentile(latencies, 0.99)
+            print(f"{name:<10} {clients:>6} {qps:>10.1f} {p50 * 1000:>10.1f} {p99 * 1000:>10.1f}")
+    executor.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="检索执行器基准测试")
+    parser.add_argument("--model", default=EMBEDDING_MODEL_PATH)
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 8, 64])
+    parser.add_argument("--requests", type=int, default=256)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--window-ms", type=float, default=5)
+    asyncio.run(main(parser.parse_args()))
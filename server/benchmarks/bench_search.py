@@ -0,0 +1,73 @@
+"""跨知识库检索基准：对比依次调用/query、/query-minecraft、/query-magic与一次/search的延迟
+
+需要先启动服务器，并关闭检索缓存，避免重复查询直接命中缓存:
+    EMBEDDING_CACHE_SIZE=0 RETRIEVAL_CACHE_SIZE=0 python app.py
+
+用法（在server目录下）:
+    python benchmarks/bench_search.py --url http://127.0.0.1:8000 --requests 100 --concurrency 1 8
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from _common import percentile, run_clients  # noqa: E402
+from settings import DATA_DIR  # noqa: E402
+
+LEGACY_ENDPOINTS = ("/query", "/query-minecraft", "/query-magic")
+
+
+def load_queries(count):
+    """从三个数据文件中轮流取问题"""
+    with open(os.path.join(DATA_DIR, "riddle", "data.json"), "r", encoding="utf-8") as f:
+        riddles = [item["instruction"] for item in json.load(f)]
+    with open(os.path.join(DATA_DIR, "minecraft", "minecraft.json"), "r", encoding="utf-8") as f:
+        minecraft = [item["question"] for item in json.load(f)]
+    with open(os.path.join(DATA_DIR, "magic", "harry_potter_spells_clean.json"), "r", encoding="utf-8") as f:
+        magic = [item["描述"] for item in json.load(f) if item.get("描述") != "名称未知"]
+    pools = (riddles, minecraft, magic)
+    return [pools[i % 3][(i // 3) % len(pools[i % 3])] for i in range(count)]
+
+
+async def main(args):
+    queries = load_queries(args.requests)
+    async with httpx.AsyncClient(base_url=args.url, timeout=60) as client:
+        ready = await client.get("/ready")
+        if ready.status_code != 200:
+            print(f"服务器尚未就绪: {ready.text}")
+            return
+
+        async def sequential(query):
+            for endpoint in LEGACY_ENDPOINTS:
+                response = await client.post(endpoint, params={"query": query})
+                response.raise_for_status()
+
+        async def fan_out(query):
+            response = await client.post("/search", json={"query": query, "timeout_ms": args.timeout_ms})
+            response.raise_for_status()
+
+        # 预热
+        await sequential(queries[0])
+        await fan_out(queries[0])
+
+        print(f"查询数: {args.requests}")
+        print(f"{'方式':<10} {'并发':>6} {'QPS':>10} {'p50(ms)':>10} {'p99(ms)':>10}")
+        for concurrency in args.concurrency:
+            for name, handler in (("依次调用", sequential), ("/search", fan_out)):
+                qps, latencies = await run_clients(handler, queries, concurrency)
+                p50, p99 = percentile(latencies, 0.5), percentile(latencies, 0.99)
+                print(f"{name:<10} {concurrency:>6} {qps:>10.1f} {p50 * 1000:>10.1f} {p99 * 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="跨知识库检索基准测试")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--timeout-ms", type=float, default=5000)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,66 @@
+"""启动基准：测量不同加载方式下的端口可用时间和全部知识库就绪时间
+
+分别在空的持久化目录（冷启动，需要创建索引）和已有索引的目录（热启动，直接加载）上启动服务器，
+轮询/health得到开始接受请求的时间，轮询/ready得到全部知识库就绪的时间。
+
+用法（在server目录下）:
+    python benchmarks/bench_startup.py --modes eager background
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from _common import wait_until
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(mode, persist_dir, port, timeout):
+    env = dict(os.environ, KB_LOAD_MODE=mode, PERSIST_DIR=persist_dir)
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--log-level", "warning"],
+        cwd=SERVER_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        deadline = start + timeout
+        bound = wait_until(f"http://127.0.0.1:{port}/health", deadline, proc)
+        ready = wait_until(f"http://127.0.0.1:{port}/ready", deadline, proc)
+        state = httpx.get(f"http://127.0.0.1:{port}/health", timeout=5).json()
+        return bound - start, ready - start, state
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+
+
+def main(args):
+    print(f"{'方式':<12} {'场景':<6} {'可接受请求(s)':>14} {'全部就绪(s)':>12}  各知识库加载耗时(s)")
+    for mode in args.modes:
+        persist_dir = tempfile.mkdtemp(prefix="chroma_bench_")
+        try:
+            for case in ("冷启动", "热启动"):
+                bound, ready, state = measure(mode, persist_dir, args.port, args.timeout)
+                per_kb = ", ".join(
+                    f"{name}={kb['load_seconds']}" for name, kb in state["knowledge_bases"].items()
+                )
+                model = state["embedding_model"]["load_seconds"]
+                print(f"{mode:<12} {case:<6} {bound:>14.2f} {ready:>12.2f}  模型={model}, {per_kb}")
+        finally:
+            shutil.rmtree(persist_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="服务器启动基准测试")
+    parser.add_argument("--modes", nargs="+", default=["eager", "background"], choices=["eager", "background"])
+    parser.add_argument("--port", type=int, default=8031)
+    parser.add_argument("--timeout", type=float, default=600)
+    main(parser.parse_args())
@@ -0,0 +1,186 @@
+"""向量后端基准：对比ChromaVectorStore与内存映射的MmapVectorStore（精确 / float16 / IVF）
+
+用带聚类结构的合成单位向量构建同样内容的Chroma collection和向量快照，每个后端在独立子进程中测量:
+    load     打开存储到第一次查询返回的时间（Chroma含PersistentClient与HNSW索引加载）
+    p50/p95  单条查询（与服务端相同的 as_retriever(top_k).retrieve 路径）的延迟
+    rss      加载并查询后的常驻内存增量，分为匿名内存（进程私有）和文件映射（多个worker可共享）
+    recall   与暴力精确检索相比的recall@k
+
+用法（在server目录下）:
+    python benchmarks/bench_vector_store.py --sizes 1000 10000 100000 --dim 384
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+
+VARIANTS = {
+    "chroma": None,
+    "numpy": {"dtype": "float32", "ivf_min_docs": 0},
+    "numpy-f16": {"dtype": "float16", "ivf_min_docs": 0},
+    "numpy-ivf": {"dtype": "float32", "ivf_min_docs": 1},
+}
+
+
+def memory_mb():
+    """当前进程的 (匿名内存, 文件映射内存)，单位MB，仅Linux"""
+    fields = {}
+    with open("/proc/self/status", "r") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            fields[key] = value
+    return int(fields["RssAnon"].split()[0]) / 1024, int(fields["RssFile"].split()[0]) / 1024
+
+
+def synthetic(size, dim, n_queries, seed=0):
+    """围绕若干中心生成单位向量，查询为随机文档加噪声，接近真实embedding的分布"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(8, size // 200), dim))
+    vectors = centers[rng.integers(len(centers), size=size)] + 0.6 * rng.normal(size=(size, dim))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    queries = vectors[rng.integers(size, size=n_queries)] + 0.3 * rng.normal(size=(n_queries, dim))
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    return vectors.astype(np.float32), queries.astype(np.float32)
+
+
+def build(workdir, vectors, variants):
+    import chromadb
+
+    from vector_store import MmapVectorStore, VectorStoreConfig
+
+    ids = [f"doc-{i}" for i in range(len(vectors))]
+    documents = [f"synthetic document {i}" for i in range(len(vectors))]
+    metadatas = [{"row": i} for i in range(len(vectors))]
+    seconds = {}
+    for name in variants:
+        start = time.perf_counter()
+        if VARIANTS[name] is None:
+            client = chromadb.PersistentClient(path=os.path.join(workdir, "chroma"))
+            collection = client.get_or_create_collection("bench")
+            for offset in range(0, len(vectors), 5000):
+                end = offset + 5000
+                collection.add(
+                    ids=ids[offset:end],
+                    embeddings=vectors[offset:end].tolist(),
+                    documents=documents[offset:end],
+                    metadatas=metadatas[offset:end],
+                )
+        else:
+            config = VectorStoreConfig(**VARIANTS[name])
+            MmapVectorStore.build(os.path.join(workdir, name), ids, vectors, documents, metadatas, config)
+        seconds[name] = round(time.perf_counter() - start, 3)
+    return seconds
+
+
+def worker(args):
+    """子进程：打开一个后端，测量加载、查询延迟与内存，结果以JSON输出到标准输出"""
+    from llama_index.core import VectorStoreIndex
+    from llama_index.core.embeddings import MockEmbedding
+    from llama_index.core.schema import QueryBundle
+
+    import chromadb
+    from llama_index.vector_stores.chroma import ChromaVectorStore
+
+    from vector_store import MmapVectorStore, VectorStoreConfig
+
+    queries = np.load(args.query_file)
+    anon_before, file_before = memory_mb()
+    start = time.perf_counter()
+    if VARIANTS[args.worker] is None:
+        client = chromadb.PersistentClient(path=os.path.join(args.workdir, "chroma"))
+        vector_store = ChromaVectorStore(chroma_collection=client.get_collection("bench"))
+        index = VectorStoreIndex.from_vector_store(vector_store, embed_model=MockEmbedding(embed_dim=queries.shape[1]))
+    else:
+        config = VectorStoreConfig(nprobe=args.nprobe, **VARIANTS[args.worker])
+        index = MmapVectorStore.open(os.path.join(args.workdir, args.worker), config)
+    retriever = index.as_retriever(similarity_top_k=args.top_k)
+
+    def run(embedding):
+        nodes = retriever.retrieve(QueryBundle(query_str="", embedding=embedding.tolist()))
+        return [int(item.node.metadata["row"]) for item in nodes]
+
+    found = [run(queries[0])]
+    load_seconds = time.perf_counter() - start
+
+    latencies = []
+    for embedding in queries[1:]:
+        query_start = time.perf_counter()
+        found.append(run(embedding))
+        latencies.append(time.perf_counter() - query_start)
+    latencies.sort()
+    anon_after, file_after = memory_mb()
+    print(
+        json.dumps(
+            {
+                "load_seconds": round(load_seconds, 4),
+                "p50_ms": round(latencies[len(latencies) // 2] * 1000, 3),
+                "p95_ms": round(latencies[int(len(latencies) * 0.95)] * 1000, 3),
+                "rss_anon_mb": round(anon_after - anon_before, 1),
+                "rss_file_mb": round(file_after - file_before, 1),
+                "found": found,
+            }
+        )
+    )
+
+
+def recall(found, exact):
+    hits = sum(len(set(f) & set(e)) for f, e in zip(found, exact))
+    return hits / max(1, sum(len(e) for e in exact))
+
+
+def main(args):
+    print(f"{'文档数':>8} {'后端':<10} {'构建(s)':>8} {'加载(s)':>8} {'p50(ms)':>8} {'p95(ms)':>8} "
+          f"{'匿名(MB)':>9} {'映射(MB)':>9} {'recall':>7}")
+    for size in args.sizes:
+        vectors, queries = synthetic(size, args.dim, args.queries + 1)
+        scores = queries @ vectors.T
+        exact = [list(np.argsort(-row)[: args.top_k]) for row in scores]
+
+        workdir = tempfile.mkdtemp(prefix="bench_vectors_")
+        try:
+            query_path = os.path.join(workdir, "queries.npy")
+            np.save(query_path, queries)
+            build_seconds = build(workdir, vectors, args.variants)
+            for name in args.variants:
+                output = subprocess.run(
+                    [
+                        sys.executable, __file__, "--worker", name, "--workdir", workdir, "--query-file", query_path,
+                        "--top-k", str(args.top_k), "--nprobe", str(args.nprobe),
+                    ],
+                    capture_output=True, text=True, check=True,
+                ).stdout
+                result = json.loads(output.strip().splitlines()[-1])
+                print(
+                    f"{size:>8} {name:<10} {build_seconds[name]:>8.2f} {result['load_seconds']:>8.3f} "
+                    f"{result['p50_ms']:>8.3f} {result['p95_ms']:>8.3f} {result['rss_anon_mb']:>9.1f} "
+                    f"{result['rss_file_mb']:>9.1f} {recall(result['found'], exact):>7.3f}"
+                )
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="向量后端基准测试")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--dim", type=int, default=384, help="向量维度，默认与paraphrase-multilingual-MiniLM-L12-v2相同")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--nprobe", type=int, default=32)
+    parser.add_argument("--variants", nargs="+", default=list(VARIANTS), choices=list(VARIANTS))
+    parser.add_argument("--worker", choices=list(VARIANTS), help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    parser.add_argument("--query-file", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        worker(args)
+    else:
+        main(args)
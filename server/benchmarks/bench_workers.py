@@ -0,0 +1,154 @@
+"""多worker部署基准：随worker数增加，每个worker的内存与总吞吐（queries/sec）如何变化
+
+对每个worker数和embedding模式（shared共享服务进程 / local每个worker各自加载模型）启动一次serve.py，
+等全部worker就绪后用并发客户端持续请求/kb/{kb}/query，并统计进程树的内存（仅Linux）:
+    worker RSS   每个worker的常驻内存（含共享页）
+    worker PSS   每个worker按比例分摊共享页后的内存，反映实际增加的内存
+    总PSS        全部进程（启动进程、embedding服务、worker）PSS之和
+
+各级缓存在基准中关闭，每个请求都会计算向量并检索。
+
+用法（在server目录下）:
+    python benchmarks/bench_workers.py --workers 1 2 4 --modes shared local --duration 10
+"""
+import argparse
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import httpx
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def descendants(pid):
+    """进程的全部子孙进程id"""
+    found = []
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children", "r") as f:
+            children = [int(child) for child in f.read().split()]
+    except OSError:
+        return found
+    for child in children:
+        found.append(child)
+        found += descendants(child)
+    return found
+
+
+def memory_mb(pid):
+    """返回进程的 (RSS, PSS)，单位MB"""
+    fields = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                fields[key] = value
+        return int(fields["Rss"].split()[0]) / 1024, int(fields["Pss"].split()[0]) / 1024
+    except (OSError, KeyError, ValueError):
+        return float("nan"), float("nan")
+
+
+async def wait_workers(client, workers, timeout):
+    """等待/health中出现workers个不同的pid，且全部知识库就绪"""
+    deadline = time.perf_counter() + timeout
+    ready = set()
+    while time.perf_counter() < deadline:
+        try:
+            # 每次探测使用新连接，才能分配到不同的worker
+            response = await client.get("/health", headers={"Connection": "close"})
+            body = response.json()
+            if all(kb["status"] == "ready" for kb in body["knowledge_bases"].values()):
+                ready.add(body["pid"])
+                if len(ready) >= workers:
+                    return ready
+        except (httpx.HTTPError, ValueError):
+            pass
+        await asyncio.sleep(0.05)
+    raise RuntimeError(f"{timeout}秒内只有{len(ready)}个worker就绪")
+
+
+async def load(client, kb_name, concurrency, duration):
+    done = 0
+    deadline = time.perf_counter() + duration
+
+    async def worker(offset):
+        nonlocal done
+        i = offset
+        while time.perf_counter() < deadline:
+            # 每个请求使用不同的查询文本，避免重复计算被合并
+            response = await client.post(f"/kb/{kb_name}/query", params={"query": f"how to find diamonds {i}"})
+            response.raise_for_status()
+            done += 1
+            i += concurrency
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    return done / (time.perf_counter() - start)
+
+
+async def run(args, workers, mode, port):
+    env = dict(
+        os.environ,
+        EMBEDDING_CACHE_SIZE="0",
+        RETRIEVAL_CACHE_SIZE="0",
+        SEMANTIC_CACHE_SIZE="0",
+        LOG_SAMPLE_RATE="0",
+    )
+    process = subprocess.Popen(
+        [sys.executable, "serve.py", "--workers", str(workers), "--port", str(port), "--embedding", mode],
+        cwd=SERVER_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=60) as client:
+            start = time.perf_counter()
+            worker_pids = await wait_workers(client, workers, args.startup_timeout)
+            startup = time.perf_counter() - start
+            qps = await load(client, args.kb, args.concurrency, args.duration)
+
+        tree = [process.pid] + descendants(process.pid)
+        usage = {pid: memory_mb(pid) for pid in tree}
+        worker_usage = [usage[pid] for pid in worker_pids if pid in usage]
+        return {
+            "startup": startup,
+            "qps": qps,
+            "worker_rss": sum(rss for rss, _ in worker_usage) / len(worker_usage),
+            "worker_pss": sum(pss for _, pss in worker_usage) / len(worker_usage),
+            "total_pss": sum(pss for _, pss in usage.values()),
+        }
+    finally:
+        process.send_signal(signal.SIGINT)
+        try:
+            process.wait(30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+async def main(args):
+    print(f"{'模式':<8} {'worker':>6} {'就绪(s)':>8} {'QPS':>8} {'worker RSS':>11} {'worker PSS':>11} {'总PSS':>9}")
+    port = args.port
+    for mode in args.modes:
+        for workers in args.workers:
+            result = await run(args, workers, mode, port)
+            port += 1  # 避免上一轮的端口还处于TIME_WAIT
+            print(
+                f"{mode:<8} {workers:>6} {result['startup']:>8.1f} {result['qps']:>8.1f} "
+                f"{result['worker_rss']:>10.0f}M {result['worker_pss']:>10.0f}M {result['total_pss']:>8.0f}M"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="多worker部署的内存与吞吐基准")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--modes", nargs="+", default=["shared", "local"], choices=["shared", "local"])
+    parser.add_argument("--kb", default="minecraft")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--startup-timeout", type=float, default=300.0)
+    asyncio.run(main(parser.parse_args()))
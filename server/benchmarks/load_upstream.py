@@ -0,0 +1,72 @@
+"""上游客户端压测：对本地模拟DeepSeek服务器发起并发请求，观察吞吐随并发数的变化
+
+用法（在server目录下）:
+    python benchmarks/load_upstream.py --latency 0.2 --requests 128 --concurrency 1 4 16 64
+"""
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+
+import uvicorn
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mock_deepseek  # noqa: E402
+from _common import percentile, run_clients  # noqa: E402
+from upstream import DeepSeekClient  # noqa: E402
+
+
+def start_mock_server(port, latency):
+    """在后台线程中启动模拟服务器，返回uvicorn.Server以便结束时关闭"""
+    mock_deepseek.MOCK_LATENCY = latency
+    config = uvicorn.Config(mock_deepseek.app, host="127.0.0.1", port=port, log_level="warning")
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+async def run_level(client, total, concurrency):
+    async def send(i):
+        payload = {
+            "model": "deepseek-chat",
+            "messages": [{"role": "user", "content": f"问题{i}"}],
+        }
+        await client.chat(payload)
+
+    qps, latencies = await run_clients(send, range(total), concurrency)
+    return qps, percentile(latencies, 0.5), percentile(latencies, 0.99)
+
+
+async def main(args):
+    url = f"http://127.0.0.1:{args.port}/v1/chat/completions"
+    client = DeepSeekClient(url, "mock-key", max_concurrency=max(args.concurrency))
+    await client.start()
+    print(f"模拟上游延迟: {args.latency}s, 每档请求数: {args.requests}")
+    print(f"{'并发':>6} {'吞吐(req/s)':>12} {'p50(ms)':>10} {'p99(ms)':>10}")
+    try:
+        for concurrency in args.concurrency:
+            qps, p50, p99 = await run_level(client, args.requests, concurrency)
+            print(f"{concurrency:>6} {qps:>12.1f} {p50 * 1000:>10.1f} {p99 * 1000:>10.1f}")
+    finally:
+        await client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="DeepSeek上游客户端并发压测")
+    parser.add_argument("--port", type=int, default=8011)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--requests", type=int, default=128)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    args = parser.parse_args()
+
+    server = start_mock_server(args.port, args.latency)
+    try:
+        asyncio.run(main(args))
+    finally:
+        server.should_exit = True
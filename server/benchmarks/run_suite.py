@@ -0,0 +1,340 @@
+"""基准测试套件：用data/中的数据构建三个知识库，评测检索质量与延迟，并在本地模拟上游下测量服务端指标
+
+报告内容：
+    构建   各知识库的索引构建时间与文档数、embedding模型加载时间
+    检索   按查询类别（exact原文 / paraphrase改写 / crosslingual中文查英文）统计recall@k、MRR与p50/p95/p99延迟
+    服务   启动到可接受请求、到全部就绪的时间，/query与/chat/completions的端到端延迟，服务进程的RSS
+
+查询集由数据文件确定性生成（跨语言查询见queries/minecraft_zh.json），上游为mock_deepseek.py，
+不同提交之间的结果可以直接比较。--output保存结果，--baseline与之前保存的结果对比，出现退化时返回码为1。
+
+用法（在server目录下）:
+    python benchmarks/run_suite.py --output bench.json
+    python benchmarks/run_suite.py --baseline bench.json --tolerance 0.2
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+
+import chromadb  # noqa: E402
+
+from _common import field_value, latency_summary, peak_rss_mb, wait_until  # noqa: E402
+from embeddings import BACKENDS, create_embed_model  # noqa: E402
+from knowledge_base import KNOWLEDGE_BASES, KnowledgeBase  # noqa: E402
+from retrieval import RetrievalExecutor  # noqa: E402
+from settings import DATA_DIR, EMBEDDING_MODEL_PATH  # noqa: E402
+
+QUERIES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "queries")
+_LATIN = re.compile(r"[A-Za-z][A-Za-z '\-]*[A-Za-z]")
+_CJK_NAME = re.compile(r"^[一-鿿]+")
+
+
+def process_rss_mb(pid):
+    """返回进程当前与峰值RSS（MB），不支持的平台返回NaN"""
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+        return int(fields["VmRSS"].split()[0]) / 1024, int(fields["VmHWM"].split()[0]) / 1024
+    except (OSError, KeyError, ValueError):
+        try:
+            import psutil
+
+            info = psutil.Process(pid).memory_info()
+            return info.rss / (1 << 20), getattr(info, "peak_wset", info.rss) / (1 << 20)
+        except Exception:
+            return float("nan"), float("nan")
+
+
+# ====== 查询集 ======
+def build_query_sets(kb_name, documents):
+    """返回 {类别: [(查询, 期望命中的文档id集合)]}，同一问题对应多条文档时命中任意一条即可"""
+    by_key = {}
+    sets = {"exact": [], "paraphrase": []}
+
+    if kb_name == "riddles":
+        for doc in documents:
+            by_key.setdefault(field_value(doc.get_content(), "问题"), set()).add(doc.id_)
+        for i, (question, ids) in enumerate(by_key.items()):
+            sets["exact"].append((question, ids))
+            bare = question.rstrip("？?")
+            paraphrase = f"考考你：{bare}，猜一猜" if i % 2 else bare.replace("什么", "啥") + "呀"
+            sets["paraphrase"].append((paraphrase, ids))
+
+    elif kb_name == "magic":
+        for doc in documents:
+            text = doc.get_content()
+            names = _LATIN.findall(field_value(text, "咒语"))
+            chinese = _CJK_NAME.findall(field_value(text, "描述"))
+            if names:
+                sets["exact"].append((names[0], {doc.id_}))
+            if chinese and chinese[0] != "名称未知":
+                sets["paraphrase"].append((f"{chinese[0]}是什么咒语，有什么效果", {doc.id_}))
+
+    elif kb_name == "minecraft":
+        for doc in documents:
+            by_key.setdefault(field_value(doc.get_content(), "Question"), set()).add(doc.id_)
+        for question, ids in by_key.items():
+            sets["exact"].append((question, ids))
+            body = question.replace(" in Minecraft", "").rstrip("?")
+            sets["paraphrase"].append((f"Could you tell me: {body[0].lower()}{body[1:]}", ids))
+        with open(os.path.join(QUERIES_DIR, "minecraft_zh.json"), "r", encoding="utf-8") as f:
+            sets["crosslingual"] = [(item["query"], by_key[item["question"]]) for item in json.load(f)]
+
+    return sets
+
+
+def sample(queries, limit, seed=0):
+    if limit and len(queries) > limit:
+        return random.Random(seed).sample(queries, limit)
+    return queries
+
+
+# ====== 检索评测 ======
+async def evaluate(executor, kb, queries, ks):
+    max_k = max(ks)
+    hits = {k: 0 for k in ks}
+    reciprocal_ranks = 0.0
+    latencies = []
+    for query, expected in queries:
+        start = time.perf_counter()
+        nodes = await executor.retrieve(kb.index, query, max_k, lexical=kb.lexical)
+        latencies.append(time.perf_counter() - start)
+        ids = [item.node.node_id for item in nodes]
+        rank = next((i for i, node_id in enumerate(ids, 1) if node_id in expected), None)
+        if rank is not None:
+            reciprocal_ranks += 1 / rank
+            for k in ks:
+                hits[k] += rank <= k
+    n = len(queries)
+    return {
+        "queries": n,
+        "recall": {str(k): round(hits[k] / n, 4) for k in ks},
+        "mrr": round(reciprocal_ranks / n, 4),
+        **latency_summary(latencies),
+    }
+
+
+async def run_retrieval(args, workdir, results):
+    start = time.perf_counter()
+    embed_model, backend = create_embed_model(args.embedding_backend, args.model, warmup=False)
+    results["build"] = {
+        "embedding_backend": backend,
+        "model_load_seconds": round(time.perf_counter() - start, 3),
+        "knowledge_bases": {},
+    }
+    client = chromadb.PersistentClient(path=workdir)
+    # 关闭缓存，每条查询都走完整的检索路径
+    executor = RetrievalExecutor(embed_model, embedding_cache_size=0, result_cache_size=0)
+    results["retrieval"] = {}
+
+    print(f"{'知识库':<10} {'文档数':>6} {'构建(s)':>8}")
+    for name in args.kb:
+        kb = KnowledgeBase(KNOWLEDGE_BASES[name], DATA_DIR, workdir)
+        stats = kb.sync(client, embed_model=embed_model, force=True)
+        count = kb.collection.count()
+        results["build"]["knowledge_bases"][name] = {"docs": count, "seconds": stats["seconds"]}
+        print(f"{name:<10} {count:>6} {stats['seconds']:>8.2f}")
+
+        await executor.retrieve(kb.index, "warm up", 1)
+        query_sets = build_query_sets(name, list(kb.iter_documents()))
+        results["retrieval"][name] = {}
+        for category, queries in query_sets.items():
+            report = await evaluate(executor, kb, sample(queries, args.queries), args.k)
+            results["retrieval"][name][category] = report
+
+    executor.shutdown()
+    results["build"]["peak_rss_mb"] = round(peak_rss_mb(), 1)
+
+    header = " ".join(f"{'R@' + str(k):>6}" for k in args.k)
+    print(f"\n{'知识库':<10} {'类别':<13} {'查询数':>6} {header} {'MRR':>6} {'p50(ms)':>8} {'p95(ms)':>8} {'p99(ms)':>8}")
+    for name, categories in results["retrieval"].items():
+        for category, r in categories.items():
+            cells = " ".join(f"{r['recall'][str(k)]:>6.3f}" for k in args.k)
+            print(
+                f"{name:<10} {category:<13} {r['queries']:>6} {cells} {r['mrr']:>6.3f} "
+                f"{r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} {r['p99_ms']:>8.2f}"
+            )
+    print(f"评测进程峰值RSS: {results['build']['peak_rss_mb']:.0f}MB")
+
+
+# ====== 服务端指标 ======
+def timed_requests(send, count):
+    latencies = []
+    for i in range(count):
+        start = time.perf_counter()
+        send(i).raise_for_status()
+        latencies.append(time.perf_counter() - start)
+    return latency_summary(latencies)
+
+
+def run_server(args, workdir, results):
+    mock_url = f"http://127.0.0.1:{args.port + 1}/v1/chat/completions"
+    mock = subprocess.Popen(
+        [sys.executable, "mock_deepseek.py", "--port", str(args.port + 1), "--latency", str(args.upstream_latency)],
+        cwd=SERVER_DIR,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    env = dict(
+        os.environ,
+        PERSIST_DIR=workdir,
+        DEEPSEEK_API_URL=mock_url,
+        KB_LOAD_MODE="background",
+        # 关闭各级缓存与快速回答，测量完整的检索 + 上游调用路径
+        EMBEDDING_CACHE_SIZE="0",
+        RETRIEVAL_CACHE_SIZE="0",
+        SEMANTIC_CACHE_SIZE="0",
+        FAST_ANSWER_ENABLED="false",
+        # 压测客户端只有一个，不限流
+        RATE_LIMIT_PER_SECOND="0",
+    )
+    base = f"http://127.0.0.1:{args.port}"
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(args.port), "--log-level", "warning"],
+        cwd=SERVER_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        deadline = start + args.timeout
+        wait_until(mock_url, deadline, mock, expect_status=None)
+        bound = wait_until(f"{base}/health", deadline, server) - start
+        ready = wait_until(f"{base}/ready", deadline, server) - start
+
+        with httpx.Client(base_url=base, timeout=60) as client:
+            query = timed_requests(
+                lambda i: client.post("/kb/riddles/query", params={"query": f"第{i}个谜语是什么"}), args.requests
+            )
+            chat = timed_requests(
+                lambda i: client.post(
+                    "/chat/completions",
+                    json={
+                        "model": "deepseek-chat",
+                        "persona": ("riddle_master", "steve", "wizard")[i % 3],
+                        "messages": [{"role": "user", "content": f"给我讲讲第{i}个知识点"}],
+                    },
+                ),
+                args.requests,
+            )
+        rss, peak = process_rss_mb(server.pid)
+    finally:
+        server.terminate()
+        mock.terminate()
+        server.wait(timeout=30)
+        mock.wait(timeout=30)
+
+    results["server"] = {
+        "startup_bound_seconds": round(bound, 3),
+        "startup_ready_seconds": round(ready, 3),
+        "query": query,
+        "chat": chat,
+        "upstream_latency": args.upstream_latency,
+        "rss_mb": round(rss, 1),
+        "peak_rss_mb": round(peak, 1),
+    }
+    print(f"\n服务启动: 可接受请求 {bound:.2f}s, 全部就绪 {ready:.2f}s（已有索引）")
+    print(f"{'接口':<20} {'p50(ms)':>8} {'p95(ms)':>8} {'p99(ms)':>8}")
+    for name, r in (("/kb/riddles/query", query), ("/chat/completions", chat)):
+        print(f"{name:<20} {r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} {r['p99_ms']:>8.2f}")
+    print(f"服务进程RSS: {rss:.0f}MB（峰值 {peak:.0f}MB），模拟上游延迟 {args.upstream_latency}s")
+
+
+# ====== 与基线对比 ======
+def flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, path + "."))
+        elif isinstance(value, (int, float)):
+            flat[path] = value
+    return flat
+
+
+def _noise_floor(key):
+    # 亚毫秒级的延迟、很小的内存波动不算退化
+    if key.endswith("_ms"):
+        return 1.0
+    if key.endswith("seconds"):
+        return 0.05
+    if key.endswith("_mb"):
+        return 10.0
+    return 0.0
+
+
+def compare(results, baseline, tolerance, recall_drop):
+    """质量指标（recall、MRR）下降超过recall_drop，或耗时、内存增加超过tolerance比例时视为退化"""
+    current, previous = flatten(results), flatten(baseline)
+    regressions = []
+    for key, old in previous.items():
+        new = current.get(key)
+        if new is None or key.endswith(("queries", "docs", "upstream_latency")):
+            continue
+        if ".recall." in key or key.endswith(".mrr"):
+            if old - new > recall_drop:
+                regressions.append(f"{key}: {old} -> {new}")
+        elif old > 0 and (new - old) / old > tolerance and new - old > _noise_floor(key):
+            regressions.append(f"{key}: {old} -> {new} (+{(new - old) / old:.0%})")
+    return regressions
+
+
+def main(args):
+    workdir = tempfile.mkdtemp(prefix="bench_suite_")
+    results = {"created_at": time.strftime("%Y-%m-%d %H:%M:%S"), "k": args.k}
+    try:
+        asyncio.run(run_retrieval(args, workdir, results))
+        if not args.skip_server:
+            run_server(args, workdir, results)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存到 {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance, args.recall_drop)
+        if regressions:
+            print(f"\n与基线 {args.baseline} 相比出现退化:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print(f"\n与基线 {args.baseline} 相比没有退化")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="检索质量与延迟基准测试套件")
+    parser.add_argument("--model", default=EMBEDDING_MODEL_PATH)
+    parser.add_argument("--embedding-backend", choices=BACKENDS, default="huggingface")
+    parser.add_argument("--kb", nargs="+", default=list(KNOWLEDGE_BASES), choices=sorted(KNOWLEDGE_BASES))
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 3, 5])
+    parser.add_argument("--queries", type=int, default=200, help="每个类别最多使用的查询数（固定随机种子抽样）")
+    parser.add_argument("--skip-server", action="store_true", help="只评测检索，不启动服务器")
+    parser.add_argument("--port", type=int, default=8041, help="服务器端口，模拟上游使用port+1")
+    parser.add_argument("--requests", type=int, default=50, help="每个接口的请求数")
+    parser.add_argument("--upstream-latency", type=float, default=0.05)
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--output", help="保存结果的JSON文件")
+    parser.add_argument("--baseline", help="用于对比的基线结果JSON文件")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="耗时、内存允许增加的比例")
+    parser.add_argument("--recall-drop", type=float, default=0.02, help="recall、MRR允许下降的绝对值")
+    sys.exit(main(parser.parse_args()))
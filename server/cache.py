@@ -0,0 +1,84 @@
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+# 句末的标点不影响语义，归一化时去掉
+_TRAILING_PUNCT = "？?！!。.，,、~～…"
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_query(text):
+    """归一化查询文本：全半角统一、大小写折叠、合并空白、去掉句末标点"""
+    text = unicodedata.normalize("NFKC", text or "")
+    text = _WHITESPACE.sub(" ", text).strip().casefold()
+    return text.rstrip(_TRAILING_PUNCT).strip()
+
+
+class TTLLRUCache:
+    """容量有界的LRU缓存，条目超过ttl秒后过期（ttl为None或0时不过期）"""
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (过期时间, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        """返回 (是否命中, 值)"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return False, None
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return False, None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return True, value
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, predicate=None):
+        """删除满足predicate(key)的条目，不传predicate时清空，返回删除的条目数"""
+        with self._lock:
+            if predicate is None:
+                removed = len(self._data)
+                self._data.clear()
+                return removed
+            keys = [key for key in self._data if predicate(key)]
+            for key in keys:
+                del self._data[key]
+            return len(keys)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
@@ -0,0 +1,189 @@
+"""请求合并（single-flight）：key相同的并发请求只执行一次，结果由所有等待者共享
+
+- run：普通请求，后到的请求等待第一个请求的结果（成功或异常）；
+- stream：流式请求，只有一个生产者读取上游，每个订阅者从头收到全部事件，
+  中途加入的订阅者先补发已产生的事件。全部订阅者断开时取消生产者（同时取消上游请求）。
+
+只合并同时在执行中的请求，执行结束后key即被移除，不缓存结果。
+调用方可以传入截止时间（time.monotonic()）：进行中的执行截止时间更宽松（或没有）时不合并，
+单独执行，避免截止时间更紧的请求沿用先到请求的设置；优先级等其他准入参数应放进key。
+"""
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class _StreamFlight:
+    def __init__(self):
+        self.events = []
+        self.done = False
+        self.result = None  # 生产者正常结束时的完整结果
+        self.subscribers = 0
+        self.deadline = None
+        self.ready = asyncio.get_running_loop().create_future()
+        self.changed = asyncio.Condition()
+        self.task = None
+
+
+class _Subscription:
+    """一个订阅者的事件迭代器
+
+    迭代结束、出错、被取消、aclose()或对象被回收（从未迭代，例如客户端在第一个分片前断开）时
+    退出订阅，且只退出一次；最后一个订阅者退出时生产者被取消。
+    """
+
+    def __init__(self, owner, flight, on_complete):
+        self._owner = owner
+        self._flight = flight
+        self._events = owner._subscribe(flight, on_complete)
+        self._left = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self._events.__anext__()
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        if not self._left:
+            self._left = True
+            self._owner._leave(self._flight)
+
+    async def aclose(self):
+        try:
+            await self._events.aclose()
+        finally:
+            self.close()
+
+    def __del__(self):
+        self.close()
+
+
+def _looser(current, deadline):
+    """进行中的执行的截止时间current是否比调用方的deadline宽松"""
+    return deadline is not None and (current is None or current > deadline)
+
+
+class SingleFlight:
+    def __init__(self, on_coalesced=None):
+        self.on_coalesced = on_coalesced  # 请求被合并时调用 on_coalesced(key)
+        self._calls = {}  # key -> (asyncio.Task, 截止时间)
+        self._streams = {}  # key -> _StreamFlight
+        self.leaders = 0
+        self.coalesced = 0
+
+    def _joined(self, key):
+        self.coalesced += 1
+        if self.on_coalesced is not None:
+            self.on_coalesced(key)
+
+    async def run(self, key, factory, deadline=None):
+        """返回 await factory() 的结果；同一key已在执行时等待该次执行"""
+        call = self._calls.get(key)
+        if call is not None and _looser(call[1], deadline):
+            self.leaders += 1
+            return await factory()
+        if call is None:
+            self.leaders += 1
+            task = asyncio.ensure_future(factory())
+            self._calls[key] = (task, deadline)
+            task.add_done_callback(lambda done: self._finish_call(key, done))
+        else:
+            task = call[0]
+            self._joined(key)
+        # 某个等待者被取消（客户端断开）时不影响其他等待者
+        return await asyncio.shield(task)
+
+    def _finish_call(self, key, task):
+        if self._calls.get(key, (None,))[0] is task:
+            del self._calls[key]
+        if not task.cancelled():
+            task.exception()  # 没有等待者时避免“exception was never retrieved”警告
+
+    async def stream(self, key, factory, on_complete=None, deadline=None):
+        """返回事件的异步迭代器（订阅）
+
+        factory(publish_result)完成准备工作（如检索）后返回事件的异步迭代器，生产者正常结束前
+        调用publish_result(结果)；准备工作出错时异常在这里抛出。事件全部发送完后，
+        各订阅者的on_complete(结果)分别被调用。不再读取时应调用订阅的aclose()。
+        """
+        flight = self._streams.get(key)
+        if flight is None or _looser(flight.deadline, deadline):
+            self.leaders += 1
+            flight = _StreamFlight()
+            flight.deadline = deadline
+            if key not in self._streams:
+                self._streams[key] = flight
+            flight.task = asyncio.ensure_future(self._produce(key, flight, factory))
+        else:
+            self._joined(key)
+        flight.subscribers += 1
+        subscription = _Subscription(self, flight, on_complete)
+        try:
+            await asyncio.shield(flight.ready)
+        except BaseException:
+            subscription.close()
+            raise
+        return subscription
+
+    async def _produce(self, key, flight, factory):
+        def publish_result(result):
+            flight.result = result
+
+        source = None
+        try:
+            source = await factory(publish_result)
+            flight.ready.set_result(None)
+            async for event in source:
+                async with flight.changed:
+                    flight.events.append(event)
+                    flight.changed.notify_all()
+        except (Exception, asyncio.CancelledError) as e:
+            if not flight.ready.done():
+                # 准备阶段出错：由各订阅者的stream()调用抛出同一个异常
+                if isinstance(e, asyncio.CancelledError):
+                    flight.ready.cancel()
+                else:
+                    flight.ready.set_exception(e)
+                    flight.ready.exception()
+            elif not isinstance(e, asyncio.CancelledError):
+                logger.exception("合并的流式请求出错")
+        finally:
+            if source is not None:
+                await source.aclose()
+            if self._streams.get(key) is flight:
+                del self._streams[key]
+            async with flight.changed:
+                flight.done = True
+                flight.changed.notify_all()
+
+    async def _subscribe(self, flight, on_complete):
+        sent = 0
+        while True:
+            async with flight.changed:
+                await flight.changed.wait_for(lambda: len(flight.events) > sent or flight.done)
+                pending = flight.events[sent:]
+            for event in pending:
+                yield event
+            sent += len(pending)
+            if flight.done and sent == len(flight.events):
+                break
+        if on_complete is not None and flight.result is not None:
+            on_complete(flight.result)
+
+    def _leave(self, flight):
+        flight.subscribers -= 1
+        if flight.subscribers <= 0 and not flight.done and flight.task is not None:
+            flight.task.cancel()
+
+    def stats(self):
+        return {
+            "in_flight": len(self._calls) + len(self._streams),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+        }
@@ -0,0 +1,192 @@
+"""语义回答缓存：同一角色下意思相同的问题复用之前DeepSeek的完整回答
+
+按 (角色, max_tokens) 分区保存 查询向量 -> 回答，查询时计算与分区内所有向量的余弦相似度，
+超过阈值即命中。条目数有上限，按最近使用淘汰；可选持久化到SQLite，重启后继续使用。
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def _unit(embedding):
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class SemanticCompletionCache:
+    def __init__(self, maxsize=1000, threshold=0.92, max_temperature=0.8, ttl=None, persist_path=None):
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self.max_temperature = max_temperature
+        self.ttl = ttl or None
+        self.persist_path = persist_path
+        self._entries = OrderedDict()  # id -> 条目，按最近使用排序
+        self._matrices = {}  # 分区 -> (id列表, 向量矩阵)，条目变化时重建
+        self._lock = threading.Lock()
+        self._db = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.saved_seconds = 0.0
+        if persist_path:
+            self._open_db()
+
+    def _open_db(self):
+        os.makedirs(os.path.dirname(self.persist_path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(self.persist_path, check_same_thread=False)
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS completions (
+                id TEXT PRIMARY KEY, scope TEXT, query TEXT, embedding BLOB,
+                response TEXT, latency REAL, created REAL, last_used REAL)"""
+        )
+        rows = self._db.execute(
+            "SELECT id, scope, query, embedding, response, latency, created FROM completions "
+            "ORDER BY last_used DESC LIMIT ?",
+            (self.maxsize,),
+        ).fetchall()
+        for entry_id, scope, query, embedding, response, latency, created in reversed(rows):
+            self._entries[entry_id] = {
+                "scope": scope,
+                "query": query,
+                "embedding": np.frombuffer(embedding, dtype=np.float32),
+                "response": json.loads(response),
+                "latency": latency,
+                "created": created,
+            }
+        # 超出上限的旧条目直接从磁盘删除
+        self._db.execute(
+            "DELETE FROM completions WHERE id NOT IN (SELECT id FROM completions ORDER BY last_used DESC LIMIT ?)",
+            (self.maxsize,),
+        )
+        self._db.commit()
+        if rows:
+            logger.info(f"已从{self.persist_path}恢复{len(rows)}条语义缓存")
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    @staticmethod
+    def scope(persona, max_tokens):
+        return f"{persona}:{max_tokens}"
+
+    def cacheable(self, temperature):
+        """temperature过高时回答本应有随机性，不使用缓存"""
+        return self.maxsize > 0 and (temperature or 0) <= self.max_temperature
+
+    def _matrix(self, scope):
+        cached = self._matrices.get(scope)
+        if cached is None:
+            ids = [entry_id for entry_id, entry in self._entries.items() if entry["scope"] == scope]
+            vectors = np.stack([self._entries[i]["embedding"] for i in ids]) if ids else None
+            cached = self._matrices[scope] = (ids, vectors)
+        return cached
+
+    def _remove(self, entry_id):
+        entry = self._entries.pop(entry_id)
+        self._matrices.pop(entry["scope"], None)
+        if self._db is not None:
+            self._db.execute("DELETE FROM completions WHERE id = ?", (entry_id,))
+
+    def get(self, scope, embedding):
+        """返回 (回答, 相似度)，未命中时返回 (None, 最高相似度)"""
+        query = _unit(embedding)
+        with self._lock:
+            ids, vectors = self._matrix(scope)
+            best_id, best_score = None, 0.0
+            if vectors is not None:
+                scores = vectors @ query
+                best = int(np.argmax(scores))
+                best_id, best_score = ids[best], float(scores[best])
+
+            entry = self._entries.get(best_id) if best_score >= self.threshold else None
+            if entry is not None and self.ttl and time.time() - entry["created"] > self.ttl:
+                self._remove(best_id)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None, best_score
+
+            self._entries.move_to_end(best_id)
+            self.hits += 1
+            self.saved_seconds += entry["latency"]
+            if self._db is not None:
+                self._db.execute("UPDATE completions SET last_used = ? WHERE id = ?", (time.time(), best_id))
+                self._db.commit()
+            return entry["response"], best_score
+
+    def set(self, scope, query, embedding, response, latency):
+        """保存一次上游回答，latency为这次上游调用（含检索）的耗时，命中时计入节省的时间"""
+        if self.maxsize <= 0:
+            return
+        entry_id = uuid.uuid4().hex
+        now = time.time()
+        entry = {
+            "scope": scope,
+            "query": query,
+            "embedding": _unit(embedding),
+            "response": response,
+            "latency": latency,
+            "created": now,
+        }
+        with self._lock:
+            self._entries[entry_id] = entry
+            self._matrices.pop(scope, None)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT INTO completions VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        entry_id,
+                        scope,
+                        query,
+                        entry["embedding"].tobytes(),
+                        json.dumps(response, ensure_ascii=False),
+                        latency,
+                        now,
+                        now,
+                    ),
+                )
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+            if self._db is not None:
+                self._db.commit()
+
+    def invalidate(self, persona):
+        """知识库内容变化后清除该角色的全部缓存回答"""
+        with self._lock:
+            stale = [i for i, entry in self._entries.items() if entry["scope"].startswith(persona + ":")]
+            for entry_id in stale:
+                self._remove(entry_id)
+            if self._db is not None:
+                self._db.commit()
+        if stale:
+            logger.info(f"已清除角色{persona}的{len(stale)}条语义缓存")
+        return len(stale)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "threshold": self.threshold,
+                "max_temperature": self.max_temperature,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "saved_seconds": round(self.saved_seconds, 3),
+                "persist_path": self.persist_path,
+            }
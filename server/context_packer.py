@@ -0,0 +1,86 @@
+"""按token预算组装参考内容：按检索分数依次放入整条文档，去掉近似重复的文档，超出预算时整条丢弃或按行裁剪"""
+import re
+from dataclasses import dataclass
+
+_CJK = re.compile(r"[　-〿㐀-䶿一-鿿豈-﫿＀-￯]")
+_NON_WORD = re.compile(r"[\W_]+")
+
+
+def estimate_tokens(text):
+    """估算DeepSeek的token数：中文（含全角标点）约0.6 token/字，其他字符约0.3 token/字"""
+    if not text:
+        return 0
+    cjk = len(_CJK.findall(text))
+    return int(cjk * 0.6 + (len(text) - cjk) * 0.3) + 1
+
+
+def _shingles(text):
+    text = _NON_WORD.sub("", text.casefold())
+    return {text[i : i + 2] for i in range(max(1, len(text) - 1))}
+
+
+def _trim_lines(text, budget):
+    """按行裁剪到预算以内，一行都放不下时返回空字符串"""
+    kept, used = [], estimate_tokens("...")
+    for line in text.splitlines():
+        cost = estimate_tokens(line + "\n")
+        if used + cost > budget:
+            break
+        kept.append(line)
+        used += cost
+    return "\n".join(kept) + "\n..." if kept else ""
+
+
+@dataclass
+class PackedContext:
+    text: str
+    tokens: int  # 放入的参考内容token数
+    original_tokens: int  # 检索结果全部放入时的token数
+    used: int = 0  # 放入的文档数（含裁剪的）
+    trimmed: int = 0
+    dropped: int = 0
+    duplicates: int = 0
+
+    @property
+    def tokens_saved(self):
+        return self.original_tokens - self.tokens
+
+
+def pack_context(nodes, budget, dedupe_threshold=0.9, min_trim_tokens=64, separator="\n\n"):
+    """把检索到的节点按分数从高到低放入budget个token以内
+
+    与已放入的文档双字Jaccard相似度不低于dedupe_threshold的文档视为重复；
+    放不下的文档在剩余预算不少于min_trim_tokens时按行裁剪，否则丢弃并继续尝试后面更短的文档。
+    """
+    ordered = sorted(nodes, key=lambda item: item.score if item.score is not None else 0.0, reverse=True)
+    separator_cost = estimate_tokens(separator)
+    parts, shingles = [], []
+    result = PackedContext(text="", tokens=0, original_tokens=0)
+    remaining = budget
+
+    for item in ordered:
+        text = item.node.get_content().strip()
+        cost = estimate_tokens(text)
+        result.original_tokens += cost + (separator_cost if result.original_tokens else 0)
+        grams = _shingles(text)
+        if any(len(grams & seen) / len(grams | seen) >= dedupe_threshold for seen in shingles):
+            result.duplicates += 1
+            continue
+
+        cost += separator_cost if parts else 0
+        if cost > remaining:
+            trimmed = _trim_lines(text, remaining - (separator_cost if parts else 0))
+            if remaining < min_trim_tokens or not trimmed:
+                result.dropped += 1
+                continue
+            text, cost = trimmed, estimate_tokens(trimmed) + (separator_cost if parts else 0)
+            result.trimmed += 1
+
+        parts.append(text)
+        shingles.append(grams)
+        remaining -= cost
+        result.tokens += cost
+        result.used += 1
+
+    result.text = separator.join(parts)
+    return result
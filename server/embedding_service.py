@@ -0,0 +1,195 @@
+"""共享embedding服务：由一个进程加载模型，多个uvicorn worker通过本地socket请求查询向量
+
+模型只在服务进程中加载一次，worker中用RemoteEmbedding代替本地模型，接口相同。
+服务端把batch_window时间窗口内各worker发来的请求合并成一次模型批量调用。
+连接使用multiprocessing.connection（TCP，仅监听127.0.0.1），需要与启动方一致的authkey。
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing.connection import Client, Listener
+from typing import List
+
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from pydantic import PrivateAttr
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingService:
+    """服务端：每个连接一个线程接收请求，由一个线程按时间窗口合并后调用模型"""
+
+    def __init__(
+        self, embed_model, address=("127.0.0.1", 0), authkey=None, batch_window=0.005, max_batch_size=256, signature=None
+    ):
+        self.embed_model = embed_model
+        self.signature = signature  # 模型实际使用的后端与模型文件，见embeddings.embedding_signature
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.listener = Listener(address, authkey=authkey)
+        self.requests = 0
+        self.batches = 0
+        self._queue = queue.Queue()
+
+    @property
+    def address(self):
+        return self.listener.address
+
+    def serve_forever(self):
+        threading.Thread(target=self._batch_loop, name="embedding-batch", daemon=True).start()
+        while True:
+            try:
+                conn = self.listener.accept()
+            except OSError:
+                break
+            except Exception as e:
+                # authkey不匹配等，拒绝该连接后继续服务
+                logger.warning(f"拒绝embedding服务连接: {e}")
+                continue
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def close(self):
+        self.listener.close()
+
+    def _handle(self, conn):
+        with conn:
+            while True:
+                try:
+                    command, payload = conn.recv()
+                except (EOFError, OSError):
+                    return
+                if command == "embed":
+                    future = Future()
+                    self._queue.put((payload, future))
+                    try:
+                        conn.send(("ok", future.result()))
+                    except Exception as e:
+                        conn.send(("error", str(e)))
+                elif command == "signature":
+                    conn.send(("ok", self.signature))
+                elif command == "stats":
+                    conn.send(("ok", {"requests": self.requests, "batches": self.batches}))
+                else:
+                    conn.send(("error", f"未知的命令: {command}"))
+
+    def _batch_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            size = len(batch[0][0])
+            deadline = time.perf_counter() + self.batch_window
+            while size < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(item)
+                size += len(item[0])
+
+            texts = list(dict.fromkeys(text for payload, _ in batch for text in payload))
+            try:
+                embeddings = np.asarray(self.embed_model.get_text_embedding_batch(texts), dtype=np.float32)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            rows = {text: i for i, text in enumerate(texts)}
+            for payload, future in batch:
+                future.set_result(embeddings[[rows[text] for text in payload]])
+            self.requests += len(batch)
+            self.batches += 1
+
+
+def run_service(model_path, authkey, ready, address=("127.0.0.1", 0), batch_window=0.005, max_batch_size=256):
+    """服务进程入口：加载模型后通过ready（Pipe的一端）告知实际监听地址，然后一直提供服务"""
+    from embeddings import create_embed_model, embedding_signature
+    from log_config import setup_logging
+
+    setup_logging()
+    try:
+        start = time.perf_counter()
+        embed_model, backend = create_embed_model(model_path=model_path)
+        service = EmbeddingService(
+            embed_model, address, authkey, batch_window, max_batch_size, signature=embedding_signature(embed_model)
+        )
+    except Exception as e:
+        ready.send(("error", str(e)))
+        raise
+    logger.info(f"embedding服务已启动: {service.address[0]}:{service.address[1]}，后端{backend}，模型加载耗时{time.perf_counter() - start:.2f}秒")
+    ready.send(("ok", service.address))
+    ready.close()
+    service.serve_forever()
+
+
+def parse_address(value):
+    host, _, port = value.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+class RemoteEmbedding(BaseEmbedding):
+    """客户端：与HuggingFaceEmbedding接口相同，向量由embedding服务计算
+
+    每个线程同时只使用一个连接，空闲连接放回连接池复用；连接断开时重连一次。
+    """
+
+    _address: tuple = PrivateAttr()
+    _authkey: bytes = PrivateAttr()
+    _idle: queue.LifoQueue = PrivateAttr()
+
+    def __init__(self, address, authkey, **kwargs):
+        super().__init__(model_name=f"remote:{address[0]}:{address[1]}", **kwargs)
+        self._address = tuple(address)
+        self._authkey = authkey
+        self._idle = queue.LifoQueue()
+
+    @classmethod
+    def class_name(cls):
+        return "RemoteEmbedding"
+
+    def _request(self, command, payload):
+        for attempt in range(2):
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = Client(self._address, authkey=self._authkey)
+            try:
+                conn.send((command, payload))
+                status, result = conn.recv()
+            except (EOFError, OSError):
+                conn.close()
+                if attempt:
+                    raise
+                continue
+            self._idle.put(conn)
+            if status != "ok":
+                raise RuntimeError(f"embedding服务出错: {result}")
+            return result
+
+    def stats(self):
+        return self._request("stats", None)
+
+    def embedding_signature(self):
+        return self._request("signature", None)
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        return self._request("embed", list(texts)).tolist()
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embeddings([text])[0]
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        # 当前模型对查询和文档不加前缀，与RetrievalExecutor一致
+        return self._get_text_embedding(query)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._get_query_embedding(query)
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embedding(text)
@@ -0,0 +1,244 @@
+"""embedding模型的创建：PyTorch（原有）、PyTorch int8动态量化、ONNX Runtime（fp32 / int8）
+
+配置项（环境变量或config.json）:
+    EMBEDDING_BACKEND    huggingface（默认）/ huggingface-int8 / onnx / onnx-int8
+    EMBEDDING_THREADS    推理线程数，0表示由运行时决定
+    EMBEDDING_WARMUP     启动时先计算几条文本预热，默认开启
+    EMBEDDING_ONNX_PATH  直接指定ONNX模型文件，默认使用 {模型目录}/onnx/ 下的文件
+
+所选后端加载失败时（未安装onnxruntime、找不到ONNX模型文件等）记录警告并回退到huggingface。
+实际使用的后端和模型文件记在模型上（embedding_signature()），知识库清单据此判断索引向量是否需要重新计算。
+
+ONNX后端只依赖onnxruntime和tokenizers（chromadb已依赖这两个包），按sentence-transformers的方式
+做池化和归一化，输出与HuggingFaceEmbedding一致。{模型目录}/onnx/model.onnx不存在且安装了
+transformers时，从PyTorch模型导出；int8模型由onnxruntime.quantization动态量化生成（需要onnx包）。
+"""
+import json
+import logging
+import os
+import time
+from typing import List
+
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from pydantic import PrivateAttr
+
+from settings import EMBEDDING_MODEL_PATH, get_setting
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("huggingface", "huggingface-int8", "onnx", "onnx-int8")
+WARMUP_TEXTS = ("预热", "warm up the embedding model", "阿瓦达索命咒是什么咒语？")
+
+
+def _read_json(path, default=None):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+class OnnxEmbedding(BaseEmbedding):
+    """用ONNX Runtime计算sentence-transformers模型的向量（均值或CLS池化后L2归一化）"""
+
+    max_length: int = 128
+    pooling: str = "mean"
+    _session: object = PrivateAttr()
+    _tokenizer: object = PrivateAttr()
+    _input_names: list = PrivateAttr()
+
+    def __init__(self, onnx_path, model_dir, threads=0, **kwargs):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        # 与sentence-transformers相同：最大长度取sentence_bert_config.json，池化方式取1_Pooling/config.json
+        st_config = _read_json(os.path.join(model_dir, "sentence_bert_config.json"), {})
+        pooling = _read_json(os.path.join(model_dir, "1_Pooling", "config.json"), {})
+        super().__init__(
+            model_name=onnx_path,
+            max_length=st_config.get("max_seq_length", 128),
+            pooling="cls" if pooling.get("pooling_mode_cls_token") else "mean",
+            **kwargs,
+        )
+
+        tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        tokenizer.enable_truncation(self.max_length)
+        pad_token = next((token for token in ("<pad>", "[PAD]") if tokenizer.token_to_id(token) is not None), None)
+        tokenizer.enable_padding(pad_id=tokenizer.token_to_id(pad_token) if pad_token else 0, pad_token=pad_token or "[PAD]")
+        self._tokenizer = tokenizer
+
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        self._session = onnxruntime.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+        self._input_names = [item.name for item in self._session.get_inputs()]
+
+    @classmethod
+    def class_name(cls):
+        return "OnnxEmbedding"
+
+    def _embed(self, texts):
+        encodings = self._tokenizer.encode_batch(list(texts))
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feeds = {"input_ids": input_ids, "attention_mask": mask, "token_type_ids": np.zeros_like(input_ids)}
+        output = self._session.run(None, {name: feeds[name] for name in self._input_names})[0]
+        if output.ndim == 3:
+            if self.pooling == "cls":
+                output = output[:, 0]
+            else:
+                weights = mask[:, :, None].astype(np.float32)
+                output = (output * weights).sum(axis=1) / np.clip(weights.sum(axis=1), 1e-9, None)
+        norms = np.linalg.norm(output, axis=1, keepdims=True)
+        return (output / np.clip(norms, 1e-12, None)).tolist()
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(texts) if texts else []
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._embed([text])[0]
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._embed([query])[0]
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._get_query_embedding(query)
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embedding(text)
+
+
+def resolve_model_dir(model_path):
+    """本地目录直接返回；否则视为HuggingFace模型名，下载ONNX推理需要的文件"""
+    if os.path.isdir(model_path):
+        return model_path
+    from huggingface_hub import snapshot_download
+
+    return snapshot_download(model_path, allow_patterns=["*.json", "1_Pooling/*", "onnx/model.onnx"])
+
+
+def export_onnx(model_dir, output_path):
+    """把PyTorch模型导出为ONNX（需要torch和transformers），同时保证目录中有tokenizer.json"""
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(model_dir)
+    if not os.path.exists(os.path.join(model_dir, "tokenizer.json")):
+        tokenizer.save_pretrained(model_dir)
+    model = AutoModel.from_pretrained(model_dir).eval()
+    sample = tokenizer(list(WARMUP_TEXTS), padding=True, return_tensors="pt")
+    names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+    axes = {name: {0: "batch", 1: "sequence"} for name in names + ["last_hidden_state"]}
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            tuple(sample[name] for name in names),
+            output_path,
+            input_names=names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=axes,
+            opset_version=14,
+        )
+    logger.info(f"已导出ONNX模型: {output_path}")
+
+
+def onnx_model_path(model_dir, quantized):
+    """返回ONNX模型文件路径，文件不存在时导出或量化生成"""
+    configured = get_setting("EMBEDDING_ONNX_PATH")
+    if configured:
+        return configured
+    fp32_path = os.path.join(model_dir, "onnx", "model.onnx")
+    if not os.path.exists(fp32_path):
+        legacy_path = os.path.join(model_dir, "model.onnx")
+        if os.path.exists(legacy_path):
+            fp32_path = legacy_path
+        else:
+            export_onnx(model_dir, fp32_path)
+    if not quantized:
+        return fp32_path
+
+    int8_path = os.path.join(os.path.dirname(fp32_path), "model_int8.onnx")
+    if not os.path.exists(int8_path):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+        logger.info(f"已生成int8量化模型: {int8_path}")
+    return int8_path
+
+
+def _load(backend, model_path, threads):
+    if backend in ("onnx", "onnx-int8"):
+        model_dir = resolve_model_dir(model_path)
+        return OnnxEmbedding(onnx_model_path(model_dir, backend == "onnx-int8"), model_dir, threads=threads)
+
+    from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+
+    if threads:
+        try:
+            import torch
+
+            torch.set_num_threads(threads)
+        except ImportError:
+            pass
+    if backend == "huggingface-int8":
+        import torch
+
+        embed_model = HuggingFaceEmbedding(model_name=model_path, device="cpu")
+        # 只量化Linear层的权重，激活值在推理时动态量化
+        torch.quantization.quantize_dynamic(embed_model._model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+        return embed_model
+    return HuggingFaceEmbedding(model_name=model_path)
+
+
+def _model_file(path):
+    return os.path.abspath(path) if os.path.exists(path) else path
+
+
+def embedding_signature(embed_model):
+    """返回模型实际使用的后端与模型文件 {"backend", "model"}；无法确定时（如测试用的模型）返回None
+
+    RemoteEmbedding向embedding服务查询服务进程中模型的signature。
+    """
+    remote = getattr(embed_model, "embedding_signature", None)
+    if callable(remote):
+        return remote()
+    return getattr(embed_model, "_embedding_signature", None)
+
+
+def warm_up(embed_model):
+    """先计算几条文本，让第一次真实查询不必承担懒加载和内存分配的开销"""
+    start = time.perf_counter()
+    embed_model.get_text_embedding_batch(list(WARMUP_TEXTS))
+    return time.perf_counter() - start
+
+
+def create_embed_model(backend=None, model_path=None, threads=None, warmup=None):
+    """按配置创建embedding模型，返回 (模型, 实际使用的后端)"""
+    backend = backend or get_setting("EMBEDDING_BACKEND", "huggingface")
+    model_path = model_path or EMBEDDING_MODEL_PATH
+    threads = get_setting("EMBEDDING_THREADS", 0, int) if threads is None else threads
+    warmup = get_setting("EMBEDDING_WARMUP", True, bool) if warmup is None else warmup
+    if backend not in BACKENDS:
+        logger.warning(f"未知的embedding后端{backend}，使用huggingface")
+        backend = "huggingface"
+
+    start = time.perf_counter()
+    try:
+        embed_model = _load(backend, model_path, threads)
+    except Exception as e:
+        if backend == "huggingface":
+            raise
+        logger.warning(f"embedding后端{backend}加载失败，回退到huggingface: {e}")
+        backend = "huggingface"
+        embed_model = _load(backend, model_path, threads)
+    # ONNX后端记录实际加载的.onnx文件（fp32或int8），huggingface后端记录模型目录或名称
+    model_file = embed_model.model_name if isinstance(embed_model, OnnxEmbedding) else model_path
+    embed_model._embedding_signature = {"backend": backend, "model": _model_file(model_file)}
+    message = f"embedding模型加载完成: {backend}, 耗时{time.perf_counter() - start:.2f}秒"
+    if warmup:
+        message += f", 预热{warm_up(embed_model) * 1000:.0f}毫秒"
+    logger.info(message)
+    return embed_model, backend
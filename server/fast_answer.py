@@ -0,0 +1,102 @@
+"""已知问题的快速回答：问题完全相同（或足够相似）时直接套用模板回答，不经过检索和大模型"""
+import re
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Optional
+
+from cache import normalize_query
+
+# 计算相似度前去掉所有标点和空白
+_NON_WORD = re.compile(r"[\W_]+")
+
+
+@dataclass(frozen=True)
+class FastAnswerConfig:
+    """知识库的快速回答配置"""
+
+    question_field: str  # 数据记录中的问题字段
+    answer_field: str  # 数据记录中的答案字段
+    template: str  # 回答模板，可使用{answer}和{question}
+    similarity: Optional[float] = None  # 近似问题的字符双字Dice相似度阈值，None表示只做精确匹配
+
+
+def _bigrams(text):
+    text = _NON_WORD.sub("", text)
+    if len(text) < 2:
+        return {text} if text else set()
+    return {text[i : i + 2] for i in range(len(text) - 1)}
+
+
+class AnswerIndex:
+    """归一化问题 -> 答案 的哈希表，以及用于近似匹配的双字倒排索引
+
+    同一个问题在数据中对应多个不同答案时不做快速回答，交给大模型结合检索内容回答。
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.answers = {}  # 归一化问题 -> (原问题, 答案)
+        self.ambiguous = 0
+        self._questions = []
+        self._bigrams = []
+        self._postings = defaultdict(list)  # 双字 -> [问题序号]
+
+    @classmethod
+    def from_records(cls, records, config):
+        index = cls(config)
+        seen = defaultdict(set)
+        originals = {}
+        for record in records:
+            if not isinstance(record, dict):
+                continue
+            question = str(record.get(config.question_field) or "").strip()
+            answer = str(record.get(config.answer_field) or "").strip()
+            key = normalize_query(question)
+            if key and answer:
+                seen[key].add(answer)
+                originals.setdefault(key, (question, answer))
+        for key, answers in seen.items():
+            if len(answers) > 1:
+                index.ambiguous += 1
+                continue
+            index.answers[key] = originals[key]
+        if config.similarity is not None:
+            for key in index.answers:
+                grams = _bigrams(key)
+                for gram in grams:
+                    index._postings[gram].append(len(index._questions))
+                index._questions.append(key)
+                index._bigrams.append(grams)
+        return index
+
+    def __len__(self):
+        return len(self.answers)
+
+    def lookup(self, query):
+        """返回 (原问题, 答案, 相似度)，没有匹配时返回None；精确匹配的相似度为1.0"""
+        key = normalize_query(query)
+        match = self.answers.get(key)
+        if match is not None:
+            return match[0], match[1], 1.0
+        if self.config.similarity is None:
+            return None
+
+        grams = _bigrams(key)
+        if not grams:
+            return None
+        overlaps = defaultdict(int)
+        for gram in grams:
+            for i in self._postings.get(gram, ()):
+                overlaps[i] += 1
+        best, best_score = None, 0.0
+        for i, overlap in overlaps.items():
+            score = 2 * overlap / (len(grams) + len(self._bigrams[i]))
+            if score > best_score:
+                best, best_score = i, score
+        if best is None or best_score < self.config.similarity:
+            return None
+        question, answer = self.answers[self._questions[best]]
+        return question, answer, round(best_score, 3)
+
+    def render(self, question, answer):
+        return self.config.template.format(question=question, answer=answer)
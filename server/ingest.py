@@ -0,0 +1,180 @@
+"""流式批量导入：增量解析JSON/JSONL，按固定大小分批，在进程池中计算向量并批量写入Chroma
+
+内存占用只与 批大小 x 在途批次数 有关，与数据文件大小无关。
+"""
+import json
+import logging
+import os
+import re
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from llama_index.core.vector_stores.utils import node_to_metadata_dict
+
+logger = logging.getLogger(__name__)
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\r\n"
+_SCALAR_END = re.compile(r"[,\]\s]")  # 数字、true等标量之后的分隔符
+
+
+def iter_json_array(path, chunk_size=1 << 20):
+    """增量解析顶层为数组的JSON文件，逐个产出数组元素，不会把整个文件读入内存"""
+    with open(path, "r", encoding="utf-8-sig") as f:
+        buffer, pos, eof = "", 0, False
+
+        def skip(chars):
+            nonlocal pos
+            while pos < len(buffer) and buffer[pos] in chars:
+                pos += 1
+
+        def refill():
+            # 丢弃已解析的部分并读入下一块，读到文件末尾时返回False
+            nonlocal buffer, pos, eof
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            return not eof
+
+        # 找到数组开头的'['
+        while True:
+            skip(_WHITESPACE)
+            if pos < len(buffer):
+                break
+            if not refill():
+                raise ValueError(f"{path} 是空文件")
+        if buffer[pos] != "[":
+            raise ValueError(f"{path} 的顶层不是JSON数组")
+        pos += 1
+
+        while True:
+            skip(_WHITESPACE + ",")
+            if pos >= len(buffer):
+                if not refill():
+                    raise ValueError(f"{path} 不是完整的JSON数组")
+                continue
+            if buffer[pos] == "]":
+                return
+            # 数字等标量没有结束符，可能被缓冲区截断（如"3.14"只读到"3."）：读到分隔符之后再解析
+            if buffer[pos] not in '{["' and not eof and not _SCALAR_END.search(buffer, pos):
+                refill()
+                continue
+            try:
+                item, end = _decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # 元素跨越了缓冲区末尾，读入更多内容后重试
+                if not refill():
+                    raise
+                continue
+            pos = end
+            yield item
+
+
+def iter_jsonl(path):
+    with open(path, "r", encoding="utf-8-sig") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                logger.warning(f"{path} 第{line_no}行不是有效的JSON，已跳过: {e}")
+
+
+def iter_records(path):
+    """按扩展名选择解析方式：.jsonl/.ndjson逐行解析，其余按JSON数组增量解析"""
+    if os.path.splitext(path)[1].lower() in (".jsonl", ".ndjson"):
+        return iter_jsonl(path)
+    return iter_json_array(path)
+
+
+def iter_batches(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# ====== 进程池中的embedding计算（仅使用CPU） ======
+_worker_model = None
+
+
+def _init_worker(model_path, threads):
+    global _worker_model
+    os.environ["CUDA_VISIBLE_DEVICES"] = ""
+    from embeddings import create_embed_model
+
+    _worker_model, _ = create_embed_model(model_path=model_path, threads=threads, warmup=False)
+
+
+def _embed_in_worker(texts):
+    return _worker_model.get_text_embedding_batch(texts)
+
+
+def _upsert(collection, nodes, embeddings):
+    # 与ChromaVectorStore.add写入的格式一致，检索时可以还原为节点
+    collection.upsert(
+        ids=[node.node_id for node in nodes],
+        embeddings=embeddings,
+        documents=[node.get_content() for node in nodes],
+        metadatas=[node_to_metadata_dict(node, remove_text=True, flat_metadata=True) for node in nodes],
+    )
+
+
+def ingest_documents(
+    documents,
+    collection,
+    embed_model=None,
+    model_path=None,
+    batch_size=256,
+    workers=0,
+    threads_per_worker=1,
+    progress=None,
+):
+    """把文档流分批计算向量并upsert到Chroma collection，返回写入的文档数
+
+    workers为0时使用传入的embed_model在当前进程计算；大于0时启动进程池，每个进程各自加载model_path。
+    progress(已写入数量)在每批写入后调用。
+    """
+    batches = iter_batches(documents, batch_size)
+    written = 0
+
+    if workers <= 0:
+        for batch in batches:
+            embeddings = embed_model.get_text_embedding_batch([node.get_content() for node in batch])
+            _upsert(collection, batch, embeddings)
+            written += len(batch)
+            if progress:
+                progress(written)
+        return written
+
+    # 最多同时提交 workers*2 个批次，保证内存占用有界
+    max_in_flight = workers * 2
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(model_path, threads_per_worker)
+    ) as pool:
+        in_flight = {}
+        exhausted = False
+        while in_flight or not exhausted:
+            while not exhausted and len(in_flight) < max_in_flight:
+                batch = next(batches, None)
+                if batch is None:
+                    exhausted = True
+                    break
+                future = pool.submit(_embed_in_worker, [node.get_content() for node in batch])
+                in_flight[future] = batch
+            if not in_flight:
+                break
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                batch = in_flight.pop(future)
+                _upsert(collection, batch, future.result())
+                written += len(batch)
+                if progress:
+                    progress(written)
+    return written
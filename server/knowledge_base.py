@@ -0,0 +1,613 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional, Tuple
+
+from llama_index.core import VectorStoreIndex
+from llama_index.core.schema import Document
+from llama_index.core.settings import Settings
+from llama_index.vector_stores.chroma import ChromaVectorStore
+
+from context_packer import estimate_tokens, pack_context
+from embeddings import embedding_signature
+from fast_answer import AnswerIndex, FastAnswerConfig
+from ingest import ingest_documents, iter_records
+from lexical import LexicalIndex
+from log_config import SAMPLED
+from record_mapper import FieldMapper, KeyValueMapper, MappingReport, SchemaError, mapper_fingerprint
+from vector_store import MmapVectorStore, VectorStoreConfig, remove_snapshot
+
+try:
+    import fcntl
+except ImportError:  # Windows：没有文件锁，只支持单进程热更新
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class KnowledgeBaseSpec:
+    """知识库的声明式配置：数据来源、记录映射、检索参数和角色提示词"""
+
+    name: str  # 知识库id，同时也是初始的Chroma collection名称（热更新后为带时间戳的新collection）
+    display_name: str  # 日志中使用的中文名称
+    data_file: str  # 相对于DATA_DIR的数据文件路径
+    persist_subdir: str  # 相对于PERSIST_DIR的docstore目录，""表示直接使用PERSIST_DIR
+    record_mapper: Any  # 校验记录并生成 (文档文本, 元数据)，见record_mapper.py
+    top_k: int
+    context_tokens: int  # 参考内容的token预算，见context_packer.py
+    persona: str  # 角色id，/chat/completions按此选择知识库
+    prompt_template: str  # 角色系统提示词，{context}处填入检索到的参考内容
+    legacy_prompts: Tuple[str, ...] = field(default_factory=tuple)  # 旧版前端发送的系统提示词
+    retrieval_mode: str = "vector"  # "vector"仅向量检索；"hybrid"同时使用BM25关键词检索并做RRF融合
+    fast_answer: Optional[FastAnswerConfig] = None  # 已知问题直接按模板回答，不调用大模型
+    vector_backend: str = "chroma"  # "chroma"或"numpy"（内存映射的向量快照，见vector_store.py）
+
+
+KNOWLEDGE_BASE_SPECS = (
+    KnowledgeBaseSpec(
+        name="riddles",
+        display_name="猜谜",
+        data_file=os.path.join("riddle", "data.json"),
+        persist_subdir="",
+        record_mapper=FieldMapper(required=("instruction", "output"), template="问题: {instruction}\n回答: {output}"),
+        top_k=3,
+        context_tokens=1200,
+        persona="riddle_master",
+        prompt_template="""你是一位猜谜大师，精通各种脑筋急转弯和谜语。
+            基于以下参考内容回答用户的问题，如果找到了准确匹配的谜语，请用生动有趣的方式给出答案。
+            如果没有找到准确匹配的谜语，可以基于你的知识创造性地回答。
+
+            参考内容：
+            {context}
+            """,
+        legacy_prompts=("你是模型A，猜谜大师，精通各种脑筋急转弯和谜语。用生动有趣的方式回答用户的问题。",),
+        retrieval_mode="hybrid",
+        fast_answer=FastAnswerConfig(
+            question_field="instruction",
+            answer_field="output",
+            template="哈哈，这个谜语我知道！\n\n谜面：{question}\n谜底：**{answer}**\n\n怎么样，猜对了吗？再来一个吧！",
+            similarity=0.9,
+        ),
+    ),
+    KnowledgeBaseSpec(
+        name="minecraft",
+        display_name="我的世界",
+        data_file=os.path.join("minecraft", "minecraft.json"),
+        persist_subdir="minecraft",
+        # minecraft.json使用question/answer/source；兼容instruction/output格式的数据
+        record_mapper=FieldMapper(
+            required=("question", "answer"),
+            template="Question: {question}\nAnswer: {answer}",
+            aliases={"instruction": "question", "output": "answer"},
+            metadata_fields=("source",),
+        ),
+        top_k=5,  # 多检索几条，增加覆盖面
+        context_tokens=1000,
+        persona="steve",
+        prompt_template="""你是我的世界(Minecraft)中的史蒂夫(Steve)，精通所有与我的世界相关的知识。
+            基于以下参考内容（英文）回答用户的问题，理解英文的含义，并翻译成中文。
+            当知识库中找到准确的信息时，请基于这些信息回答。如果没有找到相关信息，先道歉！接着可以基于你对我的世界的了解创造性地回答。
+            回答时要亲切友好，像一个热爱分享我的世界知识的玩家，可以使用一些与游戏相关的表达方式。
+
+            参考内容（英文）：
+            {context}
+
+            请注意：虽然参考资料是英文的，但你必须用流利的中文回答！
+            """,
+        legacy_prompts=("你是模型B，专业的技术顾问。",),
+    ),
+    KnowledgeBaseSpec(
+        name="magic",
+        display_name="哈利波特魔法",
+        data_file=os.path.join("magic", "harry_potter_spells_clean.json"),
+        persist_subdir="magic",
+        record_mapper=KeyValueMapper(required=("描述", "咒语")),
+        top_k=4,
+        context_tokens=1200,
+        persona="wizard",
+        prompt_template="""你是哈利波特世界中的一位魔法师，精通各种魔法咒语和魔法知识。
+            基于以下参考内容回答用户的问题，如果找到了相关的魔法咒语或魔法知识，请详细解释其用途和效果。
+            回答时要幽默风趣，充满魔法世界的奇妙感，可以偶尔引用哈利波特系列中的经典台词或场景。
+
+            参考内容：
+            {context}
+            """,
+        legacy_prompts=("你是模型C，幽默的生活小助手。",),
+        # 咒语名、人名等专有名词用关键词检索更准
+        retrieval_mode="hybrid",
+    ),
+)
+
+# 按知识库id、角色id、旧版系统提示词建立的查找表，角色分发是一次字典查找
+KNOWLEDGE_BASES: Dict[str, KnowledgeBaseSpec] = {spec.name: spec for spec in KNOWLEDGE_BASE_SPECS}
+PERSONAS: Dict[str, KnowledgeBaseSpec] = {spec.persona: spec for spec in KNOWLEDGE_BASE_SPECS}
+LEGACY_PROMPTS: Dict[str, KnowledgeBaseSpec] = {
+    prompt: spec for spec in KNOWLEDGE_BASE_SPECS for prompt in spec.legacy_prompts
+}
+
+
+def resolve_persona(persona, messages):
+    """根据角色id确定知识库；未提供角色id时按旧版前端的系统提示词精确匹配，都没有则返回None"""
+    if persona:
+        return PERSONAS.get(persona)
+    if messages and messages[0].get("role") == "system":
+        return LEGACY_PROMPTS.get(messages[0].get("content", "").strip())
+    return None
+
+
+def content_hash(text, metadata=None):
+    """文档内容的稳定id：文本和元数据不变id就不变，用于增量同步"""
+    if metadata:
+        text = text + "\n" + json.dumps(metadata, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _file_stat(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _copy_collection(chroma_client, source_name, target_name, batch_size=5000):
+    """把source_name中的向量复制到新collection，返回复制的条数"""
+    try:
+        source = chroma_client.get_collection(source_name)
+    except Exception:
+        return 0  # collection不存在（如从未加载成功），全部重新计算
+    target = chroma_client.get_or_create_collection(target_name)
+    copied = 0
+    for offset in range(0, source.count(), batch_size):
+        result = source.get(include=["embeddings", "documents", "metadatas"], limit=batch_size, offset=offset)
+        if not result["ids"]:
+            break
+        target.add(
+            ids=result["ids"],
+            embeddings=result["embeddings"],
+            documents=result["documents"],
+            metadatas=result["metadatas"],
+        )
+        copied += len(result["ids"])
+    return copied
+
+
+def _batches(items, size):
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+class KnowledgeBase:
+    """一个知识库的运行时状态：配置、Chroma collection、向量索引以及加载状态
+
+    加载状态依次为 pending -> queued -> loading -> ready / failed。
+    vector_backend为空时使用spec中的配置；numpy后端下index为MmapVectorStore。
+    collection_name为空时使用清单中记录的collection（热更新后为带版本号的新collection），没有清单时为spec.name。
+    """
+
+    def __init__(self, spec, data_dir, persist_root, vector_backend=None, vector_config=None, collection_name=None):
+        self.spec = spec
+        self.data_dir = data_dir
+        self.persist_root = persist_root
+        self.data_path = os.path.join(data_dir, spec.data_file)
+        self.persist_dir = os.path.join(persist_root, spec.persist_subdir) if spec.persist_subdir else persist_root
+        self.vector_backend = vector_backend or spec.vector_backend
+        if self.vector_backend not in ("chroma", "numpy"):
+            raise ValueError(f"未知的向量后端: {self.vector_backend}")
+        self.vector_config = vector_config or VectorStoreConfig()
+        self.collection = None
+        self.index = None
+        self.vectors = None  # numpy后端的MmapVectorStore
+        self.lexical = None  # hybrid模式下的BM25倒排索引
+        self.answers = None  # 快速回答的问题索引
+        self.status = "pending"
+        self.error = None
+        self.rebuilt = None
+        self.load_seconds = None
+        self.last_sync = None
+        self._data_stat = None  # 上次同步时数据文件的 (mtime, 大小)，用于廉价地判断文件是否被修改
+        self._lock = threading.Lock()
+        self.collection_name = collection_name or (self._read_manifest() or {}).get("collection") or spec.name
+
+    @property
+    def ready(self):
+        return self.status == "ready"
+
+    @property
+    def vector_source(self):
+        """批量检索使用的对象：numpy后端为MmapVectorStore，否则为Chroma collection，两者的query()格式相同"""
+        return self.vectors if self.vectors is not None else self.collection
+
+    @property
+    def vectors_dir(self):
+        return os.path.join(self.persist_dir, f"{self.collection_name}.vectors")
+
+    def state(self):
+        return {
+            "status": self.status,
+            "collection": self.collection_name,
+            "vector_backend": self.vector_backend,
+            "rebuilt": self.rebuilt,
+            "load_seconds": self.load_seconds,
+            "last_sync": self.last_sync,
+            "error": self.error,
+        }
+
+    def load(self, chroma_client):
+        """同步并加载索引，记录状态与耗时，可在线程中调用，返回索引内容是否发生了变化"""
+        with self._lock:
+            if self.status == "ready":
+                return False
+            self.status = "loading"
+            self.error = None
+            start = time.perf_counter()
+            try:
+                stats = self.sync(chroma_client)
+                if self.spec.fast_answer is not None:
+                    self.answers = AnswerIndex.from_records(iter_records(self.data_path), self.spec.fast_answer)
+                    logger.info(
+                        f"{self.spec.display_name}快速回答索引: {len(self.answers)}个问题, "
+                        f"{self.answers.ambiguous}个问题有多个答案未收录"
+                    )
+                self.rebuilt = bool(stats["added"] or stats["deleted"])
+                self.status = "ready"
+                return self.rebuilt
+            except Exception as e:
+                self.status = "failed"
+                self.error = str(e)
+                logger.exception(f"{self.spec.display_name}索引加载失败: {e}")
+                return False
+            finally:
+                self.load_seconds = round(time.perf_counter() - start, 3)
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.persist_dir, f"{self.spec.name}.manifest.json")
+
+    def _read_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return None
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            logger.warning(f"读取{self.spec.display_name}索引清单出错，将重新比对全部文档: {e}")
+            return None
+
+    def _write_manifest(self, data_hash, count, report, embedding=None):
+        manifest = {
+            "collection": self.collection_name,
+            "embedding": embedding,
+            "data_file": self.spec.data_file,
+            "data_sha256": data_hash,
+            "mapper": content_hash(mapper_fingerprint(self.spec.record_mapper)),
+            "count": count,
+            "records": report,
+            "updated_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def iter_documents(self, report=None):
+        """流式读取数据文件（JSON数组或JSONL），经记录映射器校验后逐条产出Document
+
+        文档id为内容哈希；不符合格式的记录被跳过并计入report。
+        """
+        for record in iter_records(self.data_path):
+            try:
+                text, metadata = self.spec.record_mapper.map(record)
+            except SchemaError as e:
+                if report is not None:
+                    report.add_skip(str(e))
+                continue
+            if report is not None:
+                report.kept += 1
+            yield Document(
+                text=text,
+                id_=content_hash(text, metadata),
+                metadata=metadata,
+                # 来源等元数据只用于过滤和引用，不参与向量计算和提示词
+                excluded_embed_metadata_keys=list(metadata),
+                excluded_llm_metadata_keys=list(metadata),
+            )
+
+    def sync(
+        self,
+        chroma_client,
+        embed_model=None,
+        force=False,
+        batch_size=256,
+        workers=0,
+        model_path=None,
+        progress=None,
+    ):
+        """增量同步数据文件与Chroma collection，并打开索引
+
+        数据文件哈希与清单一致时只做一次哈希校验；否则流式读取数据文件，只为新增或变化的记录
+        计算向量（workers>0时在进程池中计算），并删除数据文件中已不存在的记录。
+        清单中记录的embedding后端或模型文件与当前模型不一致时，清空collection后全部重新计算向量。
+        返回 added/deleted/unchanged/seconds 统计。
+        """
+        start = time.perf_counter()
+        embed_model = embed_model or Settings.embed_model
+        os.makedirs(self.persist_dir, exist_ok=True)
+
+        data_stat = _file_stat(self.data_path)
+        data_hash = file_sha256(self.data_path)
+        manifest = self._read_manifest()
+        signature = embedding_signature(embed_model)
+        self.collection = chroma_client.get_or_create_collection(self.collection_name)
+        vector_store = ChromaVectorStore(chroma_collection=self.collection)
+
+        stats = {"added": 0, "deleted": 0, "unchanged": 0}
+        count = self.collection.count()
+        # 不同后端（fp32/int8、PyTorch/ONNX）算出的向量不能混在同一个索引中
+        recorded = (manifest or {}).get("embedding")
+        reembed = bool(count) and signature is not None and recorded != signature
+        unchanged = (
+            not reembed
+            and manifest is not None
+            and manifest.get("data_sha256") == data_hash
+            and manifest.get("mapper") == content_hash(mapper_fingerprint(self.spec.record_mapper))
+            and manifest.get("count") == count
+        )
+        if unchanged and not force:
+            stats["unchanged"] = count
+            stats["records"] = manifest.get("records")
+            logger.info(f"{self.spec.display_name}数据未变化，直接加载索引（{count}条）")
+        else:
+            logger.info(f"正在同步{self.spec.display_name}索引...")
+            existing = set(self.collection.get(include=[])["ids"])
+            if reembed:
+                logger.warning(
+                    f"{self.spec.display_name}索引的embedding与当前模型不一致（清单: {recorded}，当前: {signature}），"
+                    f"全部重新计算向量"
+                )
+                for batch in _batches(sorted(existing), batch_size):
+                    self.collection.delete(ids=batch)
+                existing = set()
+            desired = set()
+            report = MappingReport()
+
+            def new_documents():
+                for doc in self.iter_documents(report):
+                    if doc.id_ in desired:
+                        continue  # 内容完全相同的记录只保留一条
+                    desired.add(doc.id_)
+                    if doc.id_ not in existing:
+                        yield doc
+
+            stats["added"] = ingest_documents(
+                new_documents(),
+                self.collection,
+                embed_model=embed_model,
+                model_path=model_path,
+                batch_size=batch_size,
+                workers=workers,
+                progress=(lambda done: progress(self.spec.name, done)) if progress else None,
+            )
+
+            stats["records"] = report.as_dict()
+            logger.info(f"{self.spec.display_name}数据校验: 保留{report.kept}条, 跳过{report.skipped}条")
+            for reason, times in report.reasons.most_common(5):
+                logger.info(f"  跳过原因: {reason} ({times}条)")
+            if report.kept == 0:
+                # 数据格式与映射器不匹配时宁可加载失败，也不要悄悄建出一个空索引
+                raise ValueError(f"{self.spec.display_name}数据文件中没有符合格式的记录: {self.data_path}")
+
+            to_delete = sorted(existing - desired)
+            for batch in _batches(to_delete, batch_size):
+                self.collection.delete(ids=batch)
+                stats["deleted"] += len(batch)
+            stats["unchanged"] = len(existing) - len(to_delete)
+
+            self._write_manifest(data_hash, self.collection.count(), stats["records"], signature)
+            logger.info(
+                f"{self.spec.display_name}索引同步完成: 新增{stats['added']}条, "
+                f"删除{stats['deleted']}条, 未变{stats['unchanged']}条"
+            )
+
+        if self.vector_backend == "numpy":
+            self.vectors = self._open_vectors(data_hash, force, signature)
+            self.index = self.vectors
+            stats["vectors_bytes"] = self.vectors.nbytes
+        else:
+            self.index = VectorStoreIndex.from_vector_store(vector_store, embed_model=embed_model)
+        if self.spec.retrieval_mode == "hybrid":
+            # 倒排索引只在内存中，每次加载时从collection重建，与向量索引内容始终一致
+            lexical_start = time.perf_counter()
+            self.lexical = LexicalIndex.from_collection(self.vector_source)
+            stats["lexical_seconds"] = round(time.perf_counter() - lexical_start, 3)
+            logger.info(
+                f"{self.spec.display_name}关键词索引构建完成: {len(self.lexical)}条文档, "
+                f"{len(self.lexical.postings)}个词, 耗时{stats['lexical_seconds']}秒"
+            )
+        stats["seconds"] = round(time.perf_counter() - start, 3)
+        self.last_sync = stats
+        self._data_stat = data_stat
+        return stats
+
+    def _open_vectors(self, data_hash, force=False, embedding=None):
+        """打开向量快照；快照与当前collection内容不一致时从collection重新导出"""
+        source = {
+            "embedding": embedding,
+            "data_sha256": data_hash,
+            "mapper": content_hash(mapper_fingerprint(self.spec.record_mapper)),
+            "count": self.collection.count(),
+        }
+        config = self.vector_config
+        wants_ivf = bool(config.ivf_min_docs and source["count"] >= config.ivf_min_docs)
+        store = None if force else MmapVectorStore.open(self.vectors_dir, config)
+        if (
+            store is not None
+            and store.meta.get("source") == source
+            and store.meta.get("dtype") == config.dtype
+            and bool(store.meta.get("ivf_lists")) == wants_ivf
+        ):
+            logger.info(f"{self.spec.display_name}向量快照未变化，直接映射（{len(store)}条）")
+            return store
+
+        if store is not None:
+            store.close()  # 释放过期快照的映射，之后才能删除
+        export_start = time.perf_counter()
+        os.makedirs(self.vectors_dir, exist_ok=True)
+        store = MmapVectorStore.export_collection(self.collection, self.vectors_dir, config, source)
+        logger.info(
+            f"{self.spec.display_name}向量快照导出完成: {len(store)}条, {store.meta['dtype']}, "
+            f"IVF簇数{store.meta['ivf_lists']}, 耗时{time.perf_counter() - export_start:.3f}秒"
+        )
+        return store
+
+    # ---- 热更新 ----
+
+    def needs_reload(self):
+        """数据文件内容与当前索引不一致，或清单已指向其他collection（其他进程已重建）时返回True
+
+        文件的修改时间和大小都没变时不计算哈希；同一次修改只报告一次，重建失败后要等文件再次修改才重试。
+        """
+        manifest = self._read_manifest() or {}
+        if manifest.get("collection", self.collection_name) != self.collection_name:
+            return True
+        stat = _file_stat(self.data_path)
+        if stat is None or stat == self._data_stat:
+            return False
+        self._data_stat = stat
+        return file_sha256(self.data_path) != manifest.get("data_sha256")
+
+    def reload(self, chroma_client, force=False):
+        """在新的collection中重建知识库，返回 (新的KnowledgeBase或None, 报告)
+
+        本对象及正在使用它的查询不受影响，由调用方替换引用。新collection先复制当前collection的向量，
+        只为变化的记录计算向量；force时从空collection全部重新计算。数据未变化且未指定force时返回None。
+        多进程部署时按文件锁串行：其他进程已经重建好的，直接打开清单指向的collection。
+        """
+        start = time.perf_counter()
+        report = {
+            "kb": self.spec.name,
+            "previous_collection": self.collection_name,
+            "documents_before": self.collection.count() if self.collection is not None else None,
+        }
+        with self._reload_lock():
+            manifest = self._read_manifest() or {}
+            current = manifest.get("collection", self.collection_name)
+            data_hash = file_sha256(self.data_path)
+            if not force and manifest.get("data_sha256") == data_hash:
+                if current == self.collection_name and self.ready:
+                    report.update(mode="unchanged", collection=current, seconds=round(time.perf_counter() - start, 3))
+                    return None, report
+                mode, name = "follow", current
+            else:
+                mode, name = "rebuild", f"{self.spec.name}-{int(time.time() * 1000)}"
+
+            fresh = KnowledgeBase(
+                self.spec, self.data_dir, self.persist_root, self.vector_backend, self.vector_config, name
+            )
+            copied = 0
+            if mode == "rebuild" and not force:
+                copied = _copy_collection(chroma_client, current, name)
+            fresh.load(chroma_client)
+            if not fresh.ready:
+                if mode == "rebuild":
+                    fresh.drop(chroma_client)
+                raise RuntimeError(f"{self.spec.display_name}重建失败: {fresh.error}")
+
+        stats = fresh.last_sync or {}
+        report.update(
+            mode=mode,
+            collection=name,
+            documents=fresh.collection.count(),
+            copied=copied,
+            added=stats.get("added", 0),
+            deleted=stats.get("deleted", 0),
+            unchanged=stats.get("unchanged", 0),
+            records=stats.get("records"),
+            seconds=round(time.perf_counter() - start, 3),
+        )
+        logger.info(
+            f"{self.spec.display_name}热更新完成({mode}): {report['previous_collection']} -> {name}, "
+            f"{report['documents_before']} -> {report['documents']}条, 新增{report['added']}条, "
+            f"删除{report['deleted']}条, 耗时{report['seconds']}秒"
+        )
+        return fresh, report
+
+    def drop(self, chroma_client):
+        """删除本对象的collection和向量快照（热更新后旧版本不再使用时调用）"""
+        if (self._read_manifest() or {}).get("collection") == self.collection_name:
+            logger.warning(f"{self.collection_name}仍是清单中的当前版本，不删除")
+            return
+        try:
+            chroma_client.delete_collection(self.collection_name)
+        except Exception as e:
+            logger.warning(f"删除collection {self.collection_name}出错: {e}")
+        if self.vectors is not None:
+            self.vectors.close()
+        # 删除失败（其他worker仍映射着快照）时留给启动时的sweep_snapshots清理
+        remove_snapshot(self.vectors_dir)
+        logger.info(f"已删除{self.spec.display_name}的旧版本索引: {self.collection_name}")
+
+    def sweep_snapshots(self):
+        """删除不再使用的向量快照：当前快照目录中的旧版本，以及热更新后未能删除的旧collection的快照目录
+
+        启动时调用；热更新期间旧版本仍在使用，不要调用。返回删除的目录数。
+        """
+        if not os.path.isdir(self.persist_dir):
+            return 0
+        pattern = re.compile(rf"{re.escape(self.spec.name)}(-\d+)?\.vectors")
+        current = os.path.basename(self.vectors_dir)
+        removed = MmapVectorStore.sweep(self.vectors_dir)
+        for name in os.listdir(self.persist_dir):
+            if name != current and pattern.fullmatch(name):
+                removed += remove_snapshot(os.path.join(self.persist_dir, name))
+        return removed
+
+    @contextmanager
+    def _reload_lock(self):
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(self.persist_dir, exist_ok=True)
+        with open(os.path.join(self.persist_dir, f"{self.spec.name}.reload.lock"), "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def pack_context(self, nodes, query="", max_tokens=None, context_window=65536):
+        """按token预算组装检索到的节点，返回PackedContext
+
+        预算取角色的context_tokens，并保证 提示词 + 参考内容 + 用户问题 + max_tokens 不超过模型上下文窗口。
+        """
+        budget = self.spec.context_tokens
+        if max_tokens:
+            room = context_window - max_tokens - estimate_tokens(self.spec.prompt_template) - estimate_tokens(query)
+            budget = max(0, min(budget, room))
+        packed = pack_context(nodes, budget)
+        if packed.tokens_saved:
+            logger.info(
+                f"{self.spec.display_name}参考内容: {packed.tokens}/{packed.original_tokens} tokens, "
+                f"节省{packed.tokens_saved} (重复{packed.duplicates}条, 丢弃{packed.dropped}条, 裁剪{packed.trimmed}条)",
+                extra=SAMPLED,
+            )
+        return packed
+
+    def build_prompt(self, context):
+        """把参考内容填入角色提示词"""
+        return self.spec.prompt_template.format(context=context)
@@ -0,0 +1,154 @@
+"""内存中的倒排索引：BM25关键词检索、精确匹配查找，以及与向量检索结果的RRF融合"""
+import math
+import re
+from collections import Counter, defaultdict
+
+from llama_index.core.schema import NodeWithScore, TextNode
+from llama_index.core.vector_stores.utils import metadata_dict_to_node
+
+from cache import normalize_query
+
+try:
+    import jieba
+
+    jieba.setLogLevel(60)
+except ImportError:  # 未安装jieba时退化为中文单字+双字切分
+    jieba = None
+
+_CJK_RUN = re.compile(r"[㐀-䶿一-鿿豈-﫿]+")
+_TOKEN_RUN = re.compile(r"[㐀-䶿一-鿿豈-﫿]+|[a-z0-9]+(?:['\-][a-z0-9]+)*")
+_LATIN_PHRASE = re.compile(r"[a-z0-9][a-z0-9 '\-]*[a-z0-9]|[a-z0-9]")
+
+
+def _cjk_tokens(run):
+    if jieba is not None:
+        return [token for token in jieba.lcut_for_search(run) if token.strip()]
+    if len(run) == 1:
+        return [run]
+    return list(run) + [run[i : i + 2] for i in range(len(run) - 1)]
+
+
+def record_to_node(node_id, text, metadata):
+    """把Chroma中的一条记录还原为节点"""
+    try:
+        node = metadata_dict_to_node(metadata or {}, text=text)
+    except Exception:
+        # 不是由llama-index写入的记录，直接用文本构造节点
+        node = TextNode(text=text or "", metadata=metadata or {})
+    node.id_ = node_id
+    return node
+
+
+def tokenize(text):
+    """中英文混合分词：英文按单词，中文用jieba（或单字+双字）"""
+    tokens = []
+    for match in _TOKEN_RUN.finditer(normalize_query(text)):
+        run = match.group()
+        if _CJK_RUN.fullmatch(run):
+            tokens.extend(_cjk_tokens(run))
+        else:
+            tokens.append(run)
+    return tokens
+
+
+def exact_keys(text):
+    """从“字段: 值”格式的文档中提取可精确匹配的键
+
+    每个字段值、按“|”拆开的各部分，以及其中连续的中文或英文片段都作为键，
+    例如“咒语: 声音洪亮 | Sonorus”得到“声音洪亮 | sonorus”“声音洪亮”“sonorus”。
+    """
+    keys = set()
+    for line in text.splitlines():
+        value = line.split(":", 1)[1] if ":" in line else line
+        parts = [value] + value.split("|")
+        for part in parts:
+            part = normalize_query(part)
+            if not part:
+                continue
+            keys.add(part)
+            keys.update(_CJK_RUN.findall(part))
+            keys.update(phrase.strip() for phrase in _LATIN_PHRASE.findall(part))
+    return {key for key in keys if len(key) >= 2}
+
+
+class LexicalIndex:
+    """BM25倒排索引，同时维护“精确键 -> 文档”的哈希表用于精确匹配短路
+
+    出现在过多文档中的键（如“咒语未知”）不参与精确匹配。
+    """
+
+    def __init__(self, nodes, k1=1.5, b=0.75, max_exact_docs=3):
+        self.k1 = k1
+        self.b = b
+        self.nodes = nodes
+        self.postings = defaultdict(list)  # 词 -> [(文档序号, 词频)]
+        self.doc_lengths = []
+        exact = defaultdict(set)
+
+        for i, node in enumerate(nodes):
+            text = node.get_content()
+            counts = Counter(tokenize(text))
+            self.doc_lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                self.postings[term].append((i, tf))
+            for key in exact_keys(text):
+                exact[key].add(i)
+
+        n = len(nodes)
+        self.avg_length = (sum(self.doc_lengths) / n) if n else 0.0
+        self.idf = {
+            term: math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5)) for term, docs in self.postings.items()
+        }
+        self.exact = {key: sorted(docs) for key, docs in exact.items() if len(docs) <= max_exact_docs}
+
+    @classmethod
+    def from_collection(cls, collection, **kwargs):
+        """从Chroma collection中读取全部文档构建索引"""
+        result = collection.get(include=["documents", "metadatas"])
+        nodes = [
+            record_to_node(node_id, text, metadata)
+            for node_id, text, metadata in zip(result["ids"], result["documents"], result["metadatas"])
+        ]
+        return cls(nodes, **kwargs)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def exact_match(self, query):
+        """查询归一化后与某个精确键完全相同时，返回对应文档（分数为1.0），否则返回空列表"""
+        docs = self.exact.get(normalize_query(query))
+        if not docs:
+            return []
+        return [NodeWithScore(node=self.nodes[i], score=1.0) for i in docs]
+
+    def search(self, query, top_k):
+        """BM25检索，返回按分数降序的NodeWithScore列表"""
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = self.idf[term]
+            for i, tf in postings:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[i] / (self.avg_length or 1))
+                scores[i] += idf * tf * (self.k1 + 1) / (tf + norm)
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+        return [NodeWithScore(node=self.nodes[i], score=score) for i, score in best]
+
+
+def reciprocal_rank_fusion(result_lists, top_k, k=60):
+    """RRF融合多路检索结果：每路按名次贡献1/(k+名次)，按节点id合并
+
+    分数除以理论最大值（每路都排第一），落在(0, 1]之间；只反映名次，只能在同一次融合的结果之间比较，
+    不能与向量检索的相似度或其他查询的融合分数比较。
+    """
+    fused = {}
+    scores = defaultdict(float)
+    for results in result_lists:
+        for rank, item in enumerate(results, 1):
+            node_id = item.node.node_id
+            scores[node_id] += 1.0 / (k + rank)
+            fused.setdefault(node_id, item.node)
+    best = sorted(scores.items(), key=lambda entry: entry[1], reverse=True)[:top_k]
+    scale = len(result_lists) / (k + 1)
+    return [NodeWithScore(node=fused[node_id], score=score / scale) for node_id, score in best]
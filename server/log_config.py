@@ -0,0 +1,85 @@
+"""日志配置：文本或JSON格式输出，请求路径上的日志可按比例采样
+
+各模块使用 logging.getLogger(__name__)，请求路径上每次都会出现的日志带上 extra=SAMPLED，
+按 LOG_SAMPLE_RATE 采样输出；警告和错误不参与采样。
+
+配置项（环境变量或config.json）:
+    LOG_FORMAT       text（默认）或 json
+    LOG_LEVEL        默认 INFO
+    LOG_SAMPLE_RATE  请求日志的采样比例，默认 1.0，0 表示不输出
+"""
+import json
+import logging
+import random
+import sys
+import time
+
+from settings import get_setting
+
+SAMPLED = {"sampled": True}
+
+# LogRecord自带的属性，其余通过extra传入的字段作为结构化字段输出
+_RESERVED = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "sampled"}
+
+
+def _fields(record):
+    return {key: value for key, value in vars(record).items() if key not in _RESERVED}
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if getattr(record, "sampled", False) and record.levelno < logging.WARNING:
+            return random.random() < self.rate
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update(_fields(record))
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s", "%H:%M:%S")
+
+    def format(self, record):
+        text = super().format(record)
+        fields = _fields(record)
+        if fields:
+            text += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return text
+
+
+def setup_logging(fmt=None, level=None, sample_rate=None):
+    """配置根日志记录器（重复调用时替换之前的配置）"""
+    fmt = fmt or get_setting("LOG_FORMAT", "text")
+    level = level or get_setting("LOG_LEVEL", "INFO")
+    rate = sample_rate if sample_rate is not None else get_setting("LOG_SAMPLE_RATE", 1.0, float)
+
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+    handler.addFilter(SamplingFilter(rate))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        if getattr(existing, "_ai_agent", False):
+            root.removeHandler(existing)
+    handler._ai_agent = True
+    root.addHandler(handler)
+    root.setLevel(str(level).upper())
+    # 第三方库的日志只保留警告以上
+    for name in ("httpx", "httpcore", "chromadb", "sentence_transformers", "urllib3"):
+        logging.getLogger(name).setLevel(logging.WARNING)
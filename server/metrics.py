@@ -0,0 +1,150 @@
+import bisect
+import math
+import threading
+from collections import defaultdict, deque
+
+# 默认的直方图分桶（秒）
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class RollingStats:
+    """保留最近N个观测值，用于计算均值和分位数"""
+
+    def __init__(self, window=1000):
+        self.values = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        self.values.append(value)
+        self.count += 1
+        self.total += value
+
+    def snapshot(self):
+        ordered = sorted(self.values)
+        if not ordered:
+            return {"count": 0}
+
+        def pct(p):
+            return round(ordered[min(len(ordered) - 1, int(len(ordered) * p))], 4)
+
+        return {
+            "count": self.count,
+            "avg": round(self.total / self.count, 4),
+            "p50": pct(0.50),
+            "p95": pct(0.95),
+            "p99": pct(0.99),
+        }
+
+
+class Histogram:
+    """Prometheus风格的累计直方图"""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # 最后一个为+Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def format_family(name, kind, help_text, samples):
+    """生成一个指标族的Prometheus文本格式，samples为 [(后缀, 标签字典, 值)]"""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    for suffix, labels, value in samples:
+        label_text = ",".join(f'{key}="{_escape(val)}"' for key, val in labels.items())
+        series = f"{name}{suffix}{{{label_text}}}" if label_text else f"{name}{suffix}"
+        lines.append(f"{series} {_number(value)}")
+    return lines
+
+
+class Metrics:
+    """进程内指标汇总：按 (指标名, 标签) 分组的滑动窗口统计、直方图与计数器
+
+    滑动窗口统计用于/stats的分位数，直方图与计数器用于/metrics（Prometheus文本格式）。
+    describe()为指标设置说明、标签名和分桶，未描述的指标标签名为label、使用默认分桶。
+    """
+
+    def __init__(self, prefix="ai_agent"):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._stats = defaultdict(RollingStats)
+        self._histograms = {}
+        self._counters = defaultdict(int)
+        self._descriptions = {}
+
+    def describe(self, name, help_text, label_name="label", buckets=DEFAULT_BUCKETS):
+        self._descriptions[name] = (help_text, label_name, tuple(buckets))
+
+    def _description(self, name):
+        return self._descriptions.get(name, (name, "label", DEFAULT_BUCKETS))
+
+    def observe(self, name, value, label="all"):
+        with self._lock:
+            self._stats[(name, label)].observe(value)
+            histogram = self._histograms.get((name, label))
+            if histogram is None:
+                histogram = self._histograms[(name, label)] = Histogram(self._description(name)[2])
+            histogram.observe(value)
+
+    def incr(self, name, label="all", amount=1):
+        with self._lock:
+            self._counters[(name, label)] += amount
+
+    def snapshot(self):
+        with self._lock:
+            result = defaultdict(dict)
+            for (name, label), stats in self._stats.items():
+                result[name][label] = stats.snapshot()
+            for (name, label), value in self._counters.items():
+                result[name][label] = value
+            return dict(result)
+
+    def render_prometheus(self):
+        """以Prometheus文本格式导出全部直方图和计数器"""
+        with self._lock:
+            histograms = defaultdict(list)
+            for (name, label), histogram in self._histograms.items():
+                histograms[name].append(
+                    (label, histogram.buckets, list(histogram.counts), histogram.sum, histogram.count)
+                )
+            counters = defaultdict(list)
+            for (name, label), value in self._counters.items():
+                counters[name].append((label, value))
+
+        lines = []
+        for name in sorted(histograms):
+            help_text, label_name, _ = self._description(name)
+            samples = []
+            for label, buckets, counts, total, count in sorted(histograms[name], key=lambda item: str(item[0])):
+                cumulative = 0
+                for bound, bucket_count in zip(buckets + (math.inf,), counts):
+                    cumulative += bucket_count
+                    samples.append(("_bucket", {label_name: label, "le": _number(bound)}, cumulative))
+                samples.append(("_sum", {label_name: label}, total))
+                samples.append(("_count", {label_name: label}, count))
+            lines += format_family(f"{self.prefix}_{name}", "histogram", help_text, samples)
+        for name in sorted(counters):
+            help_text, label_name, _ = self._description(name)
+            samples = [
+                ("", {label_name: label}, value) for label, value in sorted(counters[name], key=lambda item: str(item[0]))
+            ]
+            lines += format_family(f"{self.prefix}_{name}_total", "counter", help_text, samples)
+        return lines
+
+
+metrics = Metrics()
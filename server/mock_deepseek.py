@@ -0,0 +1,134 @@
+"""本地模拟DeepSeek服务器，用于测试与压测，不消耗真实API额度
+
+用法:
+    python mock_deepseek.py --port 8001 --latency 0.5
+然后设置环境变量 DEEPSEEK_API_URL=http://127.0.0.1:8001/v1/chat/completions 启动app.py
+
+测试限流、排队与熔断时可以注入延迟抖动和错误：
+    python mock_deepseek.py --latency 0.5 --jitter 0.2 --error-rate 0.3 --error-status 503
+运行中也可以通过 POST /mock/config 修改，如 {"error_rate": 1.0} 模拟上游故障，{"error_rate": 0} 恢复
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# 模拟的上游延迟（秒），可通过环境变量或命令行参数设置
+MOCK_LATENCY = float(os.environ.get("MOCK_DEEPSEEK_LATENCY", "0.2"))
+# 流式模式下相邻两个token之间的间隔（秒）
+MOCK_TOKEN_DELAY = float(os.environ.get("MOCK_DEEPSEEK_TOKEN_DELAY", "0.02"))
+# 延迟的随机抖动（秒），实际延迟在 latency ± jitter 之间
+MOCK_LATENCY_JITTER = float(os.environ.get("MOCK_DEEPSEEK_JITTER", "0"))
+# 按该比例返回错误，状态码为MOCK_ERROR_STATUS（429时附带Retry-After）
+MOCK_ERROR_RATE = float(os.environ.get("MOCK_DEEPSEEK_ERROR_RATE", "0"))
+MOCK_ERROR_STATUS = int(os.environ.get("MOCK_DEEPSEEK_ERROR_STATUS", "503"))
+
+app = FastAPI()
+
+
+def build_completion(content, model):
+    return {
+        "id": f"mock-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }
+        ],
+        "usage": {"prompt_tokens": 0, "completion_tokens": len(content), "total_tokens": len(content)},
+    }
+
+
+async def stream_completion(content, model, include_usage):
+    completion_id = f"mock-{uuid.uuid4().hex}"
+    for token in content:
+        chunk = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}],
+        }
+        yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+        await asyncio.sleep(MOCK_TOKEN_DELAY)
+    final = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+    }
+    if include_usage:
+        final["usage"] = {"prompt_tokens": 0, "completion_tokens": len(content), "total_tokens": len(content)}
+    yield f"data: {json.dumps(final, ensure_ascii=False)}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    await asyncio.sleep(max(0.0, MOCK_LATENCY + random.uniform(-MOCK_LATENCY_JITTER, MOCK_LATENCY_JITTER)))
+    if random.random() < MOCK_ERROR_RATE:
+        headers = {"Retry-After": "1"} if MOCK_ERROR_STATUS == 429 else None
+        return JSONResponse(
+            status_code=MOCK_ERROR_STATUS,
+            content={"error": {"message": "模拟的上游错误", "type": "mock_error"}},
+            headers=headers,
+        )
+    user_query = next((m["content"] for m in reversed(body.get("messages", [])) if m.get("role") == "user"), "")
+    content = f"模拟回答: {user_query}"
+    model = body.get("model", "deepseek-chat")
+    if body.get("stream"):
+        include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+        return StreamingResponse(stream_completion(content, model, include_usage), media_type="text/event-stream")
+    return build_completion(content, model)
+
+
+@app.post("/mock/config")
+async def update_config(request: Request):
+    """运行中修改延迟与错误注入，未提供的字段保持不变"""
+    global MOCK_LATENCY, MOCK_LATENCY_JITTER, MOCK_TOKEN_DELAY, MOCK_ERROR_RATE, MOCK_ERROR_STATUS
+    body = await request.json()
+    MOCK_LATENCY = float(body.get("latency", MOCK_LATENCY))
+    MOCK_LATENCY_JITTER = float(body.get("jitter", MOCK_LATENCY_JITTER))
+    MOCK_TOKEN_DELAY = float(body.get("token_delay", MOCK_TOKEN_DELAY))
+    MOCK_ERROR_RATE = float(body.get("error_rate", MOCK_ERROR_RATE))
+    MOCK_ERROR_STATUS = int(body.get("error_status", MOCK_ERROR_STATUS))
+    return {
+        "latency": MOCK_LATENCY,
+        "jitter": MOCK_LATENCY_JITTER,
+        "token_delay": MOCK_TOKEN_DELAY,
+        "error_rate": MOCK_ERROR_RATE,
+        "error_status": MOCK_ERROR_STATUS,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="本地模拟DeepSeek服务器")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=MOCK_LATENCY, help="每个请求的模拟延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=MOCK_LATENCY_JITTER, help="延迟的随机抖动（秒）")
+    parser.add_argument("--error-rate", type=float, default=MOCK_ERROR_RATE, help="返回错误的请求比例（0~1）")
+    parser.add_argument("--error-status", type=int, default=MOCK_ERROR_STATUS, help="注入错误的状态码")
+    args = parser.parse_args()
+    MOCK_LATENCY = args.latency
+    MOCK_LATENCY_JITTER = args.jitter
+    MOCK_ERROR_RATE = args.error_rate
+    MOCK_ERROR_STATUS = args.error_status
+    print(
+        f"模拟DeepSeek服务器启动: http://{args.host}:{args.port}/v1/chat/completions "
+        f"(延迟 {MOCK_LATENCY}±{MOCK_LATENCY_JITTER}s, 错误率 {MOCK_ERROR_RATE:.0%}, 状态码 {MOCK_ERROR_STATUS})"
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,93 @@
+"""记录映射：校验数据文件中每条记录的结构，并转换为文档文本和元数据
+
+每个知识库配置一个映射器，映射器只需提供 map(record) -> (文本, 元数据)，
+记录不符合要求时抛出SchemaError，由调用方计入跳过统计。
+"""
+from collections import Counter
+
+_SCALAR_TYPES = (str, int, float, bool)
+
+
+class SchemaError(ValueError):
+    """记录不符合知识库的数据格式"""
+
+
+def mapper_fingerprint(mapper):
+    """映射器配置的指纹，写入索引清单；映射规则变化后即使数据文件未变也会重新同步"""
+    return f"{type(mapper).__name__}:{sorted(vars(mapper).items())!r}"
+
+
+class FieldMapper:
+    """按字段名取值并套用文本模板
+
+    required中的字段必须存在且为非空标量；aliases把旧字段名映射到标准字段名；
+    metadata_fields中的字段（可选）写入节点元数据，可用于过滤和引用来源。
+    """
+
+    def __init__(self, required, template, aliases=None, metadata_fields=()):
+        self.required = tuple(required)
+        self.template = template
+        self.aliases = dict(aliases or {})
+        self.metadata_fields = tuple(metadata_fields)
+
+    def map(self, record):
+        if not isinstance(record, dict):
+            raise SchemaError(f"记录不是对象: {type(record).__name__}")
+        fields = dict(record)
+        for old, new in self.aliases.items():
+            if new not in fields and old in fields:
+                fields[new] = fields[old]
+
+        missing = [key for key in self.required if key not in fields]
+        if missing:
+            raise SchemaError(f"缺少字段: {', '.join(missing)}")
+        for key in self.required:
+            value = fields[key]
+            if not isinstance(value, _SCALAR_TYPES) or (isinstance(value, str) and not value.strip()):
+                raise SchemaError(f"字段为空或类型错误: {key}")
+
+        text = self.template.format(**{key: str(fields[key]).strip() for key in self.required})
+        metadata = {
+            key: str(fields[key]).strip()
+            for key in self.metadata_fields
+            if isinstance(fields.get(key), _SCALAR_TYPES) and str(fields[key]).strip()
+        }
+        return text, metadata
+
+
+class KeyValueMapper:
+    """把记录中所有非空标量字段按“键: 值”逐行拼接，required中的字段必须存在且非空"""
+
+    def __init__(self, required=()):
+        self.required = tuple(required)
+
+    def map(self, record):
+        if not isinstance(record, dict):
+            raise SchemaError(f"记录不是对象: {type(record).__name__}")
+        missing = [key for key in self.required if not record.get(key)]
+        if missing:
+            raise SchemaError(f"缺少字段: {', '.join(missing)}")
+        lines = [
+            f"{key}: {value}"
+            for key, value in record.items()
+            if value and isinstance(value, _SCALAR_TYPES)
+        ]
+        if not lines:
+            raise SchemaError("没有可用的字段")
+        return "\n".join(lines), {}
+
+
+class MappingReport:
+    """统计一次构建中保留和跳过的记录数，以及跳过的原因"""
+
+    def __init__(self):
+        self.kept = 0
+        self.skipped = 0
+        self.reasons = Counter()
+
+    def add_skip(self, reason):
+        self.skipped += 1
+        self.reasons[reason] += 1
+
+    def as_dict(self):
+        return {"kept": self.kept, "skipped": self.skipped, "skip_reasons": dict(self.reasons.most_common(5))}
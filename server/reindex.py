@@ -0,0 +1,88 @@
+"""离线增量同步知识库索引
+
+只为新增或变化的记录计算向量，并删除数据文件中已移除的记录；数据文件未变化时只做哈希校验。
+同步期间请勿同时运行服务器，两个进程同时写同一个Chroma目录可能导致数据损坏。
+
+用法（在项目根目录下）:
+    python -m server.reindex --kb minecraft
+    python -m server.reindex --kb all --force
+    python -m server.reindex --kb minecraft --workers 4 --batch-size 512   # 大文件：多进程计算向量
+    python -m server.reindex --kb all --vector-backend numpy               # 同时导出内存映射的向量快照
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import chromadb  # noqa: E402
+from llama_index.core.settings import Settings  # noqa: E402
+
+from embeddings import BACKENDS, create_embed_model  # noqa: E402
+from knowledge_base import KNOWLEDGE_BASES, KnowledgeBase  # noqa: E402
+from log_config import setup_logging  # noqa: E402
+from settings import DATA_DIR, EMBEDDING_MODEL_PATH, PERSIST_DIR, get_setting  # noqa: E402
+from vector_store import VectorStoreConfig  # noqa: E402
+
+
+def print_progress(name, done):
+    print(f"  [{name}] 已写入 {done} 条")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线增量同步知识库索引")
+    parser.add_argument("--kb", default="all", choices=["all", *KNOWLEDGE_BASES.keys()], help="要同步的知识库")
+    parser.add_argument("--force", action="store_true", help="忽略清单，逐条比对数据文件与索引")
+    parser.add_argument("--batch-size", type=int, default=256, help="每批计算向量的记录数")
+    parser.add_argument("--workers", type=int, default=0, help="计算向量的进程数，0表示在当前进程计算")
+    parser.add_argument("--model", default=EMBEDDING_MODEL_PATH, help="embedding模型路径")
+    parser.add_argument(
+        "--embedding-backend",
+        choices=BACKENDS,
+        default=get_setting("EMBEDDING_BACKEND", "huggingface"),
+        help="写入索引与查询时必须使用同一后端",
+    )
+    parser.add_argument(
+        "--vector-backend",
+        choices=["chroma", "numpy"],
+        default=get_setting("VECTOR_BACKEND"),
+        help="numpy时同步后同时导出向量快照，默认按各知识库的配置",
+    )
+    args = parser.parse_args()
+    setup_logging()
+
+    names = list(KNOWLEDGE_BASES) if args.kb == "all" else [args.kb]
+
+    # --workers启动的进程池按同一配置加载模型
+    os.environ["EMBEDDING_BACKEND"] = args.embedding_backend
+    start = time.perf_counter()
+    embed_model, backend = create_embed_model(args.embedding_backend, args.model, warmup=False)
+    # 所选后端加载失败回退时，进程池也要使用实际的后端，否则同一索引中混有两种向量
+    os.environ["EMBEDDING_BACKEND"] = backend
+    Settings.embed_model = embed_model
+    print(f"embedding模型({backend})加载完成，耗时 {time.perf_counter() - start:.2f}s")
+
+    chroma_client = chromadb.PersistentClient(path=PERSIST_DIR)
+    for name in names:
+        kb = KnowledgeBase(
+            KNOWLEDGE_BASES[name], DATA_DIR, PERSIST_DIR, args.vector_backend, VectorStoreConfig.from_settings()
+        )
+        stats = kb.sync(
+            chroma_client,
+            embed_model=embed_model,
+            force=args.force,
+            batch_size=args.batch_size,
+            workers=args.workers,
+            model_path=args.model,
+            progress=print_progress,
+        )
+        print(
+            f"{name}: 新增 {stats['added']}, 删除 {stats['deleted']}, 未变 {stats['unchanged']}, "
+            f"共 {kb.collection.count()} 条, 耗时 {stats['seconds']:.2f}s"
+        )
+    print(f"全部完成，总耗时 {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+import asyncio
+import logging
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from llama_index.core.schema import NodeWithScore, QueryBundle
+
+from cache import TTLLRUCache, normalize_query
+from lexical import reciprocal_rank_fusion, record_to_node
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class RetrievalExecutor:
+    """把检索从事件循环中移到线程池执行，并对并发查询做微批处理
+
+    在batch_window时间窗口内到达的查询会合并成一次embed_model批量调用，
+    随后每个查询各自使用算好的向量执行向量检索，调用方只拿到自己的节点。
+
+    查询向量按归一化文本缓存；检索结果按 (collection, version, top_k, 归一化文本) 缓存。
+    version为索引的版本（带版本号的collection名），热更新后新版本的查询不会读到旧版本的结果，
+    即使检索开始前调用方拿到的还是旧索引；旧版本的结果由invalidate(collection, 旧version)清除。
+    """
+
+    def __init__(
+        self,
+        embed_model,
+        max_workers=4,
+        batch_window=0.005,
+        max_batch_size=64,
+        embedding_cache_size=4096,
+        result_cache_size=2048,
+        cache_ttl=3600,
+        candidate_factor=3,
+    ):
+        self.embed_model = embed_model
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.candidate_factor = candidate_factor
+        self.exact_hits = 0  # 混合检索中精确匹配直接返回的次数
+        self.embedding_cache = TTLLRUCache(embedding_cache_size, cache_ttl)
+        self.result_cache = TTLLRUCache(result_cache_size, cache_ttl)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="retrieval")
+        self._pending = []  # [(query, future)]
+        self._flush_handle = None
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False)
+
+    def _embed_batch(self, texts):
+        # 当前模型对查询和文档不加前缀，查询向量可以直接走文档的批量接口
+        return self.embed_model.get_text_embedding_batch(texts)
+
+    async def embed(self, query):
+        """获取查询向量；未命中缓存时，同一时间窗口内的查询会被合并成一批"""
+        query = normalize_query(query)
+        hit, embedding = self.embedding_cache.get(query)
+        if hit:
+            return embedding
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((query, future))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.batch_window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.get_running_loop().create_task(self._run_batch(batch))
+
+    async def _run_batch(self, batch):
+        # 相同的查询文本只计算一次
+        texts = list(dict.fromkeys(query for query, _ in batch))
+        loop = asyncio.get_running_loop()
+        try:
+            embeddings = await loop.run_in_executor(self._pool, self._embed_batch, texts)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        by_text = dict(zip(texts, embeddings))
+        for text, embedding in by_text.items():
+            self.embedding_cache.set(text, embedding)
+        for query, future in batch:
+            if not future.done():
+                future.set_result(by_text[query])
+
+    async def retrieve(self, index, query, top_k, collection=None, lexical=None, version=None):
+        """在线程池中对指定索引执行检索，返回NodeWithScore列表
+
+        传入collection时启用结果缓存，version为index所属的版本，缓存按版本区分。传入lexical（LexicalIndex）时为混合检索：
+        查询与某条文档的问题、咒语名等字段完全相同时直接返回该文档，不计算向量；
+        否则向量检索和BM25检索各取top_k*candidate_factor条候选，用RRF融合后取前top_k条。
+        """
+        label = collection or "unknown"
+        cache_key = None
+        if collection is not None:
+            cache_key = (collection, version, top_k, normalize_query(query))
+            hit, nodes = self.result_cache.get(cache_key)
+            if hit:
+                metrics.incr("retrieval_cache_hits", label)
+                return nodes
+
+        if lexical is not None:
+            nodes = lexical.exact_match(query)
+            if nodes:
+                self.exact_hits += 1
+                metrics.incr("exact_match_hits", label)
+                return nodes[:top_k]
+
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        embedding = await self.embed(query)
+        searched = time.perf_counter()
+        metrics.observe("stage_embed_seconds", searched - start, label)
+        bundle = QueryBundle(query_str=query, embedding=embedding)
+        if lexical is None:
+            retriever = index.as_retriever(similarity_top_k=top_k)
+            nodes = await loop.run_in_executor(self._pool, retriever.retrieve, bundle)
+        else:
+            nodes = await loop.run_in_executor(self._pool, self._hybrid_retrieve, index, lexical, bundle, top_k)
+        metrics.observe("stage_vector_search_seconds", time.perf_counter() - searched, label)
+        if cache_key is not None:
+            self.result_cache.set(cache_key, nodes)
+        return nodes
+
+    async def embed_many(self, queries):
+        """批量获取查询向量：命中缓存的直接返回，其余合并为一次模型调用"""
+        texts = [normalize_query(query) for query in queries]
+        embeddings = {}
+        missing = []
+        for text in dict.fromkeys(texts):
+            hit, embedding = self.embedding_cache.get(text)
+            if hit:
+                embeddings[text] = embedding
+            else:
+                missing.append(text)
+        if missing:
+            loop = asyncio.get_running_loop()
+            computed = await loop.run_in_executor(self._pool, self._embed_batch, missing)
+            for text, embedding in zip(missing, computed):
+                self.embedding_cache.set(text, embedding)
+                embeddings[text] = embedding
+        return [embeddings[text] for text in texts]
+
+    async def retrieve_batch(self, collection, queries, top_k, lexical=None):
+        """批量检索：一次模型调用计算全部查询向量，一次collection.query完成全部查询的top-k
+
+        返回与queries一一对应的NodeWithScore列表；传入lexical时与retrieve相同，先做精确匹配，再做RRF融合。
+        不使用检索结果缓存。
+        """
+        results = [None] * len(queries)
+        if lexical is not None:
+            for i, query in enumerate(queries):
+                nodes = lexical.exact_match(query)
+                if nodes:
+                    self.exact_hits += 1
+                    results[i] = nodes[:top_k]
+        todo = [i for i, nodes in enumerate(results) if nodes is None]
+        if todo:
+            texts = [queries[i] for i in todo]
+            embeddings = await self.embed_many(texts)
+            loop = asyncio.get_running_loop()
+            found = await loop.run_in_executor(
+                self._pool, self._query_collection, collection, texts, embeddings, top_k, lexical
+            )
+            for i, nodes in zip(todo, found):
+                results[i] = nodes
+        return results
+
+    def _query_collection(self, collection, queries, embeddings, top_k, lexical):
+        n_results = top_k * self.candidate_factor if lexical is not None else top_k
+        raw = collection.query(
+            query_embeddings=embeddings, n_results=n_results, include=["documents", "metadatas", "distances"]
+        )
+        found = []
+        for query, ids, documents, metadatas, distances in zip(
+            queries, raw["ids"], raw["documents"], raw["metadatas"], raw["distances"]
+        ):
+            # 与ChromaVectorStore相同，相似度为exp(-距离)
+            nodes = [
+                NodeWithScore(node=record_to_node(node_id, text, metadata), score=math.exp(-distance))
+                for node_id, text, metadata, distance in zip(ids, documents, metadatas, distances)
+            ]
+            if lexical is not None:
+                nodes = reciprocal_rank_fusion([nodes, lexical.search(query, n_results)], top_k)
+            found.append(nodes)
+        return found
+
+    def _hybrid_retrieve(self, index, lexical, bundle, top_k):
+        candidates = top_k * self.candidate_factor
+        vector_nodes = index.as_retriever(similarity_top_k=candidates).retrieve(bundle)
+        lexical_nodes = lexical.search(bundle.query_str, candidates)
+        return reciprocal_rank_fusion([vector_nodes, lexical_nodes], top_k)
+
+    def invalidate(self, collection, version=None):
+        """清除该collection的检索结果缓存；传入version时只清除该版本的结果
+
+        旧版本上仍在进行的检索可能在此之后写入结果，这些条目只会被持有旧索引的请求读到，随LRU/TTL淘汰。
+        """
+        removed = self.result_cache.invalidate(
+            lambda key: key[0] == collection and (version is None or key[1] == version)
+        )
+        if removed:
+            logger.info(f"已清除{collection}的{removed}条检索缓存")
+        return removed
+
+    def cache_stats(self):
+        return {
+            "embedding": self.embedding_cache.stats(),
+            "retrieval": self.result_cache.stats(),
+            "exact_hits": self.exact_hits,
+        }
@@ -0,0 +1,149 @@
+"""生产环境启动：多个uvicorn worker共享一个embedding服务进程和只读的向量快照
+
+启动顺序：
+    1. 启动embedding服务进程（只有它加载模型），等待其开始监听；
+    2. 在当前进程中用该服务同步全部知识库，保证只有一个进程写Chroma和向量快照；
+    3. 启动N个uvicorn worker。worker通过EMBEDDING_SERVICE_ADDRESS请求查询向量，
+       以只读mmap打开同一份向量快照（默认numpy后端），不再各自加载模型和索引。
+       多个worker时会话默认保存在PERSIST_DIR下的SQLite中（SESSION_STORE_PATH），
+       追问落到其他worker时仍能取到之前的对话。
+
+开发调试仍使用 python app.py（单进程、自动重载）。
+
+用法（在server目录下）:
+    python serve.py --workers 4 --port 8000
+    python serve.py --workers 4 --embedding local       # 每个worker各自加载模型（对比用）
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import secrets
+import sys
+import time
+
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SERVER_DIR)
+
+from log_config import setup_logging  # noqa: E402
+from settings import EMBEDDING_MODEL_PATH, PERSIST_DIR, get_setting  # noqa: E402
+
+logger = logging.getLogger("serve")
+
+
+def start_embedding_service(model_path, authkey, batch_window, max_batch_size):
+    """启动embedding服务进程，返回 (进程, 监听地址)"""
+    from embedding_service import run_service
+
+    ctx = multiprocessing.get_context("spawn")
+    receiver, sender = ctx.Pipe(duplex=False)
+    process = ctx.Process(
+        target=run_service,
+        args=(model_path, authkey, sender),
+        kwargs={"batch_window": batch_window, "max_batch_size": max_batch_size},
+        name="embedding-service",
+        daemon=True,
+    )
+    process.start()
+    sender.close()
+    try:
+        status, result = receiver.recv()
+    except EOFError:
+        raise RuntimeError("embedding服务进程启动失败")
+    if status != "ok":
+        raise RuntimeError(f"embedding服务启动失败: {result}")
+    return process, result
+
+
+def sync_knowledge_bases(embed_model, vector_backend):
+    """worker启动前在当前进程中同步全部知识库，worker加载时只需打开已有的索引"""
+    import chromadb
+
+    from knowledge_base import KNOWLEDGE_BASES, KnowledgeBase
+    from settings import DATA_DIR, PERSIST_DIR
+    from vector_store import VectorStoreConfig
+
+    client = chromadb.PersistentClient(path=PERSIST_DIR)
+    for spec in KNOWLEDGE_BASES.values():
+        kb = KnowledgeBase(spec, DATA_DIR, PERSIST_DIR, vector_backend, VectorStoreConfig.from_settings())
+        stats = kb.sync(client, embed_model=embed_model)
+        kb.sweep_snapshots()
+        logger.info(f"{spec.display_name}同步完成: 新增{stats['added']}条, 删除{stats['deleted']}条, 耗时{stats['seconds']}秒")
+
+
+def default_session_store_path(workers):
+    """多个worker且未配置SESSION_STORE_PATH时返回共享的SQLite路径，否则返回None（保持原配置）"""
+    if workers <= 1 or get_setting("SESSION_STORE_PATH", ""):
+        return None
+    return os.path.join(PERSIST_DIR, "sessions.sqlite3")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="多worker生产环境启动")
+    parser.add_argument("--host", default=get_setting("HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=get_setting("PORT", 8000, int))
+    parser.add_argument("--workers", type=int, default=get_setting("WORKERS", os.cpu_count() or 1, int))
+    parser.add_argument(
+        "--embedding",
+        choices=["shared", "local"],
+        default=get_setting("EMBEDDING_MODE", "shared"),
+        help="shared: 单独的embedding服务进程；local: 每个worker各自加载模型",
+    )
+    parser.add_argument(
+        "--vector-backend",
+        choices=["chroma", "numpy"],
+        default=get_setting("VECTOR_BACKEND", "numpy"),
+        help="numpy时各worker共享内存映射的向量快照",
+    )
+    parser.add_argument("--model", default=EMBEDDING_MODEL_PATH, help="embedding模型路径")
+    args = parser.parse_args()
+
+    setup_logging()
+    # worker通过环境变量读取配置（spawn启动的子进程会继承）
+    os.environ["VECTOR_BACKEND"] = args.vector_backend
+    os.environ["EMBEDDING_MODEL_PATH"] = args.model
+    session_store_path = default_session_store_path(args.workers)
+    if session_store_path:
+        os.environ["SESSION_STORE_PATH"] = session_store_path
+        logger.info(f"会话保存在{session_store_path}，由{args.workers}个worker共享")
+
+    service = None
+    start = time.perf_counter()
+    if args.embedding == "shared":
+        from embedding_service import RemoteEmbedding
+
+        authkey = secrets.token_bytes(16)
+        service, address = start_embedding_service(
+            args.model,
+            authkey,
+            batch_window=get_setting("RETRIEVAL_BATCH_WINDOW_MS", 5, float) / 1000,
+            max_batch_size=get_setting("EMBEDDING_SERVICE_MAX_BATCH", 256, int),
+        )
+        os.environ["EMBEDDING_SERVICE_ADDRESS"] = f"{address[0]}:{address[1]}"
+        os.environ["EMBEDDING_SERVICE_AUTHKEY"] = authkey.hex()
+        embed_model = RemoteEmbedding(address, authkey)
+    else:
+        from embeddings import create_embed_model
+
+        os.environ.pop("EMBEDDING_SERVICE_ADDRESS", None)
+        embed_model, _ = create_embed_model(model_path=args.model, warmup=False)
+
+    try:
+        sync_knowledge_bases(embed_model, args.vector_backend)
+        del embed_model
+        logger.info(
+            f"准备完成，耗时{time.perf_counter() - start:.2f}秒，启动{args.workers}个worker: "
+            f"http://{args.host}:{args.port}"
+        )
+
+        import uvicorn
+
+        uvicorn.run("app:app", host=args.host, port=args.port, workers=args.workers, app_dir=SERVER_DIR)
+    finally:
+        if service is not None:
+            service.terminate()
+            service.join(5)
+
+
+if __name__ == "__main__":
+    main()
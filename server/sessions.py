@@ -0,0 +1,228 @@
+"""服务端会话：按session_id保存多轮对话，前端每次只需发送新消息
+
+- 检索：追问（"那它怎么用？"）单独检索不到相关内容，把最近几轮的用户问题合并进检索查询；
+- 上游：最近几轮原样发送，更早的轮次压缩成摘要，历史总量不超过token预算；
+- 存储：按 (角色, session_id) 保存，会话数有上限，按最近使用淘汰，超过ttl未使用的会话过期。
+  默认保存在进程内存中；设置persist_path时保存在SQLite中，多个worker共享同一份会话。
+"""
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from context_packer import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+_SESSION_ID = re.compile(r"^[A-Za-z0-9_\-]{8,64}$")
+# 指代上文的词：出现时说明问题依赖前文，需要与之前的问题合并检索
+_FOLLOW_UP = re.compile(
+    r"它|他|她|这个|那个|这些|那些|这种|那种|上面|刚才|前面|呢[？?]?$|还有|然后|怎么用"
+    r"|\b(it|its|this|that|these|those|they|them|one|else)\b",
+    re.IGNORECASE,
+)
+_SENTENCE_END = re.compile(r"(?<=[。！？!?\n])")
+MAX_REPLY_CHARS = 2000  # 每轮回答最多保存的字数，限制单个会话的内存占用
+
+
+def valid_session_id(session_id):
+    return bool(session_id) and bool(_SESSION_ID.match(session_id))
+
+
+def turns_from_messages(messages):
+    """从客户端发来的完整消息列表中提取此前的轮次 [(问题, 回答)]，不含最后一条用户消息"""
+    turns, question = [], None
+    dialog = [msg for msg in messages if msg.get("role") in ("user", "assistant")]
+    if dialog and dialog[-1].get("role") == "user":
+        dialog = dialog[:-1]
+    for msg in dialog:
+        if msg["role"] == "user":
+            question = msg.get("content") or ""
+        elif question is not None:
+            turns.append((question, msg.get("content") or ""))
+            question = None
+    return turns
+
+
+def is_follow_up(query, max_tokens=6):
+    """较短或含指代词的问题视为追问"""
+    return estimate_tokens(query) <= max_tokens or bool(_FOLLOW_UP.search(query))
+
+
+def rewrite_query(query, turns, max_turns=2, max_tokens=6):
+    """追问时把最近max_turns轮的用户问题合并到检索查询前面，否则原样返回"""
+    if not turns or max_turns <= 0 or not is_follow_up(query, max_tokens):
+        return query
+    previous = [question for question, _ in turns[-max_turns:] if question]
+    return " ".join(previous + [query])
+
+
+def _first_sentence(text, limit):
+    text = " ".join((text or "").split())
+    sentence = _SENTENCE_END.split(text, 1)[0] if text else ""
+    return sentence if len(sentence) <= limit else sentence[:limit] + "…"
+
+
+def build_history(turns, budget, recent_turns=2, summary_chars=60):
+    """把此前的轮次转为发给上游的消息，返回 (消息列表, 估算token数)
+
+    最近recent_turns轮原样发送（从最新的一轮开始放，放不下为止），更早的轮次每轮只保留问题和回答的
+    第一句，合并成一条摘要；摘要同样从新到旧放入剩余预算，放不下的最早轮次丢弃。
+    """
+    if not turns or budget <= 0:
+        return [], 0
+    used = 0
+    recent = []
+    split = len(turns) - min(max(recent_turns, 0), len(turns))
+    for i in range(len(turns) - 1, split - 1, -1):
+        question, answer = turns[i]
+        cost = estimate_tokens(question) + estimate_tokens(answer) + 8
+        if used + cost > budget:
+            # 放不下的近期轮次也改为摘要
+            split = i + 1
+            break
+        recent.insert(0, turns[i])
+        used += cost
+    older = turns[:split]
+
+    lines = []
+    header = "此前对话摘要："
+    used += estimate_tokens(header)
+    for question, answer in reversed(older):
+        line = f"- 用户：{_first_sentence(question, summary_chars)} 回答：{_first_sentence(answer, summary_chars)}"
+        cost = estimate_tokens(line) + 1
+        if used + cost > budget:
+            break
+        lines.insert(0, line)
+        used += cost
+
+    messages = []
+    if lines:
+        messages.append({"role": "system", "content": "\n".join([header] + lines)})
+    else:
+        used -= estimate_tokens(header)
+    for question, answer in recent:
+        messages += [{"role": "user", "content": question}, {"role": "assistant", "content": answer}]
+    return messages, used
+
+
+class SessionStore:
+    def __init__(self, maxsize=10000, ttl=None, max_turns=20, persist_path=None):
+        self.maxsize = maxsize
+        self.ttl = ttl or None
+        self.max_turns = max_turns
+        self.persist_path = persist_path
+        self._sessions = OrderedDict()  # (角色, session_id) -> (最后使用时间, 轮次列表)，按最近使用排序
+        self._lock = threading.Lock()
+        self._db = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._writes = 0
+        if persist_path:
+            os.makedirs(os.path.dirname(persist_path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(persist_path, check_same_thread=False, timeout=5)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions (persona TEXT, id TEXT, turns TEXT, updated REAL, "
+                "PRIMARY KEY (persona, id))"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated)")
+            self._db.commit()
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _expired(self, updated, now):
+        return self.ttl is not None and now - updated > self.ttl
+
+    def get(self, persona, session_id):
+        """返回会话此前的轮次 [(问题, 回答)]，会话不存在或已过期时返回空列表"""
+        if self.maxsize <= 0:
+            return []
+        now = time.time()
+        with self._lock:
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT turns, updated FROM sessions WHERE persona = ? AND id = ?", (persona, session_id)
+                ).fetchone()
+                entry = (row[1], [tuple(turn) for turn in json.loads(row[0])]) if row else None
+            else:
+                entry = self._sessions.get((persona, session_id))
+            if entry is None or self._expired(entry[0], now):
+                self.misses += 1
+                return []
+            if self._db is None:
+                self._sessions.move_to_end((persona, session_id))
+            self.hits += 1
+            return list(entry[1])
+
+    def append(self, persona, session_id, question, answer):
+        """记录一轮对话，只保留最近max_turns轮"""
+        if self.maxsize <= 0:
+            return
+        now = time.time()
+        turn = (question, (answer or "")[:MAX_REPLY_CHARS])
+        with self._lock:
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT turns, updated FROM sessions WHERE persona = ? AND id = ?", (persona, session_id)
+                ).fetchone()
+                turns = json.loads(row[0]) if row and not self._expired(row[1], now) else []
+                turns = (turns + [list(turn)])[-self.max_turns :]
+                self._db.execute(
+                    "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?)",
+                    (persona, session_id, json.dumps(turns, ensure_ascii=False), now),
+                )
+                self._writes += 1
+                if self._writes % 100 == 1:
+                    self._evict_db(now)
+                self._db.commit()
+                return
+
+            key = (persona, session_id)
+            entry = self._sessions.get(key)
+            turns = [] if entry is None or self._expired(entry[0], now) else entry[1]
+            self._sessions[key] = (now, (turns + [turn])[-self.max_turns :])
+            self._sessions.move_to_end(key)
+            while len(self._sessions) > self.maxsize:
+                self._sessions.popitem(last=False)
+                self.evictions += 1
+
+    def _evict_db(self, now):
+        # 每100次写入清理一次，SQLite中的会话数可能暂时略超过maxsize
+        if self.ttl is not None:
+            self._db.execute("DELETE FROM sessions WHERE updated < ?", (now - self.ttl,))
+        removed = self._db.execute(
+            "DELETE FROM sessions WHERE rowid NOT IN (SELECT rowid FROM sessions ORDER BY updated DESC LIMIT ?)",
+            (self.maxsize,),
+        ).rowcount
+        self.evictions += max(removed, 0)
+
+    def size(self):
+        with self._lock:
+            if self._db is not None:
+                return self._db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+            return len(self._sessions)
+
+    def stats(self):
+        size = self.size()
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": size,
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "max_turns": self.max_turns,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "persist_path": self.persist_path,
+            }
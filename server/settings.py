@@ -0,0 +1,55 @@
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 配置文件路径：与app.py同目录的config.json
+CONFIG_PATH = os.path.join(SERVER_DIR, "config.json")
+
+_config_cache = None
+
+
+def load_config():
+    """读取config.json，文件不存在或解析失败时返回空字典（结果会被缓存）"""
+    global _config_cache
+    if _config_cache is None:
+        _config_cache = {}
+        if os.path.exists(CONFIG_PATH):
+            try:
+                with open(CONFIG_PATH, "r", encoding="utf-8") as f:
+                    _config_cache = json.load(f)
+            except Exception as e:
+                logger.warning(f"读取配置文件出错: {e}")
+    return _config_cache
+
+
+def get_setting(name, default=None, cast=None):
+    """按 环境变量 -> config.json -> 默认值 的顺序读取配置项"""
+    value = os.environ.get(name)
+    if value is None:
+        value = load_config().get(name)
+    if value is None:
+        return default
+    if cast is not None:
+        try:
+            if cast is bool and isinstance(value, str):
+                return value.strip().lower() in ("1", "true", "yes", "on")
+            return cast(value)
+        except (TypeError, ValueError):
+            logger.warning(f"配置项 {name} 的值无效: {value!r}，使用默认值 {default!r}")
+            return default
+    return value
+
+
+# 数据目录与持久化目录：相对路径均以server目录为基准，与启动时的工作目录无关
+DATA_DIR = os.path.normpath(os.path.join(SERVER_DIR, "..", "data"))
+PERSIST_DIR = os.path.join(SERVER_DIR, get_setting("PERSIST_DIR", "chroma_db"))
+
+# 加载本地embedding模型
+EMBEDDING_MODEL_PATH = get_setting(
+    "EMBEDDING_MODEL_PATH",
+    r"C:\Users\Boredommm\.cache\modelscope\hub\models\sentence-transformers\paraphrase-multilingual-MiniLM-L12-v2",
+)
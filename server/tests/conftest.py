@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 服务端模块按server目录下的顶层模块导入（与app.py相同）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,156 @@
+"""准入控制的测试：优先级排队、截止时间拒绝、熔断状态转换与探测名额"""
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import admission
+from admission import PRIORITIES, AdmissionError, CircuitBreaker, UpstreamScheduler
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # 只替换admission模块看到的时钟，事件循环仍使用真实时间
+    fake = FakeClock()
+    monkeypatch.setattr(admission, "time", SimpleNamespace(monotonic=fake))
+    return fake
+
+
+@pytest.mark.asyncio
+async def test_scheduler_hands_slots_out_by_priority():
+    scheduler = UpstreamScheduler(max_concurrency=1)
+    await scheduler.acquire()
+    order = []
+
+    async def request(priority):
+        await scheduler.acquire(priority)
+        order.append(priority)
+        scheduler.release(0.01)
+
+    # 按优先级从低到高的顺序到达
+    tasks = [asyncio.create_task(request(PRIORITIES[name])) for name in ("batch", "background", "interactive")]
+    await asyncio.sleep(0)
+    assert scheduler.stats()["queued"] == 3
+
+    scheduler.release(0.01)
+    await asyncio.gather(*tasks)
+
+    assert order == [PRIORITIES["interactive"], PRIORITIES["background"], PRIORITIES["batch"]]
+    assert scheduler.stats()["active"] == 0 and scheduler.stats()["queued"] == 0
+
+
+@pytest.mark.asyncio
+async def test_scheduler_rejects_when_estimated_wait_misses_deadline():
+    scheduler = UpstreamScheduler(max_concurrency=1)
+    await scheduler.acquire()
+    scheduler.service_time = 1.0
+
+    with pytest.raises(AdmissionError) as rejected:
+        scheduler.check(0, deadline=time.monotonic() + 0.1)
+    assert rejected.value.reason == "deadline"
+    assert rejected.value.status_code == 503
+    # 截止时间足够时可以排队
+    scheduler.check(0, deadline=time.monotonic() + 5)
+
+
+@pytest.mark.asyncio
+async def test_scheduler_queued_request_times_out_at_deadline():
+    scheduler = UpstreamScheduler(max_concurrency=1)
+    await scheduler.acquire()
+
+    with pytest.raises(AdmissionError) as rejected:
+        await scheduler.acquire(0, deadline=time.monotonic() + 0.05)
+    assert rejected.value.reason == "deadline"
+    assert scheduler.stats()["queued"] == 0
+
+    # 名额归还后没有遗留的排队请求占用它
+    scheduler.release(None)
+    assert scheduler.stats()["active"] == 0
+
+
+def test_breaker_opens_half_opens_and_closes(clock):
+    breaker = CircuitBreaker(window=30, min_requests=2, error_rate=0.5, cooldown=10)
+    breaker.record(False)
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record(False)
+    assert breaker.state == CircuitBreaker.OPEN and breaker.opened == 1
+    with pytest.raises(AdmissionError) as rejected:
+        breaker.acquire()
+    assert rejected.value.reason == "circuit_open"
+
+    clock.advance(10)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    with breaker.call():
+        # 探测请求在途时其他请求被拒绝
+        with pytest.raises(AdmissionError):
+            breaker.acquire()
+        breaker.record(True)
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.stats()["requests"] == 0
+
+
+def test_breaker_failed_probe_reopens_and_counts(clock):
+    breaker = CircuitBreaker(min_requests=1, error_rate=0.5, cooldown=10)
+    breaker.record(False)
+    clock.advance(10)
+
+    with breaker.call():
+        breaker.record(False)
+
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.opened == 2
+    clock.advance(10)
+    # 重新打开后的下一次冷却结束时，探测名额已经归还
+    assert breaker.acquire() is True
+
+
+@pytest.mark.asyncio
+async def test_breaker_cancelled_probe_releases_slot(clock):
+    breaker = CircuitBreaker(min_requests=1, error_rate=0.5, cooldown=10)
+    breaker.record(False)
+    clock.advance(10)
+    entered = asyncio.Event()
+
+    async def probe():
+        with breaker.call():
+            entered.set()
+            await asyncio.Event().wait()
+
+    task = asyncio.create_task(probe())
+    await asyncio.wait_for(entered.wait(), 1)
+    with pytest.raises(AdmissionError):
+        breaker.acquire()
+
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    # 被取消的探测没有结果，熔断器仍为半开，下一个请求可以继续探测
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    with breaker.call():
+        breaker.record(True)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_breaker_probe_released_on_unexpected_error(clock):
+    breaker = CircuitBreaker(min_requests=1, error_rate=0.5, cooldown=10)
+    breaker.record(False)
+    clock.advance(10)
+
+    with pytest.raises(ValueError):
+        with breaker.call():
+            raise ValueError("不是httpx异常")
+
+    assert breaker.acquire() is True
@@ -0,0 +1,109 @@
+"""查询缓存的测试：LRU淘汰、TTL过期、按条件失效与查询归一化"""
+from types import SimpleNamespace
+
+import pytest
+from llama_index.core.embeddings import MockEmbedding
+
+import cache
+from cache import TTLLRUCache, normalize_query
+from retrieval import RetrievalExecutor
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache, "time", SimpleNamespace(monotonic=lambda: now[0]))
+    return now
+
+
+def test_lru_evicts_least_recently_used():
+    lru = TTLLRUCache(maxsize=2)
+    lru.set("a", 1)
+    lru.set("b", 2)
+    assert lru.get("a") == (True, 1)
+    lru.set("c", 3)
+
+    assert lru.get("b") == (False, None)
+    assert lru.get("a") == (True, 1) and lru.get("c") == (True, 3)
+    assert lru.stats()["evictions"] == 1
+
+
+def test_entries_expire_after_ttl(clock):
+    lru = TTLLRUCache(maxsize=10, ttl=60)
+    lru.set("a", 1)
+
+    clock[0] += 59
+    assert lru.get("a") == (True, 1)
+    clock[0] += 1
+    assert lru.get("a") == (False, None)
+
+    stats = lru.stats()
+    assert stats["expirations"] == 1 and stats["size"] == 0
+    assert stats["hits"] == 1 and stats["misses"] == 1 and stats["hit_rate"] == 0.5
+
+
+def test_zero_ttl_never_expires_and_zero_size_disables(clock):
+    lru = TTLLRUCache(maxsize=10, ttl=0)
+    lru.set("a", 1)
+    clock[0] += 10**9
+    assert lru.get("a") == (True, 1)
+
+    disabled = TTLLRUCache(maxsize=0)
+    disabled.set("a", 1)
+    assert disabled.get("a") == (False, None)
+
+
+def test_invalidate_by_predicate_or_all():
+    lru = TTLLRUCache()
+    for key in [("magic", 1), ("magic", 2), ("minecraft", 1)]:
+        lru.set(key, key)
+
+    assert lru.invalidate(lambda key: key[0] == "magic") == 2
+    assert lru.get(("minecraft", 1))[0]
+    assert lru.invalidate() == 1
+    assert lru.stats()["size"] == 0
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("苦力怕怕什么？", "苦力怕怕什么"),
+        ("  Creeper   怕 什么?! ", "creeper 怕 什么"),
+        ("ＡＢＣ１２３", "abc123"),
+        (None, ""),
+    ],
+)
+def test_normalize_query(text, expected):
+    assert normalize_query(text) == expected
+
+
+class CountingIndex:
+    def __init__(self):
+        self.calls = []
+
+    def as_retriever(self, similarity_top_k):
+        self.top_k = similarity_top_k
+        return self
+
+    def retrieve(self, bundle):
+        self.calls.append((bundle.query_str, self.top_k))
+        return [bundle.query_str]
+
+
+@pytest.mark.asyncio
+async def test_result_cache_is_keyed_by_collection_top_k_and_normalized_query():
+    executor = RetrievalExecutor(MockEmbedding(embed_dim=8), batch_window=0)
+    index = CountingIndex()
+
+    await executor.retrieve(index, "火球术？", 3, collection="magic")
+    await executor.retrieve(index, " 火球术", 3, collection="magic")
+    assert len(index.calls) == 1
+    # top_k或知识库不同时不共享结果
+    await executor.retrieve(index, "火球术", 5, collection="magic")
+    await executor.retrieve(index, "火球术", 3, collection="riddle")
+    assert len(index.calls) == 3
+    # 不传collection时不缓存
+    await executor.retrieve(index, "火球术", 3)
+    await executor.retrieve(index, "火球术", 3)
+    assert len(index.calls) == 5
+    executor.shutdown()
@@ -0,0 +1,209 @@
+"""请求合并（SingleFlight）的测试：取消隔离与流式订阅的补发"""
+import asyncio
+
+import pytest
+
+from coalesce import SingleFlight
+
+
+@pytest.mark.asyncio
+async def test_run_leader_cancel_does_not_cancel_followers():
+    flight = SingleFlight()
+    release = asyncio.Event()
+    calls = 0
+
+    async def factory():
+        nonlocal calls
+        calls += 1
+        await release.wait()
+        return "answer"
+
+    leader = asyncio.create_task(flight.run("k", factory))
+    await asyncio.sleep(0)
+    follower = asyncio.create_task(flight.run("k", factory))
+    await asyncio.sleep(0)
+
+    # 第一个请求的客户端断开，共享的执行不能被取消
+    leader.cancel()
+    await asyncio.sleep(0)
+    release.set()
+
+    assert await follower == "answer"
+    assert leader.cancelled()
+    assert calls == 1
+    assert flight.stats() == {"in_flight": 0, "leaders": 1, "coalesced": 1}
+
+
+@pytest.mark.asyncio
+async def test_run_shares_exception_and_forgets_key():
+    flight = SingleFlight()
+
+    async def failing():
+        await asyncio.sleep(0)
+        raise ValueError("upstream")
+
+    results = await asyncio.gather(flight.run("k", failing), flight.run("k", failing), return_exceptions=True)
+
+    assert [type(r) for r in results] == [ValueError, ValueError]
+    assert flight.stats()["in_flight"] == 0
+
+
+async def _collect(events):
+    return [event async for event in events]
+
+
+@pytest.mark.asyncio
+async def test_stream_late_subscriber_replays_earlier_events():
+    flight = SingleFlight()
+    step = asyncio.Event()
+    completed = []
+
+    async def factory(publish_result):
+        async def events():
+            yield "a"
+            yield "b"
+            await step.wait()
+            yield "c"
+            publish_result("abc")
+
+        return events()
+
+    first = await flight.stream("k", factory, on_complete=completed.append)
+    first_task = asyncio.create_task(_collect(first))
+    # 等生产者发出前两个事件后再加入
+    for _ in range(10):
+        await asyncio.sleep(0)
+    assert flight._streams["k"].events == ["a", "b"]
+    late = await flight.stream("k", factory, on_complete=completed.append)
+    late_task = asyncio.create_task(_collect(late))
+    await asyncio.sleep(0)
+    step.set()
+
+    assert await first_task == ["a", "b", "c"]
+    assert await late_task == ["a", "b", "c"]
+    assert completed == ["abc", "abc"]
+    assert flight.stats() == {"in_flight": 0, "leaders": 1, "coalesced": 1}
+
+
+@pytest.mark.asyncio
+async def test_stream_cancels_producer_when_all_subscribers_leave():
+    flight = SingleFlight()
+    cancelled = asyncio.Event()
+
+    async def factory(publish_result):
+        async def events():
+            try:
+                yield "a"
+                await asyncio.Event().wait()
+            finally:
+                cancelled.set()
+
+        return events()
+
+    events = await flight.stream("k", factory)
+    assert await events.__anext__() == "a"
+    await events.aclose()
+
+    await asyncio.wait_for(cancelled.wait(), 1)
+
+
+@pytest.mark.asyncio
+async def test_stream_follower_never_consumed_still_lets_producer_be_cancelled():
+    flight = SingleFlight()
+    cancelled = asyncio.Event()
+
+    async def factory(publish_result):
+        async def events():
+            try:
+                yield "a"
+                await asyncio.Event().wait()
+            finally:
+                cancelled.set()
+
+        return events()
+
+    leader = await flight.stream("k", factory)
+    # 跟随者的客户端在第一个分片前断开：订阅从未被迭代，只由响应关闭
+    follower = await flight.stream("k", factory)
+    assert flight._streams["k"].subscribers == 2
+    assert await leader.__anext__() == "a"
+    await leader.aclose()
+    assert not cancelled.is_set()
+
+    await follower.aclose()
+    await asyncio.wait_for(cancelled.wait(), 1)
+    assert flight.stats()["in_flight"] == 0
+
+
+@pytest.mark.asyncio
+async def test_stream_dropped_subscription_leaves_without_aclose():
+    flight = SingleFlight()
+    cancelled = asyncio.Event()
+
+    async def factory(publish_result):
+        async def events():
+            try:
+                await asyncio.Event().wait()
+                yield "never"
+            finally:
+                cancelled.set()
+
+        return events()
+
+    events = await flight.stream("k", factory)
+    # 订阅对象被丢弃（例如创建响应前出错）时同样退出
+    del events
+    await asyncio.wait_for(cancelled.wait(), 1)
+
+
+@pytest.mark.asyncio
+async def test_tighter_deadline_does_not_join_looser_request():
+    flight = SingleFlight()
+    release = asyncio.Event()
+    deadlines = []
+
+    def factory(deadline):
+        async def call():
+            deadlines.append(deadline)
+            await release.wait()
+            return deadline
+
+        return call
+
+    loose = asyncio.create_task(flight.run("k", factory(10.0), deadline=10.0))
+    await asyncio.sleep(0)
+    # 截止时间更紧：单独执行，不沿用先到请求的截止时间
+    tight = asyncio.create_task(flight.run("k", factory(5.0), deadline=5.0))
+    # 截止时间更宽松或没有截止时间：可以合并
+    looser = asyncio.create_task(flight.run("k", factory(20.0), deadline=20.0))
+    unbounded = asyncio.create_task(flight.run("k", factory(None)))
+    await asyncio.sleep(0)
+    release.set()
+
+    assert await asyncio.gather(loose, tight, looser, unbounded) == [10.0, 5.0, 10.0, 10.0]
+    assert sorted(deadlines) == [5.0, 10.0]
+    assert flight.stats() == {"in_flight": 0, "leaders": 2, "coalesced": 2}
+
+
+@pytest.mark.asyncio
+async def test_stream_tighter_deadline_gets_own_producer():
+    flight = SingleFlight()
+    produced = []
+
+    def factory(name):
+        async def open_stream(publish_result):
+            produced.append(name)
+
+            async def events():
+                yield name
+
+            return events()
+
+        return open_stream
+
+    first = await flight.stream("k", factory("loose"), deadline=10.0)
+    second = await flight.stream("k", factory("tight"), deadline=5.0)
+
+    assert await _collect(first) == ["loose"]
+    assert await _collect(second) == ["tight"]
+    assert produced == ["loose", "tight"]
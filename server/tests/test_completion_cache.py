@@ -0,0 +1,92 @@
+"""语义回答缓存的测试：相似度阈值、分区、temperature限制、淘汰、过期、失效与SQLite持久化"""
+import pytest
+
+from completion_cache import SemanticCompletionCache
+
+SCOPE = SemanticCompletionCache.scope("wizard", 512)
+RESPONSE = {"choices": [{"message": {"content": "照明咒。"}}]}
+
+
+def test_hit_only_above_similarity_threshold():
+    cache = SemanticCompletionCache(threshold=0.9)
+    cache.set(SCOPE, "荧光闪烁是什么", [1.0, 0.0], RESPONSE, latency=2.0)
+
+    response, similarity = cache.get(SCOPE, [0.99, 0.05])
+    assert response == RESPONSE and similarity >= 0.9
+    # 余弦约0.71，低于阈值
+    response, similarity = cache.get(SCOPE, [1.0, 1.0])
+    assert response is None and similarity == pytest.approx(0.7071, abs=1e-3)
+
+    stats = cache.stats()
+    assert stats["hits"] == 1 and stats["misses"] == 1 and stats["saved_seconds"] == 2.0
+
+
+def test_entries_are_partitioned_by_persona_and_max_tokens():
+    cache = SemanticCompletionCache()
+    cache.set(SCOPE, "q", [1.0, 0.0], RESPONSE, latency=1.0)
+
+    assert cache.get(SemanticCompletionCache.scope("wizard", 1024), [1.0, 0.0]) == (None, 0.0)
+    assert cache.get(SemanticCompletionCache.scope("riddle", 512), [1.0, 0.0]) == (None, 0.0)
+
+
+def test_high_temperature_is_not_cacheable():
+    cache = SemanticCompletionCache(max_temperature=0.8)
+
+    assert cache.cacheable(0.7) and cache.cacheable(None)
+    assert not cache.cacheable(1.2)
+    assert not SemanticCompletionCache(maxsize=0).cacheable(0.0)
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = SemanticCompletionCache(maxsize=2, threshold=0.99)
+    cache.set(SCOPE, "a", [1.0, 0.0, 0.0], {"answer": "a"}, latency=1.0)
+    cache.set(SCOPE, "b", [0.0, 1.0, 0.0], {"answer": "b"}, latency=1.0)
+    cache.get(SCOPE, [1.0, 0.0, 0.0])
+    cache.set(SCOPE, "c", [0.0, 0.0, 1.0], {"answer": "c"}, latency=1.0)
+
+    assert cache.get(SCOPE, [0.0, 1.0, 0.0])[0] is None
+    assert cache.get(SCOPE, [1.0, 0.0, 0.0])[0] == {"answer": "a"}
+    assert cache.stats()["evictions"] == 1
+
+
+def test_expired_entry_is_dropped(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("completion_cache.time.time", lambda: now[0])
+    cache = SemanticCompletionCache(ttl=60)
+    cache.set(SCOPE, "q", [1.0, 0.0], RESPONSE, latency=1.0)
+
+    now[0] += 61
+    assert cache.get(SCOPE, [1.0, 0.0])[0] is None
+    assert cache.stats()["size"] == 0
+
+
+def test_invalidate_drops_only_that_persona():
+    cache = SemanticCompletionCache()
+    cache.set(SCOPE, "q", [1.0, 0.0], RESPONSE, latency=1.0)
+    cache.set(SemanticCompletionCache.scope("riddle", 512), "q", [1.0, 0.0], RESPONSE, latency=1.0)
+
+    assert cache.invalidate("wizard") == 1
+    assert cache.get(SCOPE, [1.0, 0.0])[0] is None
+    assert cache.get(SemanticCompletionCache.scope("riddle", 512), [1.0, 0.0])[0] == RESPONSE
+
+
+def test_sqlite_persistence_survives_restart_and_respects_maxsize(tmp_path, monkeypatch):
+    # 每次取时间都前进1秒，最近使用的顺序不依赖时钟精度
+    now = iter(range(1000, 2000))
+    monkeypatch.setattr("completion_cache.time.time", lambda: float(next(now)))
+    path = str(tmp_path / "completions.sqlite3")
+    cache = SemanticCompletionCache(maxsize=5, persist_path=path)
+    for i in range(3):
+        vector = [0.0, 0.0, 0.0]
+        vector[i] = 1.0
+        cache.set(SCOPE, f"q{i}", vector, {"answer": i}, latency=1.0)
+    cache.get(SCOPE, [1.0, 0.0, 0.0])
+    cache.close()
+
+    # 重启时只恢复最近使用的maxsize条
+    restored = SemanticCompletionCache(maxsize=2, persist_path=path)
+    assert restored.stats()["size"] == 2
+    assert restored.get(SCOPE, [1.0, 0.0, 0.0])[0] == {"answer": 0}
+    assert restored.get(SCOPE, [0.0, 0.0, 1.0])[0] == {"answer": 2}
+    assert restored.get(SCOPE, [0.0, 1.0, 0.0])[0] is None
+    restored.close()
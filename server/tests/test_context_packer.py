@@ -0,0 +1,71 @@
+"""参考内容组装的测试：按分数放入、去重、裁剪与丢弃，以及知识库按上下文窗口收紧预算"""
+from llama_index.core.schema import NodeWithScore, TextNode
+
+from context_packer import estimate_tokens, pack_context
+from knowledge_base import KNOWLEDGE_BASES, KnowledgeBase
+
+
+def scored(text, score):
+    return NodeWithScore(node=TextNode(text=text), score=score)
+
+
+def test_estimate_tokens_weights_chinese_higher():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("你好世界" * 10) > estimate_tokens("abcd" * 10)
+
+
+def test_documents_are_packed_by_score_within_budget():
+    nodes = [scored("低分文档", 0.1), scored("高分文档", 0.9), scored("中间文档", 0.5)]
+
+    packed = pack_context(nodes, budget=1000)
+
+    assert packed.text.split("\n\n") == ["高分文档", "中间文档", "低分文档"]
+    assert packed.used == 3 and packed.tokens == packed.original_tokens
+    assert packed.tokens_saved == 0
+
+
+def test_near_duplicates_are_skipped():
+    text = "咒语: 荧光闪烁 | Lumos\n效果: 魔杖尖端发光"
+    nodes = [scored(text, 0.9), scored(text + "。", 0.8), scored("咒语: 诺克斯 | Nox", 0.7)]
+
+    packed = pack_context(nodes, budget=1000)
+
+    assert packed.duplicates == 1 and packed.used == 2
+    assert packed.tokens < packed.original_tokens
+
+
+def test_oversized_document_is_trimmed_by_line():
+    long_text = "\n".join(f"第{i}行：苦力怕靠近玩家时会爆炸" for i in range(50))
+
+    packed = pack_context([scored(long_text, 0.9)], budget=100, min_trim_tokens=32)
+
+    assert packed.trimmed == 1
+    assert packed.text.startswith("第0行") and packed.text.endswith("\n...")
+    assert packed.tokens <= 100
+
+
+def test_document_is_dropped_when_too_little_budget_remains():
+    first = "短文档" * 20
+    long_text = "\n".join(f"第{i}行：很长的文档" for i in range(50))
+    budget = estimate_tokens(first) + 20
+
+    packed = pack_context([scored(first, 0.9), scored(long_text, 0.8), scored("短", 0.1)], budget=budget)
+
+    # 剩余预算不足min_trim_tokens，跳过长文档后仍放入后面更短的文档
+    assert packed.dropped == 1 and packed.trimmed == 0
+    assert packed.text.endswith("短") and packed.used == 2
+    assert packed.tokens <= budget
+
+
+def test_knowledge_base_budget_leaves_room_for_max_tokens(tmp_path):
+    kb = KnowledgeBase(KNOWLEDGE_BASES["minecraft"], str(tmp_path), str(tmp_path))
+    nodes = [scored("\n".join(f"第{i}行：{'红石' * 10}" for i in range(40)), 0.9)]
+
+    full = kb.pack_context(nodes)
+    assert 0 < full.tokens <= kb.spec.context_tokens
+
+    # 上下文窗口几乎被max_tokens占满时，参考内容随之收紧
+    room = estimate_tokens(kb.spec.prompt_template) + estimate_tokens("红石") + 200
+    tight = kb.pack_context(nodes, query="红石", max_tokens=1000, context_window=1000 + room)
+    assert tight.tokens <= 200 < full.tokens
+    assert kb.pack_context(nodes, max_tokens=5000, context_window=1000).text == ""
@@ -0,0 +1,23 @@
+"""embedding模型创建的测试：记录实际使用的后端与模型文件，供知识库清单比对"""
+from llama_index.core.embeddings import MockEmbedding
+
+import embeddings
+from embeddings import create_embed_model, embedding_signature
+
+
+def test_signature_records_fallback_backend(monkeypatch):
+    def load(backend, model_path, threads):
+        if backend == "onnx-int8":
+            raise ImportError("No module named 'onnxruntime'")
+        return MockEmbedding(embed_dim=8)
+
+    monkeypatch.setattr(embeddings, "_load", load)
+
+    embed_model, backend = create_embed_model("onnx-int8", "BAAI/bge-small-zh", warmup=False)
+
+    assert backend == "huggingface"
+    assert embedding_signature(embed_model) == {"backend": "huggingface", "model": "BAAI/bge-small-zh"}
+
+
+def test_signature_is_none_for_models_not_created_here():
+    assert embedding_signature(MockEmbedding(embed_dim=8)) is None
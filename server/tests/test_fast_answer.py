@@ -0,0 +1,47 @@
+"""快速回答索引的测试：精确与近似匹配、有多个答案的问题不收录"""
+from fast_answer import AnswerIndex, FastAnswerConfig
+
+RIDDLES = [
+    {"riddle": "什么东西越洗越脏？", "answer": "水"},
+    {"riddle": "什么门永远关不上？", "answer": "球门"},
+    {"riddle": "什么东西有头无脚？", "answer": "砖头"},
+    {"riddle": "什么东西有头无脚？", "answer": "针"},
+    {"riddle": "", "answer": "没有问题"},
+    "不是字典的记录",
+]
+
+
+def make_index(similarity=None):
+    config = FastAnswerConfig("riddle", "answer", "谜底是：{answer}", similarity=similarity)
+    return AnswerIndex.from_records(RIDDLES, config)
+
+
+def test_exact_lookup_uses_normalized_question():
+    index = make_index()
+
+    assert index.lookup("什么东西越洗越脏") == ("什么东西越洗越脏？", "水", 1.0)
+    assert index.lookup(" 什么门永远关不上?") == ("什么门永远关不上？", "球门", 1.0)
+    assert index.render("什么门永远关不上？", "球门") == "谜底是：球门"
+
+
+def test_questions_with_conflicting_answers_are_left_to_the_model():
+    index = make_index(similarity=0.5)
+
+    assert index.lookup("什么东西有头无脚？") is None
+    assert index.ambiguous == 1
+    assert len(index) == 2
+
+
+def test_exact_only_without_similarity_threshold():
+    assert make_index().lookup("什么东西越洗会越脏？") is None
+
+
+def test_near_duplicate_lookup_respects_threshold():
+    index = make_index(similarity=0.7)
+
+    question, answer, score = index.lookup("什么东西越洗会越脏？")
+    assert (question, answer) == ("什么东西越洗越脏？", "水")
+    assert 0.7 <= score < 1.0
+    assert make_index(similarity=0.95).lookup("什么东西越洗会越脏？") is None
+    assert index.lookup("今天天气怎么样") is None
+    assert index.lookup("？") is None
@@ -0,0 +1,27 @@
+"""流式JSON解析：元素跨越读取缓冲区边界时也要完整解析"""
+import pytest
+
+from ingest import iter_json_array
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 1 << 20])
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("[3.14159]", [3.14159]),
+        ("[1, 22 ,333,\n4444]", [1, 22, 333, 4444]),
+        ('[true, null, -1e10, "a,b]"]', [True, None, -1e10, "a,b]"]),
+        ('[{"q": "x", "a": [1, 2]}, {"q": "y"}]', [{"q": "x", "a": [1, 2]}, {"q": "y"}]),
+    ],
+)
+def test_iter_json_array_across_chunk_boundaries(tmp_path, text, expected, chunk_size):
+    path = tmp_path / "data.json"
+    path.write_text(text, encoding="utf-8")
+    assert list(iter_json_array(str(path), chunk_size=chunk_size)) == expected
+
+
+def test_iter_json_array_rejects_non_array(tmp_path):
+    path = tmp_path / "data.json"
+    path.write_text('{"a": 1}', encoding="utf-8")
+    with pytest.raises(ValueError):
+        list(iter_json_array(str(path)))
@@ -0,0 +1,70 @@
+"""知识库记录映射的回归测试：每个知识库的数据文件都必须建出非空的collection"""
+import json
+import os
+
+import chromadb
+import pytest
+from llama_index.core.embeddings import MockEmbedding
+
+from ingest import iter_records
+from knowledge_base import KNOWLEDGE_BASE_SPECS, KNOWLEDGE_BASES, KnowledgeBase
+from record_mapper import SchemaError
+from settings import DATA_DIR
+
+
+@pytest.mark.parametrize("spec", KNOWLEDGE_BASE_SPECS, ids=lambda spec: spec.name)
+def test_sync_builds_non_empty_collection(spec, tmp_path):
+    client = chromadb.PersistentClient(path=str(tmp_path / "chroma"))
+    kb = KnowledgeBase(spec, DATA_DIR, str(tmp_path / "persist"))
+
+    stats = kb.sync(client, embed_model=MockEmbedding(embed_dim=8))
+
+    assert stats["records"]["kept"] > 0
+    assert kb.collection.count() == stats["added"] > 0
+
+
+def test_minecraft_maps_question_answer_and_source():
+    # minecraft.json使用question/answer/source，曾因只认instruction/output而建出空索引
+    spec = KNOWLEDGE_BASES["minecraft"]
+    records = list(iter_records(os.path.join(DATA_DIR, spec.data_file)))
+    text, metadata = spec.record_mapper.map(records[0])
+
+    assert text.startswith("Question: ") and "\nAnswer: " in text
+    assert metadata.get("source")
+
+
+def test_mapper_rejects_records_missing_required_fields():
+    with pytest.raises(SchemaError):
+        KNOWLEDGE_BASES["minecraft"].record_mapper.map({"source": "wiki"})
+
+
+def signed_model(backend, model="bge-small-zh"):
+    embed_model = MockEmbedding(embed_dim=8)
+    # 与create_embed_model相同：记录实际使用的后端和模型文件
+    embed_model._embedding_signature = {"backend": backend, "model": model}
+    return embed_model
+
+
+def test_sync_reembeds_everything_when_embedding_backend_changes(tmp_path):
+    spec = KNOWLEDGE_BASES["minecraft"]
+    data_dir = tmp_path / "data"
+    data_path = data_dir / spec.data_file
+    data_path.parent.mkdir(parents=True)
+    records = [{"question": f"问题{i}", "answer": f"回答{i}", "source": "wiki"} for i in range(3)]
+    data_path.write_text(json.dumps(records, ensure_ascii=False), encoding="utf-8")
+    client = chromadb.PersistentClient(path=str(tmp_path / "chroma"))
+
+    def sync(embed_model):
+        kb = KnowledgeBase(spec, str(data_dir), str(tmp_path / "persist"))
+        return kb, kb.sync(client, embed_model=embed_model)
+
+    _, stats = sync(signed_model("huggingface"))
+    assert stats["added"] == 3
+    _, stats = sync(signed_model("huggingface"))
+    assert stats["added"] == 0 and stats["unchanged"] == 3
+
+    # ONNX加载失败回退等情况下实际后端变了：数据文件未变也要全部重新计算
+    kb, stats = sync(signed_model("onnx-int8", "/models/bge/onnx/model_int8.onnx"))
+    assert stats["added"] == 3 and stats["unchanged"] == 0
+    assert kb.collection.count() == 3
+    assert kb._read_manifest()["embedding"] == {"backend": "onnx-int8", "model": "/models/bge/onnx/model_int8.onnx"}
@@ -0,0 +1,92 @@
+"""关键词检索的测试：分词、精确匹配短路、BM25排序与RRF融合"""
+import pytest
+from llama_index.core.embeddings import MockEmbedding
+from llama_index.core.schema import NodeWithScore, TextNode
+
+from lexical import LexicalIndex, exact_keys, reciprocal_rank_fusion, tokenize
+from retrieval import RetrievalExecutor
+
+SPELLS = [
+    "咒语: 声音洪亮 | Sonorus\n效果: 放大施咒者的声音",
+    "咒语: 荧光闪烁 | Lumos\n效果: 魔杖尖端发光",
+    "咒语: 诺克斯 | Nox\n效果: 熄灭魔杖的光",
+    "咒语: 咒语未知\n效果: 让物体漂浮",
+    "咒语: 咒语未知\n效果: 让物体变色",
+    "咒语: 咒语未知\n效果: 让物体消失",
+    "咒语: 咒语未知\n效果: 让物体复原",
+]
+
+
+def make_index(texts=SPELLS, **kwargs):
+    return LexicalIndex([TextNode(text=text, id_=f"doc-{i}") for i, text in enumerate(texts)], **kwargs)
+
+
+def node_ids(results):
+    return [result.node.node_id for result in results]
+
+
+def test_tokenize_splits_words_and_chinese():
+    tokens = tokenize("Lumos是照明咒吗？")
+
+    assert "lumos" in tokens
+    assert any(token in tokens for token in ("照明", "照明咒"))
+
+
+def test_exact_keys_include_field_values_and_their_parts():
+    keys = exact_keys("咒语: 声音洪亮 | Sonorus")
+
+    assert {"声音洪亮 | sonorus", "声音洪亮", "sonorus"} <= keys
+    # 单个字符不作为键
+    assert all(len(key) >= 2 for key in keys)
+
+
+def test_exact_match_returns_document_for_normalized_field_value():
+    index = make_index()
+
+    assert node_ids(index.exact_match("Sonorus？")) == ["doc-0"]
+    assert index.exact_match("荧光闪烁")[0].score == 1.0
+    assert index.exact_match("施咒者") == []
+
+
+def test_exact_match_skips_keys_shared_by_too_many_documents():
+    index = make_index(max_exact_docs=3)
+
+    # “咒语未知”出现在4条文档中
+    assert index.exact_match("咒语未知") == []
+
+
+def test_bm25_ranks_documents_with_rarer_matching_terms_first():
+    index = make_index()
+
+    results = index.search("魔杖 熄灭", 3)
+
+    assert node_ids(results)[0] == "doc-2"
+    assert set(node_ids(results)) == {"doc-1", "doc-2"}
+    assert results[0].score > results[1].score > 0
+    assert index.search("xyzzy", 3) == []
+
+
+def ranked(*ids):
+    return [NodeWithScore(node=TextNode(text=node_id, id_=node_id), score=0.0) for node_id in ids]
+
+
+def test_rrf_prefers_documents_found_by_both_retrievers():
+    fused = reciprocal_rank_fusion([ranked("a", "b", "c"), ranked("a", "d", "b")], top_k=3)
+
+    assert node_ids(fused) == ["a", "b", "d"]
+    # 两路都排第一的文档得分为1
+    assert fused[0].score == pytest.approx(1.0)
+    assert all(0 < result.score <= 1 for result in fused)
+
+
+@pytest.mark.asyncio
+async def test_hybrid_retrieve_short_circuits_exact_match_without_embedding():
+    executor = RetrievalExecutor(MockEmbedding(embed_dim=8), batch_window=0)
+    embedded = []
+    executor._embed_batch = lambda texts: embedded.append(texts) or [[0.0] * 8 for _ in texts]
+
+    nodes = await executor.retrieve(None, "Lumos", 3, lexical=make_index())
+
+    assert node_ids(nodes) == ["doc-1"]
+    assert embedded == [] and executor.exact_hits == 1
+    executor.shutdown()
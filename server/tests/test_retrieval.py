@@ -0,0 +1,135 @@
+"""检索执行器的测试：查询向量的微批处理，结果缓存按索引版本区分，热更新后不会读到旧索引的结果"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from llama_index.core.embeddings import MockEmbedding
+
+from retrieval import RetrievalExecutor
+
+
+class FixedIndex:
+    """as_retriever().retrieve()返回固定结果，并记录调用次数"""
+
+    def __init__(self, result):
+        self.result = result
+        self.calls = 0
+
+    def as_retriever(self, similarity_top_k):
+        return self
+
+    def retrieve(self, bundle):
+        self.calls += 1
+        return self.result
+
+
+def make_kb(version, result):
+    return SimpleNamespace(index=FixedIndex(result), collection_name=version)
+
+
+async def retrieve(executor, kb, query="火球术"):
+    # 与app.retrieve_nodes相同的调用方式
+    return await executor.retrieve(kb.index, query, 3, collection="magic", version=kb.collection_name)
+
+
+@pytest.mark.asyncio
+async def test_index_swapped_between_lookup_and_retrieve_does_not_poison_cache():
+    executor = RetrievalExecutor(MockEmbedding(embed_dim=8), batch_window=0)
+    knowledge_bases = {"magic": make_kb("magic-1", ["旧版本"])}
+
+    # 请求先拿到知识库对象（如chat_completions），在等待语义缓存的向量时发生热更新
+    held = knowledge_bases["magic"]
+    old = knowledge_bases["magic"]
+    knowledge_bases["magic"] = make_kb("magic-2", ["新版本"])
+    executor.invalidate("magic", old.collection_name)
+
+    assert await retrieve(executor, held) == ["旧版本"]
+    # 之后的请求使用新版本，不会读到上面以旧索引写入的缓存
+    fresh = knowledge_bases["magic"]
+    assert await retrieve(executor, fresh) == ["新版本"]
+    assert await retrieve(executor, fresh) == ["新版本"]
+    assert fresh.index.calls == 1
+    executor.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_invalidate_version_only_drops_that_version():
+    executor = RetrievalExecutor(MockEmbedding(embed_dim=8), batch_window=0)
+    old, new = make_kb("magic-1", ["旧"]), make_kb("magic-2", ["新"])
+    await retrieve(executor, old)
+    await retrieve(executor, new)
+
+    assert executor.invalidate("magic", "magic-1") == 1
+    assert executor.invalidate("minecraft") == 0
+
+    await retrieve(executor, new)
+    assert new.index.calls == 1
+    await retrieve(executor, old)
+    assert old.index.calls == 2
+    # 不指定版本时清除该知识库的全部结果
+    assert executor.invalidate("magic") == 2
+    executor.shutdown()
+
+
+def recording_executor(**kwargs):
+    """记录每次模型批量调用的文本"""
+    executor = RetrievalExecutor(MockEmbedding(embed_dim=8), **kwargs)
+    batches = []
+    embed_batch = executor._embed_batch
+
+    def record(texts):
+        batches.append(list(texts))
+        return embed_batch(texts)
+
+    executor._embed_batch = record
+    return executor, batches
+
+
+@pytest.mark.asyncio
+async def test_concurrent_queries_share_one_model_call():
+    executor, batches = recording_executor(batch_window=0.01)
+
+    embeddings = await asyncio.gather(
+        executor.embed("火球术"), executor.embed(" 火球术？"), executor.embed("冰冻术")
+    )
+
+    # 归一化后相同的查询只计算一次
+    assert batches == [["火球术", "冰冻术"]]
+    assert embeddings[0] == embeddings[1]
+    assert len(embeddings[2]) == 8
+    executor.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_full_batch_flushes_without_waiting_for_window():
+    executor, batches = recording_executor(batch_window=10, max_batch_size=2)
+
+    await asyncio.wait_for(asyncio.gather(executor.embed("a"), executor.embed("b")), 1)
+
+    assert batches == [["a", "b"]]
+    executor.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_cached_embedding_skips_the_model():
+    executor, batches = recording_executor(batch_window=0)
+
+    first = await executor.embed("荧光闪烁")
+    assert await executor.embed("荧光闪烁。") == first
+    assert len(batches) == 1
+    executor.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_failed_batch_fails_every_waiter():
+    executor = RetrievalExecutor(MockEmbedding(embed_dim=8), batch_window=0.01)
+
+    def broken(texts):
+        raise RuntimeError("模型出错")
+
+    executor._embed_batch = broken
+    results = await asyncio.gather(executor.embed("a"), executor.embed("b"), return_exceptions=True)
+
+    assert [type(result) for result in results] == [RuntimeError, RuntimeError]
+    assert executor._pending == []
+    executor.shutdown()
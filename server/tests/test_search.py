@@ -0,0 +1,75 @@
+"""跨知识库检索的测试：按名次交错合并，单个知识库超时、出错或未就绪时返回部分结果"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+from llama_index.core.schema import NodeWithScore, TextNode
+
+import app
+
+
+def make_kb(name, status="ready"):
+    spec = SimpleNamespace(name=name, display_name=name)
+    return SimpleNamespace(spec=spec, ready=status == "ready", status=status, error="索引文件损坏")
+
+
+def hits(name, n):
+    return [NodeWithScore(node=TextNode(text=f"{name}-{i}", metadata={"source": name}), score=1.0 - i / 10) for i in range(n)]
+
+
+@pytest.fixture
+def kbs(monkeypatch):
+    knowledge_bases = {
+        "magic": make_kb("magic"),
+        "minecraft": make_kb("minecraft"),
+        "slow": make_kb("slow"),
+        "broken": make_kb("broken"),
+        "failed": make_kb("failed", status="failed"),
+    }
+
+    async def retrieve_nodes(kb, query, top_k=None):
+        name = kb.spec.name
+        if name == "slow":
+            await asyncio.sleep(10)
+        if name == "broken":
+            raise RuntimeError("检索出错")
+        return hits(name, top_k or 2)
+
+    monkeypatch.setattr(app, "knowledge_bases", knowledge_bases)
+    monkeypatch.setattr(app, "retrieve_nodes", retrieve_nodes)
+    return knowledge_bases
+
+
+@pytest.mark.asyncio
+async def test_results_interleave_by_rank_across_knowledge_bases(kbs):
+    response = await app.search(app.SearchRequest(query="q", kbs=["minecraft", "magic"], top_k={"magic": 3}))
+
+    assert [(hit["kb"], hit["rank"]) for hit in response["results"]] == [
+        ("minecraft", 1), ("magic", 1), ("minecraft", 2), ("magic", 2), ("magic", 3),
+    ]
+    assert response["partial"] is False
+    assert response["knowledge_bases"]["magic"] == {"status": "ok", "count": 3}
+
+
+@pytest.mark.asyncio
+async def test_partial_results_report_each_failure(kbs):
+    request = app.SearchRequest(query="q", kbs=["magic", "slow", "broken", "failed"], timeout_ms=100, limit=1)
+
+    response = await asyncio.wait_for(app.search(request), 2)
+
+    status = response["knowledge_bases"]
+    assert status["magic"] == {"status": "ok", "count": 2}
+    assert status["slow"] == {"status": "timeout"}
+    assert status["broken"] == {"status": "error", "detail": "检索出错"}
+    assert status["failed"]["status"] == "unavailable" and "索引加载失败" in status["failed"]["detail"]
+    assert response["partial"] is True
+    assert [hit["text"] for hit in response["results"]] == ["magic-0"]
+
+
+@pytest.mark.asyncio
+async def test_unknown_knowledge_base_is_rejected(kbs):
+    with pytest.raises(HTTPException) as rejected:
+        await app.search(app.SearchRequest(query="q", kbs=["magic", "nope"]))
+
+    assert rejected.value.status_code == 404
@@ -0,0 +1,109 @@
+"""服务端会话的测试：多worker共享的SQLite存储、追问改写与历史预算"""
+import os
+
+import pytest
+
+import serve
+from sessions import SessionStore, build_history, rewrite_query, turns_from_messages, valid_session_id
+
+
+def test_sqlite_store_is_shared_between_workers(tmp_path):
+    path = str(tmp_path / "sessions.sqlite3")
+    # 两个SessionStore相当于两个worker进程各自打开同一个文件
+    worker_a = SessionStore(persist_path=path)
+    worker_b = SessionStore(persist_path=path)
+
+    worker_a.append("wizard", "session-1", "荧光闪烁是什么咒语？", "照明咒。")
+    worker_b.append("wizard", "session-1", "它怎么念？", "Lumos。")
+
+    assert worker_a.get("wizard", "session-1") == [("荧光闪烁是什么咒语？", "照明咒。"), ("它怎么念？", "Lumos。")]
+    assert worker_b.get("riddle", "session-1") == []
+    worker_a.close()
+    worker_b.close()
+
+    # 重启后会话仍在
+    restarted = SessionStore(persist_path=path)
+    assert len(restarted.get("wizard", "session-1")) == 2
+    restarted.close()
+
+
+def test_memory_store_keeps_recent_turns_and_evicts_least_recent():
+    store = SessionStore(maxsize=2, max_turns=2)
+    for i in range(3):
+        store.append("wizard", "session-a", f"问题{i}", f"回答{i}")
+    store.append("wizard", "session-b", "b", "b")
+    store.get("wizard", "session-a")
+    store.append("wizard", "session-c", "c", "c")
+
+    assert store.get("wizard", "session-a") == [("问题1", "回答1"), ("问题2", "回答2")]
+    assert store.get("wizard", "session-b") == []
+    assert store.stats()["evictions"] == 1
+
+
+@pytest.mark.parametrize("persist", [False, True])
+def test_expired_session_starts_over(tmp_path, monkeypatch, persist):
+    now = [1000.0]
+    monkeypatch.setattr("sessions.time.time", lambda: now[0])
+    store = SessionStore(ttl=60, persist_path=str(tmp_path / "s.sqlite3") if persist else None)
+    store.append("wizard", "session-1", "旧问题", "旧回答")
+
+    now[0] += 61
+    assert store.get("wizard", "session-1") == []
+    store.append("wizard", "session-1", "新问题", "新回答")
+    assert store.get("wizard", "session-1") == [("新问题", "新回答")]
+    store.close()
+
+
+def test_rewrite_query_merges_previous_questions_for_follow_ups():
+    turns = [("苦力怕怕什么？", "猫。"), ("怎么驯服猫？", "用生鱼。")]
+
+    assert rewrite_query("那它吃什么？", turns) == "苦力怕怕什么？ 怎么驯服猫？ 那它吃什么？"
+    assert rewrite_query("那它吃什么？", turns, max_turns=1) == "怎么驯服猫？ 那它吃什么？"
+    # 完整的新问题不改写
+    question = "下界要塞里的烈焰人会掉落什么物品？"
+    assert rewrite_query(question, turns) == question
+    assert rewrite_query("那它吃什么？", []) == "那它吃什么？"
+    assert rewrite_query("那它吃什么？", turns, max_turns=0) == "那它吃什么？"
+
+
+def test_turns_from_messages_skips_system_and_last_question():
+    messages = [
+        {"role": "system", "content": "你是巫师"},
+        {"role": "user", "content": "q1"},
+        {"role": "assistant", "content": "a1"},
+        {"role": "user", "content": "q2"},
+    ]
+
+    assert turns_from_messages(messages) == [("q1", "a1")]
+    assert turns_from_messages(messages[:1] + messages[-1:]) == []
+
+
+def test_build_history_summarises_older_turns_within_budget():
+    turns = [(f"第{i}个问题。后面的话", f"第{i}个回答。后面的话") for i in range(6)]
+
+    messages, used = build_history(turns, budget=200, recent_turns=2)
+
+    assert messages[0]["role"] == "system" and "第0个问题。" in messages[0]["content"]
+    assert "后面的话" not in messages[0]["content"]
+    assert [m["content"] for m in messages[1:]] == [turns[4][0], turns[4][1], turns[5][0], turns[5][1]]
+    assert used <= 200
+    assert build_history(turns, budget=0) == ([], 0)
+
+
+def test_valid_session_id():
+    assert valid_session_id("abcd-1234_EF")
+    assert not valid_session_id("short")
+    assert not valid_session_id("bad id with spaces")
+
+
+def test_serve_shares_sessions_only_between_multiple_workers(monkeypatch):
+    monkeypatch.delenv("SESSION_STORE_PATH", raising=False)
+    monkeypatch.setattr(serve, "get_setting", lambda name, default=None, cast=None: default)
+
+    assert serve.default_session_store_path(1) is None
+    path = serve.default_session_store_path(4)
+    assert path == os.path.join(serve.PERSIST_DIR, "sessions.sqlite3")
+
+    # 已配置的路径保持不变
+    monkeypatch.setattr(serve, "get_setting", lambda name, default=None, cast=None: "custom.sqlite3")
+    assert serve.default_session_store_path(4) is None
@@ -0,0 +1,252 @@
+"""上游客户端的测试：连接复用、退避与重试，重试次数受截止时间约束，429不计入熔断，无法解析的响应按上游错误处理"""
+import time
+
+import httpx
+import pytest
+
+from admission import CircuitBreaker
+from upstream import DeepSeekClient, UpstreamError
+
+PAYLOAD = {"model": "deepseek-chat", "messages": [{"role": "user", "content": "你好"}]}
+
+
+def make_client(handler, **kwargs):
+    client = DeepSeekClient("http://upstream.test/v1/chat/completions", "test-key", **kwargs)
+    client._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return client
+
+
+class Upstream:
+    """按顺序返回给定的响应，记录调用次数"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    def __call__(self, request):
+        self.calls += 1
+        status, headers = self.responses[min(self.calls, len(self.responses)) - 1]
+        body = {"choices": [{"message": {"content": "ok"}}]} if status == 200 else {"error": "busy"}
+        return httpx.Response(status, headers=headers, json=body)
+
+
+@pytest.mark.asyncio
+async def test_chat_does_not_retry_when_backoff_passes_deadline():
+    upstream = Upstream((429, {"Retry-After": "5"}))
+    client = make_client(upstream, max_retries=3)
+    start = time.monotonic()
+
+    with pytest.raises(UpstreamError) as failed:
+        await client.chat(PAYLOAD, deadline=start + 1.0)
+
+    assert failed.value.status_code == 429
+    assert upstream.calls == 1
+    assert time.monotonic() - start < 0.5
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_chat_retries_only_as_many_times_as_the_deadline_allows():
+    upstream = Upstream((503, {"Retry-After": "0.2"}))
+    client = make_client(upstream, max_retries=10)
+    start = time.monotonic()
+
+    with pytest.raises(UpstreamError):
+        await client.chat(PAYLOAD, deadline=start + 0.5)
+
+    # 0.2秒的退避在0.5秒内最多放得下两次
+    assert upstream.calls <= 3
+    assert time.monotonic() - start < 0.5
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_chat_retries_then_succeeds():
+    upstream = Upstream((503, {"Retry-After": "0.01"}), (200, {}))
+    client = make_client(upstream, max_retries=2)
+
+    result = await client.chat(PAYLOAD)
+
+    assert result["choices"][0]["message"]["content"] == "ok"
+    assert upstream.calls == 2
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_stream_chat_does_not_retry_when_backoff_passes_deadline():
+    upstream = Upstream((429, {"Retry-After": "5"}))
+    client = make_client(upstream, max_retries=3)
+
+    with pytest.raises(UpstreamError):
+        async for _ in client.stream_chat(PAYLOAD, deadline=time.monotonic() + 1.0):
+            pass
+
+    assert upstream.calls == 1
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_rate_limited_upstream_does_not_open_breaker():
+    breaker = CircuitBreaker(min_requests=2, error_rate=0.5, cooldown=10)
+    client = make_client(Upstream((429, {"Retry-After": "0"})), max_retries=0, breaker=breaker)
+
+    for _ in range(3):
+        with pytest.raises(UpstreamError):
+            await client.chat(PAYLOAD)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    client._client = httpx.AsyncClient(transport=httpx.MockTransport(Upstream((503, {}))))
+    for _ in range(2):
+        with pytest.raises(UpstreamError):
+            await client.chat(PAYLOAD)
+    assert breaker.state == CircuitBreaker.OPEN
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_client_reuses_one_connection_pool():
+    client = DeepSeekClient("http://upstream.test/v1/chat/completions", "test-key")
+    await client.start()
+    pool = client._client
+    await client.start()
+
+    assert client._client is pool
+    assert client.headers["Authorization"] == "Bearer test-key"
+    await client.close()
+    assert client._client is None
+
+
+def test_backoff_honours_retry_after_up_to_max():
+    client = DeepSeekClient("http://upstream.test", "k", backoff_base=0.5, backoff_max=8.0)
+
+    assert client._backoff_delay(0, "3") == 3.0
+    assert client._backoff_delay(0, "120") == 8.0
+    # 无法解析的Retry-After（如HTTP日期）按指数退避
+    for attempt in range(6):
+        delay = client._backoff_delay(attempt, "Wed, 21 Oct 2026 07:28:00 GMT")
+        assert 0 <= delay <= min(8.0, 0.5 * 2**attempt)
+
+
+@pytest.mark.asyncio
+async def test_chat_does_not_retry_client_errors():
+    upstream = Upstream((400, {}))
+    client = make_client(upstream, max_retries=3)
+
+    with pytest.raises(UpstreamError) as failed:
+        await client.chat(PAYLOAD)
+
+    assert failed.value.status_code == 400
+    assert upstream.calls == 1
+    await client.close()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "error, status_code",
+    [(httpx.ConnectError("refused"), 502), (httpx.ReadTimeout("slow"), 504)],
+)
+async def test_chat_retries_transport_errors(error, status_code):
+    calls = 0
+
+    def handler(request):
+        nonlocal calls
+        calls += 1
+        raise error
+
+    client = make_client(handler, max_retries=2, backoff_base=0.001)
+
+    with pytest.raises(UpstreamError) as failed:
+        await client.chat(PAYLOAD)
+
+    assert failed.value.status_code == status_code
+    assert calls == 3
+    assert client.scheduler.stats()["active"] == 0
+    await client.close()
+
+
+class BrokenStream(httpx.AsyncByteStream):
+    """先发送一个分片，然后连接中断"""
+
+    async def __aiter__(self):
+        yield f"data: {GOOD_CHUNK}\n\n".encode("utf-8")
+        raise httpx.ReadError("connection reset")
+
+
+@pytest.mark.asyncio
+async def test_stream_chat_does_not_retry_after_first_chunk():
+    calls = 0
+
+    def handler(request):
+        nonlocal calls
+        calls += 1
+        return httpx.Response(200, headers={"Content-Type": "text/event-stream"}, stream=BrokenStream())
+
+    client = make_client(handler, max_retries=3, backoff_base=0.001)
+    received = []
+
+    with pytest.raises(UpstreamError) as failed:
+        async for chunk in client.stream_chat(PAYLOAD):
+            received.append(chunk)
+
+    # 已经输出了内容，重试会导致重复输出
+    assert failed.value.status_code == 502
+    assert len(received) == 1
+    assert calls == 1
+    await client.close()
+
+
+GOOD_CHUNK = '{"choices": [{"delta": {"content": "你好"}}]}'
+
+
+def sse_upstream(*lines):
+    """以SSE返回给定的data行"""
+    body = "".join(f"data: {line}\n\n" for line in lines)
+
+    def handler(request):
+        return httpx.Response(200, headers={"Content-Type": "text/event-stream"}, content=body.encode("utf-8"))
+
+    return handler
+
+
+@pytest.mark.asyncio
+async def test_stream_chat_raises_upstream_error_on_malformed_chunk():
+    breaker = CircuitBreaker(min_requests=1, error_rate=0.5, cooldown=10)
+    client = make_client(sse_upstream(GOOD_CHUNK, '{"choices": [{"delta": {"cont'), breaker=breaker)
+    received = []
+
+    with pytest.raises(UpstreamError) as failed:
+        async for chunk in client.stream_chat(PAYLOAD):
+            received.append(chunk)
+
+    assert failed.value.status_code == 502
+    assert len(received) == 1
+    # 解析失败计入熔断失败率
+    assert breaker.stats()["error_rate"] > 0
+    assert client.scheduler.stats()["active"] == 0
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_chat_raises_upstream_error_on_non_json_body():
+    client = make_client(lambda request: httpx.Response(200, content=b"<html>bad gateway</html>"))
+
+    with pytest.raises(UpstreamError) as failed:
+        await client.chat(PAYLOAD)
+
+    assert failed.value.status_code == 502
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_stream_completion_ends_with_error_event_on_malformed_chunk(monkeypatch):
+    import app
+
+    client = make_client(sse_upstream(GOOD_CHUNK, "not json"))
+    monkeypatch.setattr(app, "deepseek_client", client)
+
+    frames = [frame async for frame in app.stream_completion(PAYLOAD, "wizard", time.perf_counter())]
+
+    assert frames[0].startswith("data: ") and "你好" in frames[0]
+    assert frames[-1].startswith("event: error\n")
+    assert not any("[DONE]" in frame for frame in frames)
+    await client.close()
@@ -0,0 +1,64 @@
+"""向量快照的测试：旧版本延后删除，删除失败时记录警告并在之后重试"""
+import logging
+import os
+
+import numpy as np
+
+import vector_store
+from knowledge_base import KNOWLEDGE_BASES, KnowledgeBase
+from vector_store import MmapVectorStore
+
+
+def build(directory, n=3):
+    ids = [f"doc-{i}" for i in range(n)]
+    embeddings = np.random.default_rng(n).normal(size=(n, 4))
+    return MmapVectorStore.build(str(directory), ids, embeddings, ids, [{} for _ in ids])
+
+
+def versions(directory):
+    return sorted(name for name in os.listdir(directory) if os.path.isdir(directory / name))
+
+
+def test_build_keeps_previous_version_until_next_build(tmp_path):
+    first = build(tmp_path)
+    second = build(tmp_path)
+    # 上一个版本可能仍被映射，本次导出不删除
+    assert versions(tmp_path) == sorted([os.path.basename(first.path), os.path.basename(second.path)])
+    assert first.search(np.ones(4), 1)
+
+    first.close()
+    third = build(tmp_path)
+    assert versions(tmp_path) == sorted([os.path.basename(second.path), os.path.basename(third.path)])
+    assert MmapVectorStore.open(str(tmp_path)).path == third.path
+
+
+def test_failed_removal_is_logged_and_retried(tmp_path, monkeypatch, caplog):
+    stale = build(tmp_path)
+    build(tmp_path)
+
+    def locked(path):
+        raise PermissionError(f"另一个程序正在使用此文件: {path}")
+
+    monkeypatch.setattr(vector_store.shutil, "rmtree", locked)
+    with caplog.at_level(logging.WARNING, logger="vector_store"):
+        build(tmp_path)
+    assert "删除向量快照" in caplog.text
+    assert os.path.isdir(stale.path)
+
+    monkeypatch.undo()
+    assert MmapVectorStore.sweep(str(tmp_path)) == 2
+    assert versions(tmp_path) == [MmapVectorStore.current_version(str(tmp_path))]
+
+
+def test_sweep_snapshots_removes_retired_collections_only(tmp_path):
+    spec = KNOWLEDGE_BASES["minecraft"]
+    kb = KnowledgeBase(spec, str(tmp_path), str(tmp_path), "numpy", collection_name=f"{spec.name}-200")
+    persist_dir = tmp_path / os.path.relpath(kb.persist_dir, tmp_path)
+    for name in (f"{spec.name}.vectors", f"{spec.name}-100.vectors", f"{spec.name}-extra.vectors", "other.vectors"):
+        (persist_dir / name).mkdir(parents=True)
+    build(persist_dir / f"{spec.name}-200.vectors")
+    build(persist_dir / f"{spec.name}-200.vectors")
+
+    assert kb.sweep_snapshots() == 3
+    assert sorted(os.listdir(persist_dir)) == [f"{spec.name}-200.vectors", f"{spec.name}-extra.vectors", "other.vectors"]
+    assert len(versions(persist_dir / f"{spec.name}-200.vectors")) == 1
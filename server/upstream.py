@@ -0,0 +1,235 @@
+import asyncio
+import json
+import logging
+import random
+import time
+from contextlib import nullcontext
+
+import httpx
+
+from admission import UpstreamScheduler
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# 这些状态码通常是暂时性的，值得重试
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+class UpstreamError(Exception):
+    """上游DeepSeek API调用失败"""
+
+    def __init__(self, message, status_code=None, body=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.body = body
+
+
+class DeepSeekClient:
+    """共享的DeepSeek异步客户端
+
+    所有请求复用同一个httpx.AsyncClient（keep-alive连接池），
+    同时在途的上游请求数由scheduler限制（默认为max_concurrency个名额、不限长度的队列）。
+    传入breaker时每次调用前检查熔断状态，并把调用结果计入失败率（429除外）。
+    """
+
+    def __init__(
+        self,
+        api_url,
+        api_key,
+        max_connections=100,
+        max_keepalive_connections=20,
+        max_concurrency=32,
+        timeout=30.0,
+        connect_timeout=5.0,
+        max_retries=2,
+        backoff_base=0.5,
+        backoff_max=8.0,
+        scheduler=None,
+        breaker=None,
+    ):
+        self.api_url = api_url
+        self.api_key = api_key
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+        )
+        self.scheduler = scheduler or UpstreamScheduler(max_concurrency)
+        self.breaker = breaker
+        self._client = None
+
+    @property
+    def headers(self):
+        return {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_key}",
+        }
+
+    async def start(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                limits=self._limits,
+                timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout),
+            )
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _backoff_delay(self, attempt, retry_after=None):
+        # 优先遵循上游给出的Retry-After，否则使用带抖动的指数退避
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _breaker_call(self):
+        return self.breaker.call() if self.breaker is not None else nullcontext()
+
+    def _record(self, ok):
+        if self.breaker is not None:
+            self.breaker.record(ok)
+
+    def _record_status(self, status_code):
+        # 429是上游在限流，说明上游仍在正常处理请求，不计入熔断失败率
+        if status_code != 429:
+            self._record(status_code not in RETRYABLE_STATUS)
+
+    def _invalid_response(self, body, error):
+        # 上游返回了无法解析的内容：计为失败，按502抛出
+        self._record(False)
+        metrics.incr("upstream_errors", "invalid_json")
+        return UpstreamError(f"DeepSeek API返回了无法解析的内容: {error}", status_code=502, body=body)
+
+    def _can_retry(self, attempt, retries, delay, deadline):
+        # 重试之后已经超过截止时间的不再重试
+        return attempt < retries and (deadline is None or time.monotonic() + delay < deadline)
+
+    async def chat(self, payload, timeout=None, max_retries=None, priority=0, deadline=None):
+        """发送一次chat/completions请求并返回解析后的JSON，失败时抛出UpstreamError
+
+        priority与deadline（time.monotonic()时间）用于排队，未被准入时抛出AdmissionError。
+        """
+        await self.start()
+        retries = self.max_retries if max_retries is None else max_retries
+        request_timeout = httpx.Timeout(timeout or self.timeout, connect=self.connect_timeout)
+
+        last_error = None
+        for attempt in range(retries + 1):
+            retry_after = None
+            try:
+                async with self.scheduler.slot(priority, deadline):
+                    with self._breaker_call():
+                        response = await self._client.post(
+                            self.api_url, headers=self.headers, json=payload, timeout=request_timeout
+                        )
+                        self._record_status(response.status_code)
+                if response.status_code == 200:
+                    try:
+                        return response.json()
+                    except ValueError as e:
+                        raise self._invalid_response(response.text, e)
+
+                metrics.incr("upstream_errors", str(response.status_code))
+                last_error = UpstreamError(
+                    f"DeepSeek API返回错误 (状态码: {response.status_code}): {response.text}",
+                    status_code=response.status_code,
+                    body=response.text,
+                )
+                if response.status_code not in RETRYABLE_STATUS:
+                    raise last_error
+                retry_after = response.headers.get("Retry-After")
+            except httpx.TimeoutException as e:
+                self._record(False)
+                metrics.incr("upstream_timeouts")
+                metrics.incr("upstream_errors", "timeout")
+                last_error = UpstreamError(f"DeepSeek API请求超时: {e!r}", status_code=504)
+            except httpx.TransportError as e:
+                self._record(False)
+                metrics.incr("upstream_errors", "connect")
+                last_error = UpstreamError(f"无法连接DeepSeek API: {e!r}", status_code=502)
+
+            delay = self._backoff_delay(attempt, retry_after)
+            if not self._can_retry(attempt, retries, delay, deadline):
+                break
+            metrics.incr("upstream_retries")
+            logger.warning(f"DeepSeek API调用失败，{delay:.2f}秒后进行第{attempt + 1}次重试: {last_error}")
+            await asyncio.sleep(delay)
+
+        raise last_error
+
+    async def stream_chat(self, payload, timeout=None, max_retries=None, priority=0, deadline=None):
+        """以流式(SSE)方式请求chat/completions，逐个产出解析后的分片
+
+        只在收到第一个分片之前重试；一旦开始产出内容，出错时直接抛出，避免重复输出。
+        消费方停止迭代或被取消时，上游连接会随之关闭。
+        """
+        await self.start()
+        payload = dict(payload, stream=True)
+        retries = self.max_retries if max_retries is None else max_retries
+        request_timeout = httpx.Timeout(timeout or self.timeout, connect=self.connect_timeout)
+
+        started = False
+        last_error = None
+        for attempt in range(retries + 1):
+            retry_after = None
+            try:
+                async with self.scheduler.slot(priority, deadline):
+                    with self._breaker_call():
+                        async with self._client.stream(
+                            "POST", self.api_url, headers=self.headers, json=payload, timeout=request_timeout
+                        ) as response:
+                            self._record_status(response.status_code)
+                            if response.status_code == 200:
+                                async for line in response.aiter_lines():
+                                    if not line.startswith("data:"):
+                                        continue
+                                    data = line[5:].strip()
+                                    if data == "[DONE]":
+                                        return
+                                    try:
+                                        chunk = json.loads(data)
+                                    except ValueError as e:
+                                        raise self._invalid_response(data, e)
+                                    started = True
+                                    yield chunk
+                                return
+
+                            body = (await response.aread()).decode("utf-8", errors="replace")
+                            metrics.incr("upstream_errors", str(response.status_code))
+                            last_error = UpstreamError(
+                                f"DeepSeek API返回错误 (状态码: {response.status_code}): {body}",
+                                status_code=response.status_code,
+                                body=body,
+                            )
+                            if response.status_code not in RETRYABLE_STATUS:
+                                raise last_error
+                            retry_after = response.headers.get("Retry-After")
+            except httpx.TimeoutException as e:
+                self._record(False)
+                metrics.incr("upstream_timeouts")
+                metrics.incr("upstream_errors", "timeout")
+                last_error = UpstreamError(f"DeepSeek API请求超时: {e!r}", status_code=504)
+            except httpx.TransportError as e:
+                self._record(False)
+                metrics.incr("upstream_errors", "connect")
+                last_error = UpstreamError(f"无法连接DeepSeek API: {e!r}", status_code=502)
+
+            if started:
+                raise last_error
+            delay = self._backoff_delay(attempt, retry_after)
+            if not self._can_retry(attempt, retries, delay, deadline):
+                break
+            metrics.incr("upstream_retries")
+            logger.warning(f"DeepSeek API流式调用失败，{delay:.2f}秒后进行第{attempt + 1}次重试: {last_error}")
+            await asyncio.sleep(delay)
+
+        raise last_error
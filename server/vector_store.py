@@ -0,0 +1,356 @@
+"""基于内存映射NumPy数组的向量存储，可代替Chroma作为知识库的检索后端
+
+Chroma仍负责增量同步和持久化；数据变化后把collection导出为一组只读文件（快照），
+查询时不再经过Chroma和LlamaIndex的docstore。快照目录 {持久化目录}/{知识库id}.vectors/{版本}/ 下:
+
+    vectors.npy    N×D 单位向量（float32或float16）
+    ids.npy        文档id（定长字节串），与vectors按行对应
+    offsets.npy    每条文档在docs.jsonl中的字节偏移（N+1个）
+    docs.jsonl     文档文本与元数据，每行一个JSON
+    centroids.npy  可选的IVF索引：聚类中心
+    lists.npy      可选的IVF索引：每个簇在vectors中的行范围（导出时行已按簇排序）
+    meta.json      元信息，最后写入
+
+{知识库id}.vectors/CURRENT 指向当前版本，切换版本只替换这一个文件，已打开旧版本的进程不受影响。
+上一个版本可能仍被映射（Windows下映射中的文件无法删除），导出新版本时保留，在下一次导出或启动时清理。
+文件以只读mmap打开，多个uvicorn worker打开同一版本时共享操作系统的页缓存。
+
+精确检索为一次矩阵乘法加argpartition；文档数达到ivf_min_docs时导出IVF索引，查询只计算nprobe个簇。
+返回的距离为单位向量间的平方L2距离（2 - 2·余弦），与Chroma默认的l2距离一致，相似度同样为exp(-距离)。
+"""
+import json
+import logging
+import math
+import mmap
+import os
+import shutil
+import time
+import uuid
+from dataclasses import dataclass
+
+import numpy as np
+from llama_index.core.schema import NodeWithScore
+
+from lexical import record_to_node
+from settings import get_setting
+
+logger = logging.getLogger(__name__)
+
+# float16向量分块转换为float32后再做矩阵乘法，避免一次性复制整个矩阵
+_CHUNK_ROWS = 16384
+
+
+@dataclass(frozen=True)
+class VectorStoreConfig:
+    dtype: str = "float32"  # 向量的存储精度，float16内存占用减半
+    ivf_min_docs: int = 50000  # 文档数达到此值时导出IVF索引，0表示总是精确检索
+    ivf_lists: int = 0  # IVF簇数，0表示取sqrt(N)
+    nprobe: int = 32  # 每次查询计算的簇数
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            dtype=get_setting("VECTOR_DTYPE", "float32"),
+            ivf_min_docs=get_setting("VECTOR_IVF_MIN_DOCS", 50000, int),
+            ivf_lists=get_setting("VECTOR_IVF_LISTS", 0, int),
+            nprobe=get_setting("VECTOR_NPROBE", 32, int),
+        )
+
+
+def remove_snapshot(path):
+    """删除快照目录，失败时（如Windows下文件仍被映射）记录警告并返回False"""
+    try:
+        shutil.rmtree(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"删除向量快照{path}失败，将在下一次导出或启动时重试: {e}")
+        return False
+    return True
+
+
+def _normalize(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _top_k(scores, k):
+    """返回scores中最大的k个位置，按分数从高到低排序"""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+    return top[np.argsort(-scores[top], kind="stable")]
+
+
+def _kmeans(vectors, n_lists, iterations=10, sample_size=None, seed=0):
+    """球面k-means：在单位向量上按余弦相似度聚类，返回单位化的聚类中心"""
+    rng = np.random.default_rng(seed)
+    sample_size = sample_size or min(len(vectors), max(n_lists * 64, 10000))
+    sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+    centroids = sample[rng.choice(sample_size, n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        empty = np.bincount(assignment, minlength=n_lists) == 0
+        # 空簇重新随机取一个样本点作为中心
+        sums[empty] = sample[rng.choice(sample_size, int(empty.sum()))]
+        centroids = _normalize(sums)
+    return centroids
+
+
+def _assign(vectors, centroids):
+    assignment = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), _CHUNK_ROWS):
+        block = vectors[start : start + _CHUNK_ROWS]
+        assignment[start : start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return assignment
+
+
+class _Retriever:
+    """与LlamaIndex检索器相同的retrieve(QueryBundle)接口，查询向量需事先算好"""
+
+    def __init__(self, store, similarity_top_k):
+        self.store = store
+        self.similarity_top_k = similarity_top_k
+
+    def retrieve(self, bundle):
+        if bundle.embedding is None:
+            raise ValueError("MmapVectorStore检索需要传入已计算好的查询向量")
+        return self.store.search(bundle.embedding, self.similarity_top_k)
+
+
+class MmapVectorStore:
+    def __init__(self, path, meta, config=None):
+        self.path = path
+        self.meta = meta
+        self.config = config or VectorStoreConfig()
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        self.ids = np.load(os.path.join(path, "ids.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode="r")
+        with open(os.path.join(path, "docs.jsonl"), "rb") as f:
+            # 空文件无法建立映射
+            self._docs = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if len(self.ids) else b""
+        self.centroids = None
+        self.lists = None
+        if meta.get("ivf_lists"):
+            self.centroids = np.load(os.path.join(path, "centroids.npy"))
+            self.lists = np.load(os.path.join(path, "lists.npy"))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def count(self):
+        return len(self.ids)
+
+    @property
+    def nbytes(self):
+        return int(self.vectors.nbytes)
+
+    # ---- 打开与导出 ----
+
+    @staticmethod
+    def current_version(directory):
+        try:
+            with open(os.path.join(directory, "CURRENT"), "r", encoding="utf-8") as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    @classmethod
+    def open(cls, directory, config=None):
+        """打开当前版本的快照，不存在或文件不完整时返回None"""
+        version = cls.current_version(directory)
+        if version is None:
+            return None
+        path = os.path.join(directory, version)
+        try:
+            with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            return cls(path, meta, config)
+        except (OSError, ValueError):
+            return None
+
+    @classmethod
+    def sweep(cls, directory, keep=()):
+        """删除当前版本和keep以外的快照版本（不含写入中的.tmp目录），返回删除的个数"""
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            return 0
+        keep = {cls.current_version(directory), *keep}
+        removed = 0
+        for name in names:
+            path = os.path.join(directory, name)
+            if name in keep or name.endswith(".tmp") or not os.path.isdir(path):
+                continue
+            removed += remove_snapshot(path)
+        return removed
+
+    @classmethod
+    def build(cls, directory, ids, embeddings, documents, metadatas, config=None, source=None):
+        """把一组文档写成新版本的快照并切换为当前版本，返回打开的存储
+
+        source记录快照对应的数据来源（数据文件哈希、文档数等），用于判断快照是否过期。
+        """
+        config = config or VectorStoreConfig()
+        vectors = _normalize(embeddings)
+        count, dim = vectors.shape if vectors.ndim == 2 else (0, 0)
+
+        meta = {
+            "count": count,
+            "dim": dim,
+            "dtype": config.dtype,
+            "ivf_lists": 0,
+            "source": source,
+            "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        order = np.arange(count)
+        centroids = lists = None
+        if config.ivf_min_docs and count >= config.ivf_min_docs:
+            n_lists = config.ivf_lists or max(1, int(math.sqrt(count)))
+            centroids = _kmeans(vectors, n_lists)
+            assignment = _assign(vectors, centroids)
+            # 行按簇排序，每个簇在vectors中是连续的一段
+            order = np.argsort(assignment, kind="stable")
+            bounds = np.searchsorted(assignment[order], np.arange(n_lists + 1))
+            lists = np.stack([bounds[:-1], bounds[1:]], axis=1).astype(np.int64)
+            meta["ivf_lists"] = n_lists
+
+        version = f"{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        path = os.path.join(directory, version)
+        tmp_path = path + ".tmp"
+        os.makedirs(tmp_path, exist_ok=True)
+
+        np.save(os.path.join(tmp_path, "vectors.npy"), vectors[order].astype(config.dtype))
+        encoded = [ids[i].encode("utf-8") for i in order]
+        width = max((len(node_id) for node_id in encoded), default=1)
+        np.save(os.path.join(tmp_path, "ids.npy"), np.array(encoded, dtype=f"S{width}"))
+        offsets = np.zeros(count + 1, dtype=np.int64)
+        with open(os.path.join(tmp_path, "docs.jsonl"), "wb") as f:
+            for row, i in enumerate(order):
+                line = json.dumps({"text": documents[i], "metadata": metadatas[i]}, ensure_ascii=False)
+                f.write(line.encode("utf-8") + b"\n")
+                offsets[row + 1] = f.tell()
+        np.save(os.path.join(tmp_path, "offsets.npy"), offsets)
+        if centroids is not None:
+            np.save(os.path.join(tmp_path, "centroids.npy"), centroids)
+            np.save(os.path.join(tmp_path, "lists.npy"), lists)
+        with open(os.path.join(tmp_path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+        previous = cls.current_version(directory)
+        current_tmp = os.path.join(directory, "CURRENT.tmp")
+        with open(current_tmp, "w", encoding="utf-8") as f:
+            f.write(version)
+        os.replace(current_tmp, os.path.join(directory, "CURRENT"))
+        # 上一个版本可能仍被本进程或其他worker映射，留到下一次导出或启动时删除
+        cls.sweep(directory, keep=(previous,))
+        return cls(path, meta, config)
+
+    @classmethod
+    def export_collection(cls, collection, directory, config=None, source=None, batch_size=5000):
+        """从Chroma collection分批读取全部向量与文档，导出为新版本的快照"""
+        ids, embeddings, documents, metadatas = [], [], [], []
+        total = collection.count()
+        for offset in range(0, total, batch_size):
+            result = collection.get(
+                include=["embeddings", "documents", "metadatas"], limit=batch_size, offset=offset
+            )
+            ids += result["ids"]
+            embeddings += list(result["embeddings"])
+            documents += result["documents"]
+            metadatas += result["metadatas"]
+        return cls.build(directory, ids, np.asarray(embeddings), documents, metadatas, config, source)
+
+    # ---- 查询 ----
+
+    def record(self, row):
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        entry = json.loads(self._docs[start:end])
+        return self.ids[row].decode("utf-8"), entry["text"], entry["metadata"]
+
+    def _scores(self, queries, start=0, end=None):
+        """queries(Q×D)与vectors[start:end]的余弦相似度矩阵"""
+        end = len(self.ids) if end is None else end
+        if self.vectors.dtype == np.float32:
+            return queries @ self.vectors[start:end].T
+        scores = np.empty((len(queries), end - start), dtype=np.float32)
+        for chunk in range(start, end, _CHUNK_ROWS):
+            block = np.asarray(self.vectors[chunk : min(chunk + _CHUNK_ROWS, end)], dtype=np.float32)
+            scores[:, chunk - start : chunk - start + len(block)] = queries @ block.T
+        return scores
+
+    def _search_rows(self, queries, k):
+        """返回每个查询的 (行号数组, 相似度数组)"""
+        if self.centroids is None:
+            scores = self._scores(queries)
+            results = []
+            for row_scores in scores:
+                top = _top_k(row_scores, k)
+                results.append((top, row_scores[top]))
+            return results
+
+        results = []
+        nprobe = min(self.config.nprobe, len(self.centroids))
+        for query, centroid_scores in zip(queries, queries @ self.centroids.T):
+            rows, scores = [], []
+            for cluster in _top_k(centroid_scores, nprobe):
+                start, end = self.lists[cluster]
+                if end > start:
+                    rows.append(np.arange(start, end))
+                    scores.append(self._scores(query[None, :], start, end)[0])
+            rows = np.concatenate(rows) if rows else np.empty(0, dtype=np.int64)
+            scores = np.concatenate(scores) if scores else np.empty(0, dtype=np.float32)
+            top = _top_k(scores, k)
+            results.append((rows[top], scores[top]))
+        return results
+
+    def search_batch(self, embeddings, top_k):
+        """批量检索，返回与embeddings一一对应的NodeWithScore列表"""
+        queries = _normalize(np.atleast_2d(embeddings))
+        found = []
+        for rows, scores in self._search_rows(queries, top_k):
+            nodes = []
+            for row, score in zip(rows, scores):
+                node_id, text, metadata = self.record(int(row))
+                distance = max(0.0, 2.0 - 2.0 * float(score))
+                nodes.append(NodeWithScore(node=record_to_node(node_id, text, metadata), score=math.exp(-distance)))
+            found.append(nodes)
+        return found
+
+    def search(self, embedding, top_k):
+        return self.search_batch([embedding], top_k)[0]
+
+    def as_retriever(self, similarity_top_k):
+        return _Retriever(self, similarity_top_k)
+
+    def query(self, query_embeddings, n_results, include=("documents", "metadatas", "distances")):
+        """与Chroma collection.query相同的返回格式，批量检索可以不区分后端"""
+        result = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for rows, scores in self._search_rows(_normalize(np.atleast_2d(query_embeddings)), n_results):
+            records = [self.record(int(row)) for row in rows]
+            result["ids"].append([node_id for node_id, _, _ in records])
+            result["documents"].append([text for _, text, _ in records])
+            result["metadatas"].append([metadata for _, _, metadata in records])
+            result["distances"].append([max(0.0, 2.0 - 2.0 * float(score)) for score in scores])
+        return result
+
+    def get(self, include=("documents", "metadatas")):
+        """读取全部文档（与Chroma collection.get的格式相同），用于构建关键词索引"""
+        records = [self.record(row) for row in range(len(self.ids))]
+        return {
+            "ids": [node_id for node_id, _, _ in records],
+            "documents": [text for _, text, _ in records],
+            "metadatas": [metadata for _, _, metadata in records],
+        }
+
+    def close(self):
+        """释放文件映射，之后不能再查询"""
+        if isinstance(self._docs, mmap.mmap):
+            self._docs.close()
+        self.vectors = self.ids = self.offsets = None